@@ -1,10 +1,9 @@
 # from __future__ import annotations
 
+import argparse
 import os
 import sys
 
-from PyQt5.QtWidgets import QApplication
-
 cwd_was_sys32 = False
 if os.getcwd().lower() == r'c:\windows\system32'.lower():  # Bit of a hack, but if you have this, your fault
     cwd_was_sys32 = True
@@ -15,11 +14,14 @@ if os.getcwd().lower() == r'c:\windows\system32'.lower():  # Bit of a hack, but
         application_path = os.path.dirname(__file__)
     os.chdir(os.path.realpath(application_path))
 
-from core import GUI
 from utils import get_logger
 
 
 def main():
+    # Imported here, so batch mode works on machines without a display
+    from PyQt5.QtWidgets import QApplication
+    from core import GUI
+
     log = get_logger('Webber')
 
     app = QApplication(sys.argv)
@@ -36,6 +38,19 @@ def main():
 
     return exit_code
 
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='webber', description='Cut, crop and convert videos to a target size.')
+    parser.add_argument('--batch', metavar='JOBS',
+                        help='Run the jobs in a JSON or YAML file without the GUI, then exit.')
+    parser.add_argument('--destination', metavar='FOLDER',
+                        help='Output folder for batch jobs, defaults to the one picked in the GUI.')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Batch jobs to run at the same time.')
+    # Anything unknown is left for Qt
+    args, _ = parser.parse_known_args()
+    return args
+
 # TODO: Require picking a folder
 # TODO: Prevent start until all require options are there.
 
@@ -47,5 +62,10 @@ if __name__ == '__main__':
     if cwd_was_sys32:
         log.warning(f'Working dir was system32, changed to {os.getcwd()}')
 
-    exit_code = main()
+    args = parse_args()
+    if args.batch:
+        from batch import run_batch
+        exit_code = run_batch(args.batch, args.destination, args.jobs)
+    else:
+        exit_code = main()
     sys.exit(exit_code)
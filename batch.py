@@ -0,0 +1,163 @@
+import json
+import os
+import sys
+from collections import deque
+
+from PyQt5.QtCore import QCoreApplication
+
+from commands import JobBuilder, remove_pass_file
+from planner import BitratePlanner
+from probe import probe, resolution, duration, bit_depth, ProbeError
+from utils import get_logger, format_timestamp, FileHandler
+
+log = get_logger('Webber.Batch')
+
+# Values used for anything a job leaves out, matching the GUI defaults
+JOB_DEFAULTS = dict(
+    mode='convert',  # convert, cut or split
+    format='VP9',
+    size=8,  # MB, or a list of sizes
+    sound=False,
+    merge_audio=False,
+    audio_bitrate=320,
+    multiplier='1.0',
+    crop=None,  # [x, y, width, height] in pixels
+    chunked=False,
+    quality=False,
+    overwrite=False,
+)
+
+
+def load_jobs(path):
+    """ Reads a job list, either a plain list or a mapping with a 'jobs' list, from JSON or YAML. """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit('PyYAML is needed to read YAML job files, install it or use JSON.')
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+
+    if isinstance(data, dict):
+        data = data.get('jobs', [])
+    return data
+
+
+def _timestamp(value):
+    """ Jobs can give times in seconds, or in the mm:ss.ms format of the GUI. """
+    if isinstance(value, (int, float)):
+        return format_timestamp(value * 1000)
+    return str(value)
+
+
+def job_state(job: dict, destination):
+    """ Turns a job from the job list into the same state the GUI builds from its fields. """
+    job = {**JOB_DEFAULTS, **job}
+    if 'file' not in job:
+        raise KeyError('Job has no "file"')
+
+    file_name = os.path.abspath(job['file'])
+    info = probe(file_name)
+    total = duration(info) or 0
+    sizes = job['size'] if isinstance(job['size'], list) else [job['size']]
+
+    return dict(
+        mode=job['mode'],
+        ts_start=_timestamp(job.get('start', 0)),
+        ts_end=_timestamp(job.get('end', total)),
+        filename=file_name,
+        merge_audio=job['merge_audio'],
+        chunked=job['chunked'],
+        quality=job['quality'],
+        target_sizes=[float(i) for i in sizes],
+        filetype=job['format'],
+        target_name=job.get('name', os.path.splitext(os.path.basename(file_name))[0]),
+        multiplier=str(job['multiplier']),
+        crop_area=tuple(job['crop']) if job['crop'] else None,
+        sound=job['sound'],
+        audio_bitrate=job['audio_bitrate'],
+        destination=job.get('destination', destination),
+        resolution=resolution(info),
+        bit_depth=bit_depth(info),
+        source_duration=total,
+        overwrite=job['overwrite'],
+    )
+
+
+def run_batch(path, destination=None, max_jobs=None):
+    """ Runs every job in a job list, and returns 0 if they all finished without errors. """
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+
+    settings = FileHandler().load_settings()
+    destination = destination or settings['destination'] or os.getcwd()
+    if not max_jobs:
+        max_jobs = settings['max_jobs'] or max(1, (os.cpu_count() or 1) // 8)
+
+    current = {}
+    builder = JobBuilder(BitratePlanner(),
+                         lambda question, *_: bool(current.get('overwrite')) if question == 'overwrite' else False,
+                         lambda title, text, info: log.error(f'{title} {text} {info}'),
+                         settings)
+
+    pending = deque()
+    results = {}
+    failed = 0
+    for idx, job in enumerate(load_jobs(path), 1):
+        try:
+            current.clear()
+            current.update(job_state(job, destination))
+            state = builder.prepare(dict(current))
+            process, passfile = builder.build(state)
+        except (InterruptedError, ProbeError, OSError, KeyError, ValueError) as e:
+            log.error(f'Skipping job {idx}: {e}')
+            failed += 1
+            continue
+
+        process.done.connect(lambda code, p=process: results.__setitem__(p, code))
+        process.progress.connect(lambda items, p=process: _log_progress(p, items))
+        if passfile is not None:
+            process.done.connect(lambda _, f=passfile: remove_pass_file(f))
+        if state.get('plans'):
+            process.done.connect(lambda code, p=process, plans=state['plans']: builder.record_sizes(code, plans, p))
+        pending.append(process)
+
+    log.info(f'Running {len(pending)} job(s), {max_jobs} at a time')
+    active = []
+    while pending or active:
+        while pending and len(active) < max_jobs:
+            process = pending.popleft()
+            process.set_thread_budget(max(1, (os.cpu_count() or 1) // max_jobs))
+            log.info(f'Starting {process.name}')
+            process.start()
+            active.append(process)
+
+        for process in active:
+            process.wait(200)
+        app.processEvents()
+
+        for process in [i for i in active if i.isFinished()]:
+            # Delivers the done signal
+            app.processEvents()
+            active.remove(process)
+            code = results.get(process, 1)
+            if code:
+                failed += 1
+            log.info(f'{process.name} finished with code {code}')
+
+    log.info(f'Batch done, {failed} job(s) failed')
+    return 1 if failed else 0
+
+
+_last_logged = {}
+
+
+def _log_progress(process, items):
+    percent = items.get('percent')
+    if percent is None:
+        return
+    step = (items['pass'], percent // 10)
+    if _last_logged.get(process) != step:
+        _last_logged[process] = step
+        log.info(f'{process.name}: pass {items["pass"]} of {items["passes"]}, {percent}%')
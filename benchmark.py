@@ -0,0 +1,192 @@
+"""
+Offline benchmark of the encoder presets in formats.py.
+Generates the same test clips with ffmpeg's lavfi sources every time, encodes them with every preset at
+a few target sizes, and reports speed, size and quality, so preset changes can be compared between releases.
+
+    python benchmark.py [--sizes 2 4 8] [--presets VP9 AV1] [--override tweaks.json] [--output results.json]
+
+Overrides are extra presets on top of an existing one, changed the same way as with the Tweaker dialog:
+
+    {"VP9 cpu-used 2": {"base": "VP9", "first": {"-cpu-used": "2"}, "second": {"-cpu-used": "2"}}}
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from batch import job_state
+from commands import JobBuilder
+from formats import format_spec, encoding, passes
+from planner import BitratePlanner
+from utils import get_logger, FileHandler
+
+log = get_logger('Webber.Benchmark')
+
+WIDTH, HEIGHT, RATE = 1280, 720, 30
+DURATION = 10
+
+# Deterministic lavfi graphs, from easy to hard to compress
+SOURCES = {
+    'screen': f"color=c=white:s={WIDTH}x{HEIGHT}:r={RATE},drawgrid=w=80:h=24:t=1:c=gray[grid];"
+              f"color=c=blue:s=320x180:r={RATE}[box];"
+              f"[grid][box]overlay=x='mod(t*160,W)':y=200:shortest=1[out0]",
+    'testsrc2': f'testsrc2=s={WIDTH}x{HEIGHT}:r={RATE}',
+    'mandelbrot': f'mandelbrot=s={WIDTH}x{HEIGHT}:r={RATE}',
+    'noise': f'color=c=gray:s={WIDTH}x{HEIGHT}:r={RATE},noise=alls=60:allf=t+u',
+}
+SIZES = [2.0, 4.0, 8.0]
+
+
+def make_source(name, graph, work_dir, duration=DURATION):
+    """ Renders a lavfi graph to a lossless clip, which is what the encoders read. """
+    path = os.path.join(work_dir, f'{name}.mkv')
+    command = ['ffmpeg', '-hide_banner', '-nostdin', '-y', '-v', 'error',
+               '-f', 'lavfi', '-i', graph, '-t', str(duration), '-c:v', 'ffv1', '-pix_fmt', 'yuv420p', path]
+    subprocess.run(command, check=True)
+    return path
+
+
+def load_overrides(path):
+    """ Reads extra presets, given as option: value pairs that replace the ones of their base preset. """
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    presets = {}
+    for name, tweaks in data.items():
+        base = format_spec[tweaks.get('base', 'VP9')]
+        changed = []
+        for options, key in zip(base.commands, ('all', 'first', 'second')):
+            pairs = dict(zip(options[::2], options[1::2]))
+            pairs.update(tweaks.get(key, {}))
+            changed.append([item for pair in pairs.items() for item in pair])
+        presets[name] = encoding(base.ext, base.f, passes(*changed), base.two_pass)
+    return presets
+
+
+def _run_pass(command, frames):
+    start = time.perf_counter()
+    subprocess.run(['ffmpeg', *command], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    elapsed = time.perf_counter() - start
+    return elapsed, frames / elapsed if elapsed else 0.0
+
+
+def quality(out_path, source_path):
+    """ Returns the SSIM and PSNR of an encode against its source. """
+    graph = '[0:v]split[a][b];[1:v]split[c][d];[a][c]ssim;[b][d]psnr'
+    command = ['ffmpeg', '-hide_banner', '-nostdin', '-i', out_path, '-i', source_path,
+               '-lavfi', graph, '-f', 'null', '-']
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    output = result.stderr.decode('utf-8', 'replace')
+
+    ssim = re.search(r'SSIM .*All:([\d.]+)', output)
+    psnr = re.search(r'PSNR .*average:([\d.]+|inf)', output)
+    return (float(ssim.group(1)) if ssim else None,
+            float(psnr.group(1)) if psnr else None)
+
+
+def run_case(builder, source, source_path, preset, size, work_dir, duration=DURATION):
+    """ Encodes one source with one preset at one size, using the same commands as the GUI. """
+    job = dict(file=source_path, format=preset, size=size, name=f'{source}_{preset}_{size:g}MB'.replace(' ', '_'))
+    state = builder.prepare(job_state(job, work_dir))
+    commands, _, _, passfile = builder.conversion_commands(state)
+
+    frames = duration * RATE
+    result = dict(source=source, preset=preset, target_mb=size, bitrate_kbps=state['plans'][0][2])
+    start = time.perf_counter()
+    for idx, command in enumerate(commands, 1):
+        elapsed, fps = _run_pass(command, frames)
+        result[f'pass{idx}_seconds'] = round(elapsed, 2)
+        result[f'pass{idx}_fps'] = round(fps, 2)
+    result['wall_seconds'] = round(time.perf_counter() - start, 2)
+
+    out_path = commands[-1][-1]
+    achieved = os.path.getsize(out_path)
+    result['size_mb'] = round(achieved / 1024 ** 2, 3)
+    result['size_ratio'] = round(achieved / (size * 1024 ** 2), 4)
+    result['ssim'], result['psnr'] = quality(out_path, source_path)
+
+    for file in os.listdir('.') if passfile else ():
+        if file.startswith(passfile) and file.endswith('.log'):
+            os.remove(file)
+    os.remove(out_path)
+    return result
+
+
+def format_table(results):
+    columns = [('source', 'Source', '{}'), ('preset', 'Preset', '{}'), ('target_mb', 'Target MB', '{:g}'),
+               ('size_mb', 'Size MB', '{:.2f}'), ('size_ratio', 'Of target', '{:.1%}'),
+               ('pass1_fps', 'Pass 1 fps', '{:.1f}'), ('pass2_fps', 'Pass 2 fps', '{:.1f}'),
+               ('wall_seconds', 'Wall s', '{:.1f}'), ('ssim', 'SSIM', '{:.4f}'), ('psnr', 'PSNR', '{:.2f}')]
+    rows = [[title for _, title, _ in columns]]
+    for result in results:
+        rows.append([fmt.format(result[key]) if result.get(key) is not None else '-' for key, _, fmt in columns])
+
+    widths = [max(len(row[idx]) for row in rows) for idx in range(len(columns))]
+    lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+def run_benchmark(presets=None, sizes=SIZES, sources=None, duration=DURATION):
+    """ Runs every preset on every source and size, and returns a list of results. """
+    presets = presets or dict(format_spec)
+    sources = sources or list(SOURCES)
+    settings = FileHandler().load_settings()
+    work_dir = tempfile.mkdtemp(prefix='webber_bench_')
+
+    # An empty history, so every run plans the same bitrates
+    builder = JobBuilder(BitratePlanner(os.path.join(work_dir, 'history.jsonl')),
+                         lambda *_: False, lambda *args: log.error(' '.join(args)), settings)
+
+    # Presets are looked up by name, so overrides are added for the duration of the run
+    original = dict(format_spec)
+    format_spec.update(presets)
+    results = []
+    try:
+        for source in sources:
+            log.info(f'Generating {source}')
+            source_path = make_source(source, SOURCES[source], work_dir, duration)
+            for preset in presets:
+                for size in sizes:
+                    log.info(f'Encoding {source} with {preset} at {size:g} MB')
+                    try:
+                        results.append(run_case(builder, source, source_path, preset, size, work_dir, duration))
+                    except (subprocess.CalledProcessError, InterruptedError, OSError) as e:
+                        log.error(f'{source}/{preset}/{size:g} MB failed: {e}')
+                        results.append(dict(source=source, preset=preset, target_mb=size, error=str(e)))
+    finally:
+        format_spec.clear()
+        format_spec.update(original)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Webber encoder presets.')
+    parser.add_argument('--sizes', type=float, nargs='+', default=SIZES, help='Target sizes in MB.')
+    parser.add_argument('--presets', nargs='+', default=None, help='Presets to run, defaults to all.')
+    parser.add_argument('--sources', nargs='+', choices=list(SOURCES), default=None)
+    parser.add_argument('--duration', type=float, default=DURATION, help='Length of the test clips in seconds.')
+    parser.add_argument('--override', metavar='JSON', help='Extra presets, see the module docstring.')
+    parser.add_argument('--output', metavar='JSON', help='Where to save the results.')
+    args = parser.parse_args(argv)
+
+    presets = {name: format_spec[name] for name in (args.presets or format_spec)}
+    if args.override:
+        presets.update(load_overrides(args.override))
+
+    results = run_benchmark(presets, args.sizes, args.sources, args.duration)
+    print(format_table(results))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(dict(time=int(time.time()), results=results), f, indent=2)
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+
+from frameindex import cached_index
+from probe import probe, start_time, ProbeError
+from utils import get_logger, remove_option
+
+log = get_logger('Webber.Chunking')
+
+# Chunks shorter than this waste too much on the forced keyframe and encoder warmup.
+MIN_CHUNK_LENGTH = 10.0
+# Longest chunk in resumable mode, which is the most work lost when a job is interrupted.
+RESUME_CHUNK_LENGTH = 60.0
+# Work folders of resumable jobs that were never finished are removed after this many seconds.
+RESUME_MAX_AGE = 7 * 24 * 3600
+MANIFEST_FILE = 'manifest.json'
+# Left out of the job key, as the planned bitrate can change between runs. The manifest keeps the first one.
+RATE_OPTIONS = ('-b:v', '-maxrate', '-bufsize')
+
+
+def find_keyframes(file_name, start, end, offset=None):
+    """
+    Returns the timestamps (in seconds) of the video keyframes between start and end.
+    Times are relative to the start of the file like -ss and -to, offset is its start time, probed if not given.
+    Only reads packet headers, so there is no decoding involved. Uses the frame index if it's cached.
+    """
+    index = cached_index(file_name)
+    if index is not None:
+        return index.keyframes_between(start, end)
+
+    if offset is None:
+        try:
+            offset = start_time(probe(file_name))
+        except ProbeError as e:
+            log.error(f'Failed to probe start time: {e}')
+            offset = 0.0
+
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+               '-read_intervals', f'{start + offset}%{end + offset}',
+               '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0',
+               file_name]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        log.error(f'Failed to find keyframes: {e}')
+        return []
+
+    keyframes = []
+    for line in result.stdout.decode('utf-8', 'replace').splitlines():
+        pts, _, flags = line.partition(',')
+        if 'K' not in flags:
+            continue
+        try:
+            pts = float(pts) - offset
+        except ValueError:
+            continue
+        if start < pts < end:
+            keyframes.append(pts)
+
+    keyframes.sort()
+    return keyframes
+
+
+def write_concat_list(list_file, files):
+    """ Writes the file list of the concat demuxer, which reads paths between single quotes. """
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for file in files:
+            quoted = file.replace("'", "'\\''")
+            f.write(f"file '{quoted}'\n")
+
+
+def plan_chunks(start, end, keyframes, count, min_length=MIN_CHUNK_LENGTH):
+    """
+    Splits the range start-end in up to count chunks of roughly equal length.
+    Boundaries are moved to the nearest keyframe, which is usually a scene cut in game recordings,
+    and when no keyframes are known the range is split evenly.
+    """
+    duration = end - start
+    count = max(1, min(count, int(duration // min_length)))
+    if count == 1:
+        return [(start, end)]
+
+    length = duration / count
+    boundaries = [start]
+    for i in range(1, count):
+        ideal = start + i * length
+        if keyframes:
+            point = min(keyframes, key=lambda k: abs(k - ideal))
+        else:
+            point = ideal
+
+        # Skip boundaries that would make tiny chunks after snapping
+        if point - boundaries[-1] >= min_length / 2 and end - point >= min_length / 2:
+            boundaries.append(point)
+    boundaries.append(end)
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def work_key(file_name, commands, audio=None):
+    """
+    Key of a chunked job, so the same job queued again, or restored after a crash, finds its finished chunks.
+    Changes to the source file, the commands or the audio settings give a new key, but not the rate options.
+    """
+    try:
+        stat = os.stat(file_name)
+        source = [os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        source = [os.path.abspath(file_name)]
+
+    # Pass logs are renamed for every chunk, so the random name from the job doesn't matter
+    commands = [remove_option(list(command), '-passlogfile') for command in commands]
+    for command in commands:
+        for option in RATE_OPTIONS:
+            remove_option(command, option)
+    payload = json.dumps([source, commands, audio])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def load_manifest(work_dir, key):
+    """ Returns the manifest of a work folder, or None if there is none for this key. """
+    try:
+        with open(os.path.join(work_dir, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('key') != key:
+        return None
+    return manifest
+
+
+def save_manifest(work_dir, manifest):
+    """ Replaces the manifest in one step, so a crash leaves either the old or the new one. """
+    path = os.path.join(work_dir, MANIFEST_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def sync_file(path):
+    """ Makes sure a finished chunk is on disk before the manifest says it is. """
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def prune_work_dirs(root, max_age=RESUME_MAX_AGE, keep=None):
+    """ Removes work folders of resumable jobs that haven't been touched for max_age seconds. """
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    limit = time.time() - max_age
+    for name in names:
+        path = os.path.join(root, name)
+        if name == keep or not os.path.isdir(path):
+            continue
+        try:
+            if os.path.getmtime(path) < limit:
+                log.info(f'Removing old resume folder {path}')
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            continue
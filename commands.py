@@ -0,0 +1,443 @@
+import os
+import re
+import tempfile
+import textwrap
+import time
+import uuid
+from copy import deepcopy
+
+from formats import format_spec
+from planner import plan_key
+from smartcut import SmartCut
+from telemetry import JobTelemetry
+from tuning import tune_encoding
+from utils import get_logger, set_option, remove_option, format_timestamp, get_millisecond_time
+from worker import Conversion, ChunkedConversion, QualityConversion
+
+log = get_logger('Webber.Commands')
+
+
+class JobBuilder:
+    """
+    Turns the state of a job into ffmpeg commands and a conversion, without touching any widgets.
+    Shared by the GUI and the headless batch mode.
+
+    The state holds the same values as the GUI fields, see GUI.load_options.
+    Questions go through ask(question, title, text, info) -> bool, where a True answer means "Yes",
+    and question is one of 'overwrite', 'low_bitrate' and 'sound_multiplier'.
+    Errors are shown with alert(title, text, info), and then raised as InterruptedError.
+    """
+
+    def __init__(self, planner, ask, alert, settings):
+        self.planner = planner
+        self.ask = ask
+        self.alert = alert
+        self.settings = settings
+
+    def _fail(self, title, text, info, reason):
+        self.alert(title, text, info)
+        raise InterruptedError(reason)
+
+    def prepare(self, state):
+        """ Validates a state, and adds the start/end times adjusted for the length multiplier. """
+        if not state['target_sizes']:
+            self._fail('No target size!', 'The target size is not set!', '', 'No target size')
+        state['target_size'] = state['target_sizes'][0]
+        # Several sizes share one first pass instead, and single pass formats have no passes to split or replace
+        two_pass = format_spec[state['filetype']].two_pass if state['filetype'] in format_spec else True
+        state['chunked'] = state['chunked'] and len(state['target_sizes']) == 1 and two_pass
+        state['quality'] = state.get('quality', False) and len(state['target_sizes']) == 1 and not state['chunked'] \
+            and two_pass
+
+        valid_name = re.match(r'(^ *$)', state['filename']) is None
+        if not valid_name:
+            self._fail('No Target file!', 'The target filename is not selected or incorrect!', '',
+                       'Filename not valid')
+
+        stamp = 'start'
+        try:
+            start = format_timestamp(get_millisecond_time(state['ts_start']) * float(state['multiplier']))
+            state['start'] = start
+            stamp = 'end'
+            end = format_timestamp(get_millisecond_time(state['ts_end']) * float(state['multiplier']))
+            state['end'] = end
+        except Exception:
+            self._fail('Invalid timestamp',
+                       f'The {stamp} timestamp is not valid!',
+                       f'"{state[f"ts_{stamp}"]}" is not valid for Webber!',
+                       'Timestamp not valid')
+
+        log.debug(textwrap.dedent(f"""
+        File: {state["filename"]}
+        Target name: {state["target_name"]}
+        Target size: {state['target_size']}
+        Target filetype: {state["filetype"]}
+        Length multiplier: {state["multiplier"]}
+        Audio bitrate: {state["audio_bitrate"]}
+        """))
+
+        return state
+
+    def split_commands(self, state):
+        """
+        Generates the command for splitting file into 3 parts.
+        There the cut points are start/end mark. The segment muxer writes all parts from a single
+        read of the input, instead of one process per part each reading the file from the start.
+        If the video is not cropped, there is no reencoding.
+        """
+        start = get_millisecond_time(state['ts_start']) / 1000
+        end = get_millisecond_time(state['ts_end']) / 1000
+
+        if state["crop_area"] is not None:
+            x, y, w, h = (int(i) for i in state["crop_area"])
+            # TODO: Use regular encoding options here.
+            # Segments can only start on a keyframe, so they're placed on the cut points
+            conversion_style = ['-crf', '18', '-filter:v', f'crop={w}:{h}:{x}:{y}',
+                                '-force_key_frames', f'{start:.3f},{end:.3f}']
+        else:
+            conversion_style = ['-vcodec', 'copy']
+
+        if state['sound']:
+            conversion_style.extend(['-acodec', 'copy'])
+        else:
+            conversion_style.extend(['-an'])
+
+        command = ['-hide_banner', '-nostdin', '-i', f'{state["filename"]}', '-y', '-strict', '-2']
+        command.extend(conversion_style)
+        # A cut at 0 would not give an empty first part, the segment muxer would fill it from the next one.
+        # Without it, numbering starts at 1, so the part between the marks is trim_1 either way.
+        times = [point for point in (start, end) if point > 0]
+        command.extend(['-f', 'segment', '-segment_times', ','.join(f'{point:.3f}' for point in times),
+                        '-segment_start_number', '0' if start > 0 else '1', '-reset_timestamps', '1',
+                        '-segment_format', 'mp4'])
+        command.append(os.path.join(state['destination'], 'trim_%d.mp4'))
+
+        total = state['source_duration'] or end
+        return [command], f'Cutting {state["filename"].split("/")[-1]}', total
+
+    def cut_commands(self, state):
+        """
+        Generates command for splitting a file like the regular option.
+        If the video is not cropped, there is no reencoding.
+        """
+        out_path = os.path.join(state['destination'], state['target_name'] + '.mp4')
+
+        if os.path.isfile(out_path):
+            if not self.ask('overwrite', 'Warning!', 'File already exists!', 'Do you want to overwrite it?'):
+                raise InterruptedError('Can\'t overwrite file!')
+
+        command = list()
+
+        command.extend(
+            ['-hide_banner', '-nostdin', '-y',
+             '-i', f'{state["filename"]}',
+             '-ss', f'{state["ts_start"]}',
+             '-to', f'{state["ts_end"]}'])
+
+        if state["crop_area"] is not None:
+            x, y, w, h = (int(i) for i in state["crop_area"])
+            # TODO: Use regular encoding options here.
+
+            command.extend(['-crf', '18', '-filter:v', f'crop={w}:{h}:{x}:{y}', '-acodec', 'copy'])
+        else:
+            command.extend(['-vcodec', 'copy'])
+
+        if state['sound']:
+            command.extend(['-acodec', 'copy'])
+        else:
+            command.extend(['-an'])
+
+        command.append(f'{out_path}')
+
+        duration = (get_millisecond_time(state['ts_end']) - get_millisecond_time(state['ts_start'])) / 1000
+        return [command], state["filename"], duration
+
+    def conversion_commands(self, state, queued=()):
+        """
+        Generates the two pass encode of the regular option.
+        Several target sizes share the first pass, and get a second pass each that run side by side.
+        Queued is the names of the jobs already in the queue, to warn about overwriting them.
+        """
+        encoding = format_spec[state["filetype"]]
+
+        rand_passfilename = f'ffmpeg2pass{str(time.time())[-5:]}'
+
+        sizes = state['target_sizes']
+        if len(sizes) > 1:
+            names = [f'{state["target_name"]}_{size:g}MB' for size in sizes]
+        else:
+            names = [state["target_name"]]
+        out_paths = [os.path.join(state['destination'], name + '.' + encoding.ext) for name in names]
+        out_path = out_paths[0]
+
+        if any(os.path.isfile(path) or name + '.' + encoding.ext in queued for name, path in zip(names, out_paths)):
+            if not self.ask('overwrite', 'Warning!', 'File already exists or is in the queue!',
+                            'Do you want to overwrite it?'):
+                raise InterruptedError('Can\'t overwrite file!')
+
+        t0 = get_millisecond_time(state["start"]) / 1000
+        tf = get_millisecond_time(state["end"]) / 1000
+
+        duration = tf - t0  # In seconds!
+        if duration <= 0:
+            self._fail('Timestamps are incorrect!', 'The end timestamp is before the start timestamp!', '',
+                       'Too small target filesize, too low bitrate')
+
+        if state["crop_area"] is not None:
+            out_resolution = state["crop_area"][2:]
+        else:
+            out_resolution = state['resolution']
+        key = plan_key(state["filetype"], encoding, out_resolution)
+        encoding = tune_encoding(state["filetype"], encoding, out_resolution, state.get('bit_depth'))
+        bitrates = [self.video_bitrate(state, size, duration, key) for size in sizes]
+        video_bitrate = bitrates[0]
+        audio_bitrate = state['audio_bitrate'] if state['sound'] else 0
+        # Used to learn how close the encoder got, once the job is done
+        state['plans'] = [(key, size, bitrate, duration, audio_bitrate, path)
+                          for size, bitrate, path in zip(sizes, bitrates, out_paths)]
+
+        log.debug(textwrap.dedent(f"""
+                            Working dir: {os.getcwd()}
+                            Target bitrate: {video_bitrate} kbps
+                            Target destination: {out_path}
+                            Start: {state['ts_start']} ({t0:.3f} seconds)
+                            Start: {state['ts_end']} ({tf:.3f} seconds)
+                            """))
+        commands = []
+
+        command_1 = []
+        command_2 = []
+
+        def convert_to_h(string):
+            parts = string.split(':')
+            if int(parts[0]) > 59:
+                return ':'.join([str(int(parts[0]) // 60), str(int(parts[0]) % 60)] + parts[1:])
+            else:
+                return string
+
+        start_formatted = convert_to_h(state["start"])
+        end_formatted = convert_to_h(state["end"])
+        checked = False
+
+        for p, i in enumerate([command_1, command_2]):
+            i.append('-hide_banner')
+            i.append('-nostdin')
+
+            i.extend(['-y'])
+
+            # TODO: Make this option??
+            # i.extend(['-hwaccel', 'cuda'])
+            if state["start"] != '':
+                i.extend(['-ss', f'{start_formatted}'])
+            if state["end"] != '':
+                i.extend(['-to', f'{end_formatted}'])
+
+            i.extend(['-i', f'{state["filename"]}'])
+
+            i.extend(['-map', '0:v:0', '-map', '0:s?'])
+
+            i.extend(encoding.commands.all)
+
+            if p == 0:
+                i.extend(encoding.commands.first)
+            elif p == 1:
+                i.extend(encoding.commands.second)
+
+            i.extend(['-b:v', f'{video_bitrate:.2f}k',
+                      '-maxrate', f'{video_bitrate:.2f}k',
+                      '-bufsize', f'{video_bitrate * 4:.2f}k'
+                      ])
+
+            if state['sound'] and p == 1:
+                if state['merge_audio']:
+                    audio = ['-filter_complex', '[0:a:0][0:a:1]amerge=inputs=2[a]', '-map', "[a]",
+                             '-c:a', 'libopus', '-ac', '2', '-b:a', f'{state["audio_bitrate"]}k']
+                else:
+                    audio = ['-map', '0:a?', '-c:a', 'libopus', '-b:a', f'{state["audio_bitrate"]}k']
+
+                # Chunks are encoded without sound, the audio is encoded once and muxed in at the end.
+                if state['chunked']:
+                    state['audio'] = audio
+                    command_2.append('-an')
+                else:
+                    command_2.extend(audio)
+
+                if float(state["multiplier"]) != 1 and not checked:
+                    if self.ask('sound_multiplier', 'Warning!',
+                                'No sound allowed with changed duration!\n'
+                                'Ignoring the duration change.',
+                                'Do you want to stop encoding?'):
+                        raise InterruptedError('Stopped on command!')
+                    state["multiplier"] = 1
+                    checked = True  # In multi pass, this prevents repeatedly asking
+            elif p == 1:
+                command_2.append('-an')
+            elif p == 0:
+                command_1.append('-an')
+
+            if state["crop_area"] is not None:
+                x = state["crop_area"][0]
+                y = state["crop_area"][1]
+                w = state["crop_area"][2]
+                h = state["crop_area"][3]
+                crop = f'crop={w}:{h}:{x}:{y}'
+            else:
+                crop = ''
+
+            if state["multiplier"]:
+                if crop:
+                    crop = ',' + crop
+                i.extend(['-filter:v', f'setpts={state["multiplier"]}*PTS{crop}'])
+
+            elif crop:
+                i.extend(['-filter:v', crop])
+
+        if encoding.two_pass:
+            command_1.extend(['-f', f'{encoding.f}', '-passlogfile', f'{rand_passfilename}', '-pass', '1',
+                              os.devnull])
+            command_2.extend(['-f', f'{encoding.f}', '-passlogfile', f'{rand_passfilename}', '-pass', '2',
+                              '-metadata', f'title={state["target_name"]}'])
+            commands.append(command_1)
+            passfile = rand_passfilename
+        else:
+            # A single VBR pass, the max rate is only for the constrained second pass of two-pass encoders
+            remove_option(command_2, '-maxrate')
+            remove_option(command_2, '-bufsize')
+            command_2.extend(['-f', f'{encoding.f}', '-metadata', f'title={state["target_name"]}'])
+            passfile = None
+
+        # com_2.extend(['-vf', f'minterpolate=fps={fps}:mi_mode=mci:mc_mode=aobmc:me=umh:vsbmc=1'])
+
+        command_2.append(f'{out_path}')
+
+        if len(sizes) == 1:
+            commands.append(command_2)
+            return commands, state['target_name'] + '.' + encoding.ext, duration, passfile
+
+        # The first pass does not depend on the bitrate, so every size shares it,
+        # and the second passes (or single passes) run side by side.
+        second_passes = []
+        for name, path, bitrate in zip(names, out_paths, bitrates):
+            command = list(command_2)
+            set_option(command, '-b:v', f'{bitrate:.2f}k')
+            if encoding.two_pass:
+                set_option(command, '-maxrate', f'{bitrate:.2f}k')
+                set_option(command, '-bufsize', f'{bitrate * 4:.2f}k')
+            set_option(command, '-metadata', f'title={name}')
+            command[-1] = path
+            second_passes.append(command)
+
+        commands.append(second_passes)
+        name = f'{state["target_name"]} ({", ".join(f"{size:g}" for size in sizes)} MB).{encoding.ext}'
+        return commands, name, duration, passfile
+
+    def video_bitrate(self, state, target_size, duration, key):
+        audio_bitrate = state['audio_bitrate'] if state['sound'] else 0
+        video_bitrate = self.planner.plan(target_size, duration, audio_bitrate, key)
+
+        if video_bitrate < 1:
+            self._fail('Target size too small!', 'The video is too long for the target bitrate!', '',
+                       'Too small target filesize, too low bitrate')
+        elif video_bitrate < 512:
+            if self.ask('low_bitrate', 'Warning!',
+                        f'The bitrate for {target_size:g} MB is very low, and will probably not work well.',
+                        'Do you want to stop encoding?'):
+                raise InterruptedError('Stopped on command! Too low bitrate selected.')
+        return video_bitrate
+
+    def build(self, state, queued=()):
+        """
+        Creates the conversion for a prepared state.
+        Returns the conversion, and the pass log file it leaves behind (if any).
+        """
+        passfile = None
+        if state['mode'] == 'split':
+            commands, name, duration = self.split_commands(state)
+        elif state['mode'] == 'cut':
+            commands, name, duration = self.cut_commands(state)
+        else:
+            commands, name, duration, passfile = self.conversion_commands(state, queued)
+
+        for stage in commands:
+            for command in (stage if isinstance(stage[0], list) else [stage]):
+                log.debug(' '.join(command))
+
+        record = dict(
+            id=uuid.uuid4().hex[:12],
+            kind=self._kind(state, passfile),
+            commands=commands,
+            target_name=name,
+            file_name=state['filename'],
+            duration=duration,
+            audio=state.get('audio'),
+            targets={plan[-1]: plan[1] * 1024 ** 2 for plan in state.get('plans', [])},
+            margin=self.settings['size_margin'],
+            passfile=passfile,
+            plans=state.get('plans', []),
+            intermediate_dir=(self.settings['intermediate_dir'] or tempfile.gettempdir())
+            if self.settings['intermediate'] else None,
+            # Frames in the output, known when the source is indexed
+            frames=state.get('frames') if state['mode'] == 'convert' else None,
+            # What the telemetry history is grouped by
+            preset=state['filetype'],
+            resolution=state['resolution'],
+        )
+        return job_from_record(record), passfile
+
+    def _kind(self, state, passfile):
+        if state['mode'] == 'cut' and self.settings['smart_cut']:
+            return 'smartcut'
+        if passfile is not None and state['chunked']:
+            return 'chunked'
+        if passfile is not None and state['quality']:
+            return 'quality'
+        return 'conversion'
+
+    def record_sizes(self, code, plans, process):
+        """
+        Adds the finished outputs of a conversion to the bitrate planner's history.
+        Quality jobs that used a CRF encode are left out, they come in under the planned size on purpose.
+        """
+        if code or getattr(process, 'crf', None) is not None:
+            return
+        overrides = getattr(process, 'bitrate_overrides', {})
+        for key, size, bitrate, duration, audio_bitrate, path in plans:
+            bitrate = overrides.get(path, bitrate)
+            self.planner.record(key, size, bitrate, duration, audio_bitrate, path)
+
+
+def job_from_record(record: dict):
+    """
+    Creates the conversion described by a job record. Records only hold plain values,
+    so they can be saved, and the conversion recreated after a restart.
+    The record is kept on the conversion as process.record.
+    """
+    commands = deepcopy(record['commands'])
+    if record['kind'] == 'chunked':
+        process = ChunkedConversion(commands=commands, target_name=record['target_name'],
+                                    file_name=record['file_name'], duration=record['duration'],
+                                    audio=record.get('audio'))
+    elif record['kind'] == 'smartcut':
+        process = SmartCut(commands=commands, target_name=record['target_name'], file_name=record['file_name'],
+                           duration=record['duration'])
+    elif record['kind'] == 'quality':
+        process = QualityConversion(commands=commands, target_name=record['target_name'],
+                                    file_name=record['file_name'], duration=record['duration'],
+                                    targets=record.get('targets'), margin=record.get('margin', 0.1))
+    else:
+        process = Conversion(commands=commands, target_name=record['target_name'], file_name=record['file_name'],
+                             duration=record['duration'], targets=record.get('targets'),
+                             margin=record.get('margin', 0.1), intermediate_dir=record.get('intermediate_dir'),
+                             frames=record.get('frames'))
+    process.record = record
+    process.telemetry = JobTelemetry(record)
+    process.progress.connect(process.telemetry.sample)
+    process.done.connect(process.telemetry.finish)
+    return process
+
+
+def remove_pass_file(passlogfile):
+    for file in os.listdir('.'):
+        if file.startswith(str(passlogfile)) and file.endswith('.log'):
+            os.remove(file)
+            break
@@ -1,8 +1,8 @@
+import math
 import os
 import re
 import sys
 import textwrap
-import time
 import traceback
 from collections import deque
 
@@ -13,9 +13,21 @@ from PyQt5.QtMultimedia import QMediaContent
 from PyQt5.QtWidgets import *
 
 from formats import format_spec, Tweaker
+from commands import JobBuilder, remove_pass_file, job_from_record
+from journal import JobJournal
+from planner import BitratePlanner
 from player_widget import VideoWindow
-from utils import get_logger, color_text, FileHandler, get_stylesheet, find_file
-from worker import Conversion
+from probe import ProbeTask, resolution, bit_depth, duration, audio_streams, framerate
+from frameindex import IndexTask, cached_index
+from ingest import Ingest, SourceList
+from queueview import QueueModel, QueueView, RUNNING, PAUSED, REFRESH_MS
+from telemetry import format_eta
+from metrics import MetricsState, MetricsServer
+from thumbnails import ThumbnailTask, Filmstrip, cached_sheet
+from proxy import ProxyTask, cached_proxy, is_heavy
+from waveform import WaveformTask, cached_waveform, available as waveform_available
+from utils import get_logger, color_text, FileHandler, get_stylesheet, find_file, format_timestamp, \
+    get_millisecond_time
 
 
 # TODO: Check for ffmpeg! Warn user.
@@ -28,16 +40,25 @@ class GUI(QMainWindow):
 
         # TODO: Make settings file, get path from settings
         self._debug = False
-        self._active_prog = None
+        self._active = []
         self._resolution = None
+        self._media_info = None
+        self._waveform = None
+        self._index = None
+        self._proxied = False
         self.is_paused = False
         self.last_message = ''
         self.audio_bitrate = 320
 
         self._queue = deque()
+        self._journal = JobJournal()
+        # Set while closing, so jobs stopped by it are resumed on the next start
+        self._closing = False
         self._log = get_logger('Webber.GUI')
         self._fh = FileHandler()
         self._settings = self._fh.load_settings()
+        self._builder = JobBuilder(BitratePlanner(), self._ask,
+                                   lambda *args: self.alert_message(*args), self._settings)
 
         self.validate_settings()
         self._log.info(f'Current dest folder: {self._settings["destination"]}')
@@ -52,6 +73,11 @@ class GUI(QMainWindow):
         self.pause_shourtcut.activated.connect(self.pause)
         self.worker = QThreadPool(self)
         self.worker.setMaxThreadCount(1)
+        # Proxies take a while, so they get their own thread instead of holding up probing
+        self._proxy_pool = QThreadPool(self)
+        self._proxy_pool.setMaxThreadCount(1)
+        # Thumbnail, waveform, index and proxy tasks, which are stopped when closing instead of waited on
+        self._cache_tasks = []
 
         # GUI setup
         menubar = QMenuBar(self)
@@ -61,6 +87,48 @@ class GUI(QMainWindow):
         select_dest = QAction('Select destination', menu)
         select_dest.triggered.connect(self.get_folder)
         menu.addAction(select_dest)
+
+        select_jobs = QAction('Concurrent jobs', menu)
+        select_jobs.triggered.connect(self.get_max_jobs)
+        menu.addAction(select_jobs)
+
+        smart_cut = QAction('Frame accurate cuts', menu)
+        smart_cut.setCheckable(True)
+        smart_cut.setChecked(self._settings['smart_cut'])
+        smart_cut.toggled.connect(lambda checked: self._settings.update(smart_cut=checked))
+        menu.addAction(smart_cut)
+
+        intermediate = QAction('Decode once for both passes', menu)
+        intermediate.setToolTip('Decodes the clip once into a lossless temporary file, if there is room for it.')
+        intermediate.setCheckable(True)
+        intermediate.setChecked(self._settings['intermediate'])
+        intermediate.toggled.connect(lambda checked: self._settings.update(intermediate=checked))
+        menu.addAction(intermediate)
+
+        proxy = QAction('Proxy playback for heavy files', menu)
+        proxy.setToolTip('Plays a small copy of 4K, high bitrate or HEVC files, made in the background.\n'
+                         'Converting still uses the original file.')
+        proxy.setCheckable(True)
+        proxy.setChecked(self._settings['proxy'])
+        proxy.toggled.connect(lambda checked: self._settings.update(proxy=checked))
+        menu.addAction(proxy)
+
+        metrics = QAction('Status endpoint', menu)
+        metrics.setToolTip(f'Serves the queue for monitoring, on http://127.0.0.1:{self._settings["metrics_port"]}'
+                           f'/metrics (Prometheus) and /status (JSON).')
+        metrics.setCheckable(True)
+        metrics.setChecked(self._settings['metrics'])
+        metrics.toggled.connect(self.toggle_metrics)
+        menu.addAction(metrics)
+
+        snap_menu = menu.addMenu('Snap start/end to')
+        snap_group = QActionGroup(snap_menu)
+        for title, value in (('Exact position', None), ('Frames', 'frame'), ('Keyframes', 'keyframe')):
+            action = QAction(title, snap_group)
+            action.setCheckable(True)
+            action.setChecked(self._settings['snap'] == value)
+            action.triggered.connect(lambda _, v=value: self._settings.update(snap=v))
+            snap_menu.addAction(action)
         menubar.addMenu(menu)
         self.setMenuBar(menubar)
 
@@ -68,7 +136,9 @@ class GUI(QMainWindow):
         self.current_file.setReadOnly(True)
         self.tutorial_text = textwrap.dedent(f"""\
         Drag a file to this window to open!
+        Drop several files or a folder to list them, and queue them all with the same settings.
         Mute video with M-key, or adjust with scroll wheel on video.
+        Step one frame back or forward with the comma and period keys.
         \n\n\
         {color_text('Short Tutorial:', 'white','bold')}
         
@@ -95,11 +165,42 @@ class GUI(QMainWindow):
         self.textbox.setText(self.tutorial_text)
         self.textbox.setFocusPolicy(Qt.NoFocus)
 
+        # A row per job, with progress updated a few times a second instead of on every ffmpeg report
+        self._jobs = QueueModel(self, eta=self._job_eta)
+        self.queue_view = QueueView(self._jobs)
+        clear_finished = QAction('Clear finished', self.queue_view)
+        clear_finished.triggered.connect(self._jobs.clear_finished)
+        self.queue_view.addAction(clear_finished)
+        self.queue_view.setContextMenuPolicy(Qt.ActionsContextMenu)
+        self.queue_eta = QLabel('')
+        self._jobs.flushed.connect(self.update_queue_eta)
+        self._jobs.flushed.connect(self.publish_metrics)
+        self._metrics = MetricsState()
+        self._metrics_server = None
+        if self._settings['metrics']:
+            self.toggle_metrics(True)
+        queue_box = QWidget()
+        queue_layout = QVBoxLayout(queue_box)
+        queue_layout.setContentsMargins(0, 0, 0, 0)
+        queue_layout.addWidget(self.queue_view)
+        queue_layout.addWidget(self.queue_eta)
+        self.messages = QSplitter(Qt.Vertical)
+        self.messages.addWidget(self.textbox)
+        self.messages.addWidget(queue_box)
+        # Messages from jobs are shown at the same rate
+        self._message_timer = QTimer(self)
+        self._message_timer.setSingleShot(True)
+        self._message_timer.setInterval(REFRESH_MS)
+        self._message_timer.timeout.connect(self.update_textbox)
+
         self.out_name = QLineEdit()
         self.start_time = QLineEdit('00:00.00')
         self.end_time = QLineEdit()
 
         self.bitrate = QLineEdit('8')
+        self.bitrate.setToolTip('Target size in MB.\n'
+                                'Separate several sizes with commas to make one file of each size,\n'
+                                'sharing a single first pass.')
         self.playback_rate = QLineEdit('1.0')
 
         self.sound = QCheckBox('Sound')
@@ -115,10 +216,24 @@ class GUI(QMainWindow):
         self.trim.stateChanged.connect(self._disable)
 
         self.cut = QCheckBox('Cut')
-        self.cut.setToolTip('Cuts video at start/end mark.\nDoes not re-encode if video is not cropped')
+        self.cut.setToolTip('Cuts video at start/end mark.\nDoes not re-encode if video is not cropped,\n'
+                            'except for the few frames before the first and after the last keyframe\n'
+                            'with frame accurate cuts on (Options menu).')
         self.cut.setLayoutDirection(Qt.RightToLeft)
         self.cut.stateChanged.connect(self._disable)
 
+        self.chunked = QCheckBox('Chunked')
+        self.chunked.setToolTip('Encodes parts of the video in parallel, then joins them.\n'
+                                'Faster on machines with many cores. Finished parts are kept,\n'
+                                'so a cancelled or interrupted job continues where it left off.')
+        self.chunked.setLayoutDirection(Qt.RightToLeft)
+
+        self.quality = QCheckBox('Quality')
+        self.quality.setToolTip('Picks the best quality that fits the size from a few short samples,\n'
+                                'then encodes once instead of twice. Saves time on short or easy clips.\n'
+                                'Falls back to the two-pass encode when nothing fits.')
+        self.quality.setLayoutDirection(Qt.RightToLeft)
+
         self.startbtn = QPushButton('Convert')
         self.startbtn.clicked.connect(self.start)
         self.startbtn.clicked.connect(self.start_button_timer)
@@ -144,13 +259,15 @@ class GUI(QMainWindow):
         self.filetype = QComboBox()
         # TODO include more filetypes here!
         self.filetype.addItems(format_spec.keys())
+        self.filetype.currentTextChanged.connect(self._format_changed)
+        self._format_changed(self.filetype.currentText())
 
         self.top_layout = QHBoxLayout()
 
         self.infobox = QGridLayout()
         self.infobox.addWidget(QLabel('Path:'))
         self.infobox.addWidget(self.current_file, 0, 1, 1, 2)
-        self.infobox.addWidget(self.textbox, 1, 0, 1, 3)
+        self.infobox.addWidget(self.messages, 1, 0, 1, 3)
         self.infobox.addWidget(QLabel('Length mul.'))
         self.infobox.addWidget(self.playback_rate, 2, 1, 1, 1)
 
@@ -173,6 +290,31 @@ class GUI(QMainWindow):
         self.infobox.addWidget(self.cancelbtn, 7, 2, 1, 1)
 
         self.infobox.addWidget(self.merge, 8, 0, 1, 1, Qt.AlignLeft)
+        self.infobox.addWidget(self.quality, 8, 1, 1, 1)
+        self.infobox.addWidget(self.chunked, 8, 2, 1, 1)
+
+        # Files from multi-file and folder drops, shown once there are some
+        self.sources = SourceList()
+        self.sources.setToolTip('Double-click to open in the player, Delete to remove.\n'
+                                'Queued files use the current settings, from start to end.')
+        self.queue_sources_btn = QPushButton('Queue all')
+        self.queue_sources_btn.setToolTip('Converts the selected files, or all of them if none are selected.')
+        self.queue_sources_btn.clicked.connect(self.queue_sources)
+        self.clear_sources_btn = QPushButton('Clear list')
+        self.clear_sources_btn.clicked.connect(self.clear_sources)
+        self.sources.itemSelectionChanged.connect(
+            lambda: self.queue_sources_btn.setText('Queue selected' if self.sources.selectedItems() else 'Queue all'))
+        self.infobox.addWidget(self.sources, 9, 0, 1, 3)
+        self.infobox.addWidget(self.queue_sources_btn, 10, 1, 1, 1)
+        self.infobox.addWidget(self.clear_sources_btn, 10, 2, 1, 1)
+        self._show_sources(False)
+
+        self._ingest = Ingest(self)
+        self._ingest.added.connect(self.sources.add_source)
+        self._ingest.probed.connect(self.sources.set_info)
+        self._ingest.failed.connect(self.sources.set_failed)
+        self.sources.removed.connect(self._ingest.forget)
+        self.sources.open_requested.connect(lambda path: self.add_url(QUrl.fromLocalFile(path)))
 
         # self.layout = QGridLayout()
         # self.layout.addWidget(QLabel('Path:'))
@@ -241,6 +383,16 @@ class GUI(QMainWindow):
         self.setMinimumHeight(800)
         self.showMaximized()
 
+        self.restore_queue()
+
+    def _format_changed(self, spec):
+        # Chunked and Quality mode replace the passes of two-pass encodings
+        two_pass = format_spec[spec].two_pass if spec in format_spec else True
+        for box in (self.chunked, self.quality):
+            box.setEnabled(two_pass)
+            if not two_pass:
+                box.setChecked(False)
+
     def tweak_options(self):
         spec = self.filetype.currentText()
         t = Tweaker(spec)
@@ -273,17 +425,51 @@ class GUI(QMainWindow):
             self._settings['destination'] = folder
             self._log.info(f'Current dest folder: {self._settings["destination"]}')
 
+    def get_max_jobs(self):
+        jobs, ok = QInputDialog.getInt(self, 'Concurrent jobs',
+                                       'Jobs to run at the same time (0 = pick from core count):',
+                                       self._settings['max_jobs'], 0, os.cpu_count() or 1)
+        if ok:
+            self._settings['max_jobs'] = jobs
+            self._log.info(f'Concurrent jobs set to {jobs}')
+            self._deplete_queue()
+
+    def max_jobs(self):
+        if self._settings['max_jobs']:
+            return self._settings['max_jobs']
+        # A single libvpx/libaom instance rarely keeps more than ~8 cores busy
+        return max(1, (os.cpu_count() or 1) // 8)
+
     def closeEvent(self, a0) -> None:
-        if self._active_prog is not None:
-            self.alert_message('Error!', 'Can not quit while conversion is in progress!',
-                               'Cancel converison before closing.')
-            a0.ignore()
-            return
+        if self._active:
+            result = self.alert_message('Warning!', 'Conversion is in progress!',
+                                        'Unfinished jobs are resumed the next time Webber starts. Quit anyway?',
+                                        True)
+            if result != QMessageBox.Yes:
+                a0.ignore()
+                return
         self.hide()
-        self.stop()
+
+        # Jobs are left in the journal, instead of being cancelled like stop() does
+        self._closing = True
+        self._queue.clear()
+        for process in self._active:
+            process.abort = True
+        if self.is_paused:
+            self.pause()
+        for process in self._active:
+            process.wait()
+
+        # The pools wait for their tasks when they're destroyed, so the running ffmpegs are stopped first
+        for task in self._cache_tasks:
+            task.cancel()
+        QThreadPool.globalInstance().clear()
+        self._proxy_pool.clear()
 
         self.mediaplayer.disconnect()
         self.mediaplayer.mediaPlayer.disconnect()
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
         self._fh.force_save = True
         self._fh.save_settings(self._settings)
         self._fh.threadpool.waitForDone()
@@ -297,10 +483,14 @@ class GUI(QMainWindow):
         self.mediaplayer.errorLabel.setText(self.get_player_time())
 
     def stop(self):
-        if self._active_prog is not None:
+        if self._active:
+            for process in self._queue:
+                self._journal.finish(process.record['id'], 123)
+                self._jobs.finish(process.record['id'], 123)
             self._queue.clear()
-            if self._active_prog.isRunning():
-                self._active_prog.abort = True
+            for process in self._active:
+                if process.isRunning():
+                    process.abort = True
 
             self.is_paused = False
             self.update_textbox()
@@ -310,79 +500,36 @@ class GUI(QMainWindow):
             time_ms = self.mediaplayer.mediaPlayer.position()
         else:
             time_ms = override
-        time_s = time_ms // 1000
-        time_min = time_s // 60
-        remaining_s = time_s % 60
-        remaining_ms = time_ms % 1000
-        return f'{time_min:02d}:{remaining_s:02d}.{remaining_ms:03d}'
+        return format_timestamp(time_ms)
 
     @staticmethod
     def get_millisecond_time(string_time):
-        m, sms = string_time.split(':')
-        s, ms = sms.split('.')
+        return get_millisecond_time(string_time)
 
-        t1 = float(m) * 1000 * 60
-        t2 = float(s) * 1000
-
-        return t1 + t2 + int(ms)
+    def _snapped_position(self):
+        """ Player position in ms, moved to the closest frame or keyframe if snapping is on and the file is indexed. """
+        position = self.mediaplayer.mediaPlayer.position()
+        if self._index is None or self._settings['snap'] is None:
+            return position
+        return self._index.snap(position / 1000, keyframe=self._settings['snap'] == 'keyframe') * 1000
 
     def get_start(self):
-        self.start_time.setText(self.get_player_time())
+        self.start_time.setText(self.get_player_time(self._snapped_position()))
 
     def get_end(self):
-        self.end_time.setText(self.get_player_time())
-
-    def _gen_split_commands(self, state):
-        """
-        Generates commands for splitting file into 3 parts.
-        There the cut points are start/end mark.
-        If the video is not cropped, there is no reencoding.
-        """
-
-        if state["crop_area"] is not None:
-            x = int(int(self._resolution[0]) * state["crop_area"][0])
-            y = int(int(self._resolution[1]) * state["crop_area"][1])
-            w = int(int(self._resolution[0]) * state["crop_area"][2])
-            h = int(int(self._resolution[1]) * state["crop_area"][3])
-            # TODO: Use regular encoding options here.
-            conversion_style = ['-crf', '18', '-filter:v', f'crop={w}:{h}:{x}:{y}']
-        else:
-            conversion_style = ['-vcodec', 'copy']
+        self.end_time.setText(self.get_player_time(self._snapped_position()))
 
-        if self.sound.isChecked():
-            conversion_style.extend(['-acodec', 'copy'])
+    def step_frames(self, count):
+        """ Pauses, and moves count frames from the current one. """
+        position = self.mediaplayer.mediaPlayer.position()
+        if self._index is not None:
+            target = self._index.step(position / 1000, count) * 1000
         else:
-            conversion_style.extend(['-an'])
-
-        commands = list()
-        for i in range(3):
-            command = list()
-            command.append('-hide_banner')
-            command.append('-nostdin')
-            command.extend(['-i', f'{state["filename"]}', '-y'])
-            command.extend(['-strict', '-2'])
-
-            if i == 0:
-                command.append('-to')
-                command.append(f'{state["ts_start"]}')
-                command.extend(conversion_style)
-            elif i == 1:
-                command.extend(['-ss', f'{state["ts_start"]}'])
-                command.extend(['-to', f'{state["ts_end"]}'])
-
-                command.extend(conversion_style)
-
-                # trim_part.extend(['-filter:v', f'setpts=4*PTS', '-af', 'atempo=0.5,atempo=0.5'])
-            else:
-                command.extend(conversion_style)
-                command.extend(['-ss', f'{state["ts_end"]}'])
-
-            out_path = self._settings['destination'] + '\\' + f'trim_{i}' + '.mp4'
-
-            command.append(f'{out_path}')
-            commands.append(command)
-
-        return commands, f'Cutting {state["filename"].split("/")[-1]}', 0
+            # Not indexed yet, the average frame length is close enough for constant frame rate files
+            rate = framerate(self._media_info) if self._media_info else None
+            target = position + count * 1000 / (rate or 30)
+        # Rounded up, as the player shows the frame before a position that's between two frames
+        self.mediaplayer.show_frame(math.ceil(target))
 
     def _disable(self):
         if self.sender() is self.trim and self.trim.isChecked():
@@ -394,6 +541,8 @@ class GUI(QMainWindow):
         # self.out_name.setDisabled(state)
         self.bitrate.setDisabled(state)
         self.playback_rate.setDisabled(state)
+        self.chunked.setDisabled(state)
+        self.quality.setDisabled(state)
 
         # Disable sound for trim option
         self.sound.setDisabled(self.trim.isChecked())
@@ -407,239 +556,46 @@ class GUI(QMainWindow):
         if not self.sound.isChecked() or not self.sound.isEnabled():
             self.merge.setChecked(False)
 
-    def _gen_cut_commands(self, state):
-        """
-        Generates command for splitting a file like the regular option.
-        If the video is not cropped, there is no reencoding.
-        """
-        out_path = self._settings['destination'] + '\\' + self.out_name.text() + '.mp4'
-
-        if self._fh.is_file(out_path):
-            result = self.alert_message('Warning!', 'File already exists!', 'Do you want to overwrite it?', True)
-            if result != QMessageBox.Yes:
-                raise InterruptedError('Can\'t overwrite file!')
-
-        command = list()
-
-        command.extend(
-            ['-hide_banner', '-nostdin', '-y',
-             '-i', f'{state["filename"]}',
-             '-ss', f'{state["ts_start"]}',
-             '-to', f'{state["ts_end"]}'])
-
-        if state["crop_area"] is not None:
-            x = int(int(self._resolution[0]) * state["crop_area"][0])
-            y = int(int(self._resolution[1]) * state["crop_area"][1])
-            w = int(int(self._resolution[0]) * state["crop_area"][2])
-            h = int(int(self._resolution[1]) * state["crop_area"][3])
-            # TODO: Use regular encoding options here.
-
-            command.extend(['-crf', '18', '-filter:v', f'crop={w}:{h}:{x}:{y}', '-acodec', 'copy'])
-        else:
-            command.extend(['-vcodec', 'copy'])
-
-        if self.sound.isChecked():
-            command.extend(['-acodec', 'copy'])
+    def _options(self):
+        """ The job state from the fields, before it's checked. """
+        if self.trim.isChecked():
+            mode = 'split'
+        elif self.cut.isChecked():
+            mode = 'cut'
         else:
-            command.extend(['-an'])
+            mode = 'convert'
 
-        command.append(f'{out_path}')
-
-        return [command], state["filename"], 0
-
-    def load_options(self):
         state = dict(
+            mode=mode,
             ts_start=self.start_time.text(),
             ts_end=self.end_time.text(),
             filename=re.sub(r'^[^\\/:"*?<>|]+$', '', self.current_file.text()),
             merge_audio=self.merge.isChecked(),
-            target_size=float(self.bitrate.text()),
+            chunked=self.chunked.isChecked(),
+            quality=self.quality.isChecked(),
+            target_sizes=[float(i) for i in self.bitrate.text().replace(';', ',').split(',') if i.strip()],
             filetype=self.filetype.currentText(),
             target_name=self.out_name.text(),
             multiplier=self.playback_rate.text(),
-            crop_area=self.mediaplayer.overlay.get_cropped_area()
+            crop_area=self.mediaplayer.overlay.get_cropped_area(),
+            sound=self.sound.isChecked(),
+            audio_bitrate=self.audio_bitrate,
+            destination=self._settings['destination'],
+            resolution=self._resolution,
+            bit_depth=bit_depth(self._media_info) if self._media_info else None,
+            source_duration=self.mediaplayer.mediaPlayer.duration() / 1000
         )
-
-        valid_name = re.match(r'(^ *$)', state['filename']) is None
-        if not valid_name:
-            self.alert_message('No Target file!', 'The target filename is not selected or incorrect!', '')
-            raise InterruptedError('Filename not valid')
-
-        stamp = 'start'
-        try:
-            start = self.get_player_time(int(self.get_millisecond_time(state['ts_start']) * float(state['multiplier'])))
-            state['start'] = start
-            stamp = 'end'
-            end = self.get_player_time(int(self.get_millisecond_time(state['ts_end']) * float(state['multiplier'])))
-            state['end'] = end
-        except Exception:
-            self.alert_message('Invalid timestamp',
-                               f'The {stamp} timestamp is not valid!',
-                               f'"{state[f"ts_{stamp}"]}" is not valid for Webber!')
-            raise InterruptedError('Timestamp not valid')
-
-        self._log.debug(textwrap.dedent(f"""
-        File: {state["filename"]}
-        Target name: {state["target_name"]}
-        Target size: {state['target_size']}
-        Target filetype: {state["filetype"]}
-        Length multiplier: {state["multiplier"]}
-        Audio bitrate: {self.audio_bitrate}
-        """))
-
         return state
 
-    def _gen_conversion_commands(self, state):
-        encoding = format_spec[state["filetype"]]
-
-        rand_passfilename = f'ffmpeg2pass{str(time.time())[-5:]}'
-
-        out_path = self._settings['destination'] + '\\' + state["target_name"] + '.' + encoding.ext
-
-        if os.path.isfile(out_path) or any(
-                [state["target_name"] + '.' + encoding.ext == i.name for i in self._queue]):
-            result = self.alert_message('Warning!', 'File already exists or is in the queue!',
-                                        'Do you want to overwrite it?', True)
-            if result != QMessageBox.Yes:
-                raise InterruptedError('Can\'t overwrite file!')
-
-        t0 = self.get_millisecond_time(state["start"]) / 1000
-        tf = self.get_millisecond_time(state["end"]) / 1000
-
-        duration = tf - t0  # In seconds!
-        if duration <= 0:
-            self.alert_message('Timestamps are incorrect!',
-                               'The end timestamp is before the start timestamp!', '')
-            raise InterruptedError('Too small target filesize, too low bitrate')
-
-        # Assume 1kb = 1000 bit because it's ffmpeg standard?
-        video_bitrate = int(state["target_size"] * 8 * 1024 // duration)
-
-        if self.sound.isChecked():
-            video_bitrate -= self.audio_bitrateavclear
-
-        if video_bitrate < 1:
-            self.alert_message('Target size too small!',
-                               'The video is too long for the target bitrate!', '')
-            raise InterruptedError('Too small target filesize, too low bitrate')
-        elif video_bitrate < 512:
-            result = self.alert_message('Warning!',
-                                        'The current bitrate is very low, and will probably not work well.',
-                                        'Do you want to stop encoding?',
-                                        True)
-            if result == QMessageBox.Yes:
-                raise InterruptedError('Stopped on command! Too low bitrate selected.')
-
-        self._log.debug(textwrap.dedent(f"""
-                            Working dir: {os.getcwd()}
-                            Target bitrate: {video_bitrate} kbps
-                            Target destination: {out_path}
-                            Start: {state['ts_start']} ({t0:.3f} seconds)
-                            Start: {state['ts_end']} ({tf:.3f} seconds)
-                            """))
-        commands = []
-
-        command_1 = []
-        command_2 = []
-
-        def convert_to_h(string):
-            parts = string.split(':')
-            if int(parts[0]) > 59:
-                return ':'.join([str(int(parts[0]) // 60), str(int(parts[0]) % 60)] + parts[1:])
-            else:
-                return string
-
-        start_formatted = convert_to_h(state["start"])
-        end_formatted = convert_to_h(state["end"])
-        checked = False
-
-        for p, i in enumerate([command_1, command_2]):
-            i.append('-hide_banner')
-            i.append('-nostdin')
-
-            i.extend(['-y'])
-
-            # TODO: Make this option??
-            # i.extend(['-hwaccel', 'cuda'])
-            if state["start"] != '':
-                i.extend(['-ss', f'{start_formatted}'])
-            if state["end"] != '':
-                i.extend(['-to', f'{end_formatted}'])
-
-            i.extend(['-i', f'{state["filename"]}'])
-
-            i.extend(['-map', '0:v:0', '-map', '0:s?'])
-
-            i.extend(encoding.commands.all)
-
-            if p == 0:
-                i.extend(encoding.commands.first)
-            elif p == 1:
-                i.extend(encoding.commands.second)
-
-            i.extend(['-b:v', f'{video_bitrate:.2f}k',
-                      '-maxrate', f'{video_bitrate:.2f}k',
-                      '-bufsize', f'{video_bitrate * 4:.2f}k'
-                      ])
-
-            if self.sound.isChecked() and p == 1:
-                if state['merge_audio']:
-                    command_2.extend(['-filter_complex', '[0:a:0][0:a:1]amerge=inputs=2[a]', '-map', "[a]",
-                                      '-c:a', 'libopus', '-ac', '2', '-b:a', f'{self.audio_bitrate}k'])
-                else:
-                    command_2.extend(['-map', '0:a?', '-c:a', 'libopus', '-b:a', f'{self.audio_bitrate}k'])
-
-                if float(state["multiplier"]) != 1 and not checked:
-                    result = self.alert_message('Warning!',
-                                                'No sound allowed with changed duration!\n'
-                                                'Ignoring the duration change.',
-                                                'Do you want to stop encoding?',
-                                                True)
-                    if result == QMessageBox.Yes:
-                        raise InterruptedError('Stopped on command!')
-                    state["multiplier"] = 1
-                    checked = True  # In multi pass, this prevents repeatedly asking
-            elif p == 1:
-                command_2.append('-an')
-            elif p == 0:
-                command_1.append('-an')
-
-            if state["crop_area"] is not None:
-                x = state["crop_area"][0]
-                y = state["crop_area"][1]
-                # y = max(int(self._resolution[1]) - state["crop_area"][1], 0)
-                w = state["crop_area"][2]
-                h = state["crop_area"][3]
-                crop = f'crop={w}:{h}:{x}:{y}'
-            else:
-                crop = ''
-
-            if state["multiplier"]:
-                if crop:
-                    crop = ',' + crop
-                i.extend(['-filter:v', f'setpts={state["multiplier"]}*PTS{crop}'])
-
-            elif crop:
-                i.extend(['-filter:v', crop])
-
-        command_1.extend(['-f', f'{encoding.f}', '-passlogfile', f'{rand_passfilename}', '-pass', '1', 'NUL'])
-        command_2.extend(['-f', f'{encoding.f}', '-passlogfile', f'{rand_passfilename}', '-pass', '2',
-                          '-metadata', f'title={state["target_name"]}'])
-
-        # com_2.extend(['-vf', f'minterpolate=fps={fps}:mi_mode=mci:mc_mode=aobmc:me=umh:vsbmc=1'])
-
-        command_2.append(f'{out_path}')
-
-        commands.extend([command_1, command_2])
-
-        return commands, self.out_name.text() + '.' + encoding.ext, duration, rand_passfilename
+    def load_options(self):
+        state = self._builder.prepare(self._options())
+        if self._index is not None and float(state['multiplier']) == 1:
+            state['frames'] = self._index.count(get_millisecond_time(state['start']) / 1000,
+                                                get_millisecond_time(state['end']) / 1000)
+        return state
 
-    def remove_pass_file(self, passlogfile):
-        for file in os.listdir('.'):
-            # print((passlogfile))
-            if file.startswith(str(passlogfile)) and file.endswith('.log'):
-                os.remove(file)
-                break
+    def _ask(self, question, title, text, info_text):
+        return self.alert_message(title, text, info_text, True) == QMessageBox.Yes
 
     def alert_message(self, title, text, info_text, question=False, allow_cancel=False):
         warning_window = QMessageBox(parent=self)
@@ -667,53 +623,131 @@ class GUI(QMainWindow):
             self.startbtn.setDisabled(True)
             self.cancelbtn.setDisabled(False)
 
-            state = self.load_options()
             try:
-                passfile = None
-                if self.trim.isChecked():
-                    commands, name, duration = self._gen_split_commands(state)
-                elif self.cut.isChecked():
-                    commands, name, duration = self._gen_cut_commands(state)
-                else:
-                    commands, name, duration, passfile = self._gen_conversion_commands(state)
-
+                state = self.load_options()
+                process, _ = self._builder.build(state, queued=[i.name for i in self._queue])
             except InterruptedError as e:
                 self._log.info(f'User error: {e}')
                 return
-            for i in commands:
-                print(' '.join(i))
-            process = Conversion(commands=commands, target_name=name, file_name=state['filename'],
-                                 duration=duration)
-            process.finished.connect(self._deplete_queue)
-            process.done.connect(self.done)
-            if passfile is not None:
-                process.done.connect(lambda _, f=passfile: self.remove_pass_file(f))
-            process.process_output.connect(self.update_last_message)
-
-            self._queue.append(process)
+
+            self._journal.add(process.record)
+            self._enqueue(process)
             self._deplete_queue()
             self.update_textbox()
         except:
             traceback.print_exc()
 
-    def pause(self):
-        process = self._active_prog
+    def _source_state(self, path, info):
+        """ Job state for a listed file: the current settings, for all of it, without a crop. """
+        state = self._options()
+        total = duration(info) or 0
+        state.update(
+            mode='convert',
+            ts_start=format_timestamp(0),
+            ts_end=format_timestamp(total * 1000),
+            filename=path,
+            target_name=os.path.splitext(os.path.basename(path))[0],
+            crop_area=None,
+            resolution=resolution(info),
+            bit_depth=bit_depth(info),
+            source_duration=total,
+        )
+        return self._builder.prepare(state)
 
-        if process is not None:
-            pid = process.get_pid()
-            if pid is None:
-                return
+    def queue_sources(self):
+        queued = 0
+        for path, info in self.sources.ready(selected_only=bool(self.sources.selectedItems())):
+            try:
+                process, _ = self._builder.build(self._source_state(path, info),
+                                                 queued=[i.name for i in self._queue])
+            except InterruptedError as e:
+                self._log.info(f'Skipped {path}: {e}')
+                continue
+            self._journal.add(process.record)
+            self._enqueue(process)
+            self.sources.remove_source(path)
+            queued += 1
+
+        if queued:
+            self.cancelbtn.setDisabled(False)
+            self.last_message = color_text(f'Queued {queued} file(s).', 'white')
+            self._deplete_queue()
+            self.update_textbox()
+        self._show_sources(bool(self.sources.count()))
+
+    def clear_sources(self):
+        for row in reversed(range(self.sources.count())):
+            self.sources.remove_source(self.sources.item(row).data(SourceList.PATH_ROLE))
+        self._show_sources(False)
+
+    def _show_sources(self, visible):
+        for widget in (self.sources, self.queue_sources_btn, self.clear_sources_btn):
+            widget.setVisible(visible)
+
+    def _enqueue(self, process):
+        record = process.record
+        process.finished.connect(self._deplete_queue)
+        process.pass_changed.connect(self._deplete_queue)
+        process.done.connect(self.done)
+        process.done.connect(lambda code, job_id=record['id']: self._job_ended(job_id, code))
+        if record['passfile'] is not None:
+            process.done.connect(lambda _, f=record['passfile']: remove_pass_file(f))
+        if record['plans']:
+            process.done.connect(
+                lambda code, p=process, plans=record['plans']: self._builder.record_sizes(code, plans, p))
+        process.progress.connect(lambda items, job_id=record['id']: self._jobs.update_progress(job_id, items))
+        process.pass_changed.connect(
+            lambda cur_pass, passes, job_id=record['id']: self._jobs.set_pass(job_id, cur_pass, passes))
+        process.done.connect(lambda code, job_id=record['id']: self._jobs.finish(job_id, code))
+        process.process_output.connect(self.update_last_message)
+
+        self._jobs.add_job(record['id'], process.name)
+        self._jobs.set_eta(record['id'], process.telemetry.estimate())
+        self._queue.append(process)
+
+    def _job_ended(self, job_id, code):
+        if code == 123 and self._closing:
+            return
+        self._journal.finish(job_id, code)
 
+    def restore_queue(self):
+        """ Queues the jobs that were unfinished when Webber was last closed. """
+        restored = 0
+        for record in self._journal.compact():
+            try:
+                self._enqueue(job_from_record(record))
+                restored += 1
+            except Exception:
+                self._log.error(f'Could not restore job {record.get("id")}')
+                traceback.print_exc()
+                self._journal.finish(record.get('id'), 1)
+
+        if restored:
+            self._log.info(f'Restored {restored} unfinished job(s)')
+            self.last_message = color_text(f'Resuming {restored} unfinished job(s) from last time.')
+            self.cancelbtn.setDisabled(False)
+            self._deplete_queue()
+            self.update_textbox()
+
+    def pause(self):
+        pids = [pid for process in self._active for pid in process.get_pids()]
+        if not pids:
+            return
+
+        for pid in pids:
             p = psutil.Process(pid)
             if self.is_paused:
                 p.resume()
-                self.is_paused = False
             else:
                 p.suspend()
-                self.is_paused = True
-            self.update_textbox()
+        self.is_paused = not self.is_paused
+        for process in self._active:
+            if process.isRunning():
+                self._jobs.set_status(process.record['id'], PAUSED if self.is_paused else RUNNING)
+        self.update_textbox()
 
     def done(self, code):
+        self._metrics.job_done(code)
         if code == 123:
             self.last_message = 'Process stopped by user!'
         elif code:
@@ -723,34 +757,83 @@ class GUI(QMainWindow):
         self.is_paused = False
         self.update_textbox()
 
-    def _deplete_queue(self):
-        if self._active_prog is not None and self._active_prog.isRunning():
-            return
-
-        if self._queue:
-            self._active_prog = self._queue.popleft()
-            self._active_prog.start()
-        else:
-            self._active_prog = None
+    def _can_start(self):
+        max_jobs = self.max_jobs()
+        if len(self._active) < max_jobs:
+            return True
+
+        # Jobs in their last pass leave room for the first pass of one more job
+        busy = [i for i in self._active if not i.in_last_pass()]
+        return self._settings['overlap_passes'] and len(busy) < max_jobs and len(self._active) <= max_jobs
+
+    def _deplete_queue(self, *_):
+        self._active = [i for i in self._active if not i.isFinished()]
+
+        # New jobs are not started while paused, they would not be paused.
+        while self._queue and not self.is_paused and self._can_start():
+            process = self._queue.popleft()
+            # Every slot gets the same share, running jobs keep theirs, so the total stays within the cores
+            threads = max(1, (os.cpu_count() or 1) // self.max_jobs())
+            process.set_thread_budget(threads)
+            self._log.info(f'Starting {process.name} with {threads} threads, '
+                           f'{len(self._active)} other job(s) running')
+            process.start()
+            self._jobs.set_status(process.record['id'], RUNNING)
+            self._active.append(process)
+
+        if not self._active:
             self.is_paused = False
 
     def start_button_timer(self, state):
         if not state:
             self.timer.start(1000)
 
+    def _job_eta(self, job_id):
+        for process in self._active:
+            if process.record['id'] == job_id:
+                return process.telemetry.eta()
+        return None
+
+    def update_queue_eta(self):
+        """ Time left for the queue: the longest running job, and the queued ones spread over the job slots. """
+        running = [self._jobs.eta(process.record['id']) or 0 for process in self._active if process.isRunning()]
+        queued = [process.telemetry.estimate() for process in self._queue]
+        if not running and not queued:
+            self.queue_eta.setText('')
+            return
+        left = max(running, default=0) + sum(queued) / self.max_jobs()
+        self.queue_eta.setText(f'{len(running)} running, {len(queued)} queued, about {format_eta(left)} left')
+
+    def publish_metrics(self):
+        self._metrics.publish(len(self._queue), self._jobs.active_rows())
+
+    def toggle_metrics(self, enabled):
+        self._settings['metrics'] = enabled
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+            self._metrics_server = None
+        if not enabled:
+            return
+        try:
+            self._metrics_server = MetricsServer(self._metrics, self._settings['metrics_port'])
+        except OSError as e:
+            self._log.error(f'Could not serve metrics on port {self._settings["metrics_port"]}: {e}')
+            self.last_message = color_text(f'Status endpoint failed to start: {e}')
+            self.update_textbox()
+            return
+        self._metrics_server.start()
+        self.publish_metrics()
+
     def update_last_message(self, text):
         self.last_message = text
-        self.update_textbox()
+        if not self._message_timer.isActive():
+            self._message_timer.start()
 
     def update_textbox(self):
         self.textbox.setText(self.last_message)
         if self.is_paused:
             self.textbox.append(color_text('\nCONVERSION PAUSED\n') + 'Press Ctrl+Space to Resume!\n')
 
-        if self._queue:
-            self.textbox.append(color_text('\n\nIn queue:\n', color='white'))
-            self.textbox.append('\n'.join([f'{idx}. {i.name}' for idx, i in enumerate(self._queue, 1)])+'\n\n')
-
         self.textbox.append('<br><br>'+self.tutorial_text)
 
     def dragEnterEvent(self, event):
@@ -767,32 +850,39 @@ class GUI(QMainWindow):
             event.ignore()
 
     def dropEvent(self, event):
-        if event.mimeData().hasUrls and len(event.mimeData().urls()) == 1:
-            event.setDropAction(Qt.CopyAction)
-            event.accept()
-            self.add_url(event.mimeData().urls()[0])
-        else:
+        urls = [url for url in event.mimeData().urls() if url.isLocalFile()] if event.mimeData().hasUrls() else []
+        if not urls:
             event.ignore()
+            return
+
+        event.setDropAction(Qt.CopyAction)
+        event.accept()
+        if len(urls) == 1 and not os.path.isdir(urls[0].toLocalFile()):
+            self.add_url(urls[0])
+        elif self._ingest.add([url.toLocalFile() for url in urls]):
+            self._show_sources(True)
 
     def add_url(self, file):
-        p = QProcess()
-        p.start(
-            f'ffprobe "{file.toLocalFile().replace("file:///", "")}" '
-            f'-v 0 -select_streams v:0 -show_entries '
-            f'stream=width,height -of csv=s=x:p=0')
-        p.waitForStarted()
-        p.waitForFinished()
-        print(p.exitCode())
         self.mediaplayer.overlay.reset()
-        self._resolution = p.readAll().data().decode('utf-8', 'replace').strip().split('x')
-        self.mediaplayer.videoWidget.setSize(QSizeF(float(self._resolution[0]), float(self._resolution[1])))
+        self._resolution = None
+        self._media_info = None
 
-        try:
-            self._log.debug(f'Resolution of video is {self._resolution[0]}x{self._resolution[1]}')
-        except:
-            traceback.print_exc()
+        # Cached thumbnails show right away, others are made once the file is probed
+        cached = cached_sheet(file.toLocalFile())
+        self.mediaplayer.set_filmstrip(Filmstrip(*cached) if cached is not None else None)
+        self._waveform = cached_waveform(file.toLocalFile())
+        self.mediaplayer.set_waveform(self._waveform)
+        self._index = cached_index(file.toLocalFile())
 
-        self.mediaplayer.mediaPlayer.setMedia(QMediaContent(file))
+        # Probing can take a while on network shares, so it's done in the background
+        task = ProbeTask(file.toLocalFile())
+        task.signals.finished.connect(self.probe_done)
+        task.signals.failed.connect(self.probe_failed)
+        self.worker.start(task)
+
+        proxy = cached_proxy(file.toLocalFile()) if self._settings['proxy'] else None
+        self.mediaplayer.mediaPlayer.setMedia(QMediaContent(QUrl.fromLocalFile(proxy) if proxy else file))
+        self._proxied = proxy is not None
 
         self.mediaplayer.playButton.setEnabled(True)
         self.mediaplayer.trim_btn.setDisabled(False)
@@ -801,7 +891,74 @@ class GUI(QMainWindow):
         self.mediaplayer.mediaPlayer.mediaStatusChanged.connect(self.set_end_time)
         self.mediaplayer.resizeEvent(None)
 
+    def probe_done(self, path, info):
+        if path != self.current_file.text():
+            # Another file was dropped while this one was probed
+            return
+
+        self._media_info = info
+        self._resolution = resolution(info)
+        if self._resolution is None:
+            self._log.error(f'No video stream found in {path}')
+            return
+
+        self.mediaplayer.videoWidget.setSize(QSizeF(float(self._resolution[0]), float(self._resolution[1])))
+        self._log.debug(f'Resolution of video is {self._resolution[0]}x{self._resolution[1]}')
+        self.mediaplayer.resizeEvent(None)
+
+        if self.mediaplayer.filmstrip is None and duration(info):
+            task = ThumbnailTask(path, duration(info), self._resolution)
+            task.signals.finished.connect(self.thumbnails_done)
+            self._start_cache_task(QThreadPool.globalInstance(), task)
+
+        if self._index is None:
+            task = IndexTask(path)
+            task.signals.finished.connect(self.index_done)
+            self._start_cache_task(QThreadPool.globalInstance(), task)
+
+        if self._settings['proxy'] and not self._proxied and is_heavy(info):
+            task = ProxyTask(path)
+            task.signals.finished.connect(self.proxy_done)
+            self._start_cache_task(self._proxy_pool, task)
+
+        if self._waveform is None and waveform_available() and audio_streams(info) and duration(info):
+            task = WaveformTask(path, duration(info))
+            task.signals.finished.connect(self.waveform_done)
+            self._start_cache_task(QThreadPool.globalInstance(), task)
+
+    def _start_cache_task(self, pool, task):
+        self._cache_tasks = [i for i in self._cache_tasks if not i.done]
+        self._cache_tasks.append(task)
+        pool.start(task)
+
+    def proxy_done(self, path, proxy):
+        if path == self.current_file.text() and not self._proxied:
+            self._log.info(f'Playing proxy {proxy}')
+            self._proxied = True
+            self.mediaplayer.play_proxy(proxy)
+
+    def index_done(self, path, index):
+        if path == self.current_file.text():
+            self._index = index
+
+    def waveform_done(self, path, overview):
+        if path == self.current_file.text():
+            self._waveform = overview
+            self.mediaplayer.set_waveform(overview)
+
+    def thumbnails_done(self, path, sheet, meta):
+        if path == self.current_file.text():
+            self.mediaplayer.set_filmstrip(Filmstrip(sheet, meta))
+
+    def probe_failed(self, path, error):
+        if path == self.current_file.text():
+            self.last_message = color_text(f'Could not read file info!\n') + error
+            self.update_textbox()
+
     def set_end_time(self):
+        if self.mediaplayer.swapping_media:
+            # The proxy has the same length, and the end time might have been picked already
+            return
         self.end_time.setText(self.get_player_time(self.mediaplayer.mediaPlayer.duration()))
 
     def keyPressEvent(self, event):
@@ -822,5 +979,9 @@ class GUI(QMainWindow):
             else:
                 step = 5000
             self.mediaplayer.skip(step)
+        elif event.key() == Qt.Key_Comma:
+            self.step_frames(-1)
+        elif event.key() == Qt.Key_Period:
+            self.step_frames(1)
         else:
             super(GUI, self).keyPressEvent(event)
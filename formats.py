@@ -1,4 +1,5 @@
 from collections import namedtuple
+from copy import deepcopy
 from functools import partial
 
 from PyQt5.QtWidgets import QDialog, QApplication, QFormLayout, QLabel, QLineEdit, QPushButton, QHBoxLayout
@@ -6,9 +7,10 @@ from more_itertools import consume
 from more_itertools.recipes import grouper
 
 from dialog import Dialog
-from utils import color_text, get_stylesheet
+from utils import color_text, get_stylesheet, get_option, set_option
 
-encoding = namedtuple('Encoding', ['ext', 'f', 'commands'])
+# Single pass encodings (two_pass=False) use the options for all passes and the second pass, as one VBR pass
+encoding = namedtuple('Encoding', ['ext', 'f', 'commands', 'two_pass'], defaults=(True,))
 passes = namedtuple('commandset', ['all', 'first', 'second'])
 format_spec = {}
 
@@ -62,6 +64,80 @@ av1_params = passes([
 # Orignially had mkv as filetype
 format_spec['AV1'] = encoding('webm', 'webm', av1_params)
 
+# SVT-AV1 has no two-pass mode in ffmpeg, its VBR is close enough for size targeting in a single pass.
+# Tiles and threads (lp) are set in -svtav1-params, see svt_params.
+svt_av1_params = passes([
+    '-c:v', 'libsvtav1',
+    '-pix_fmt', 'yuv420p10le',
+    '-g', '300',
+    '-svtav1-params', 'tune=0:tile-columns=0:tile-rows=0:lp=12:overshoot-pct=10:undershoot-pct=50',
+], [
+], [
+    '-preset', '6',
+])
+
+format_spec['SVT-AV1'] = encoding('webm', 'webm', svt_av1_params, two_pass=False)
+
+# Untouched copy of the presets, to tell which options were changed with the Tweaker
+default_spec = deepcopy(format_spec)
+
+
+def svt_params(value) -> dict:
+    """ Splits the key=value:key=value string of -svtav1-params. """
+    pairs = (item.partition('=') for item in (value or '').split(':') if item)
+    return {key: value for key, _, value in pairs}
+
+
+def merge_svt_params(value, changes: dict) -> str:
+    params = svt_params(value)
+    params.update({key: str(option) for key, option in changes.items()})
+    return ':'.join(f'{key}={option}' for key, option in params.items())
+
+
+def apply_thread_budget(command: list, threads: int) -> list:
+    """
+    Rewrites the thread and tile options of an encoding command, so it fits in the given amount of threads.
+    Tiles are what lets the encoders make use of the threads, so they're scaled along with them.
+    The budget only lowers the options, what the command already has (eg. from tuning) is the upper limit.
+    Commands that don't encode video are left as is.
+    """
+    codec = get_option(command, '-c:v')
+    if codec not in ('libvpx-vp9', 'libaom-av1', 'libsvtav1'):
+        return command
+
+    # Roughly 2 threads per tile column is what the encoders can keep busy
+    tile_columns = max(0, min(4, threads.bit_length() - 2))
+
+    if codec == 'libsvtav1':
+        params = svt_params(get_option(command, '-svtav1-params'))
+        current = params.get('lp', '')
+        if current.isdigit() and int(current) > 0:
+            threads = min(threads, int(current))
+        current = params.get('tile-columns', '')
+        if current.isdigit():
+            tile_columns = min(tile_columns, int(current))
+        params = merge_svt_params(get_option(command, '-svtav1-params'), {'lp': threads, 'tile-columns': tile_columns})
+        set_option(command, '-svtav1-params', params)
+        return command
+
+    current = get_option(command, '-threads')
+    if current is not None and current.isdigit():
+        threads = min(threads, int(current))
+    set_option(command, '-threads', str(threads))
+
+    if codec == 'libvpx-vp9':
+        current = get_option(command, '-tile-columns')
+        if current is not None and current.isdigit():
+            tile_columns = min(tile_columns, int(current))
+        set_option(command, '-tile-columns', str(tile_columns))
+    elif codec == 'libaom-av1':
+        columns, _, rows = get_option(command, '-tiles', '1x1').partition('x')
+        if columns.isdigit() and int(columns) > 0:
+            tile_columns = min(tile_columns, int(columns).bit_length() - 1)
+        rows = rows if rows.isdigit() and int(rows) > 0 else '1'
+        set_option(command, '-tiles', f'{2 ** tile_columns}x{rows}')
+    return command
+
 
 class Tweaker(QDialog):
     def __init__(self, spec: str):
@@ -140,7 +216,10 @@ class Tweaker(QDialog):
         self.hbox = QHBoxLayout()
         self.form = form = QFormLayout()
 
-        for pass_name, pass_dict in zip(('All passes', 'First Pass', 'Second Pass'),
+        # Single pass encodings only use the second pass options on top of the shared ones
+        names = ('All passes', 'First Pass', 'Second Pass') if self.enc.two_pass else \
+            ('All options', 'First Pass (unused)', 'Single Pass')
+        for pass_name, pass_dict in zip(names,
                                         (self.all_pass_pairs, self.first_pass_pairs, self.second_pass_pairs)):
 
             add_btn = QPushButton('Add')
@@ -167,7 +246,7 @@ class Tweaker(QDialog):
             consume(pass_list.extend([k, v]) for k, v in pass_pair.items())
 
         p = passes(self.all_pass, self.first_pass, self.second_pass)
-        return encoding(self.enc.ext, self.enc.f, p)
+        return encoding(self.enc.ext, self.enc.f, p, self.enc.two_pass)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,152 @@
+import bisect
+import os
+import subprocess
+from array import array
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import mediacache
+from probe import probe, start_time, ProbeError
+from utils import get_logger
+
+log = get_logger('Webber.FrameIndex')
+
+# Positions closer than this (in seconds) to a frame are on it, the player only has millisecond precision
+EPSILON = 0.0005
+MAX_ENTRIES = 50
+# Folder of the cached indexes, renamed whenever what's stored in them changes
+CACHE_KIND = 'index_v2'
+
+
+class FrameIndex:
+    """
+    Presentation times of every video frame in a source, and which of them are keyframes, sorted.
+    Times are in seconds from the start time of the file, like the player position and -ss,
+    in arrays of doubles, so an hour at 60 fps is about 2 MB.
+    """
+
+    def __init__(self, times, keyframes):
+        self.times = times
+        self.keyframes = keyframes
+
+    def __len__(self):
+        return len(self.times)
+
+    def frame_at(self, seconds):
+        """ Index of the frame shown at a position. """
+        return max(0, bisect.bisect_right(self.times, seconds + EPSILON) - 1)
+
+    def step(self, seconds, count):
+        """ Time of the frame count frames from the one shown at a position. """
+        idx = min(len(self.times) - 1, max(0, self.frame_at(seconds) + count))
+        return self.times[idx]
+
+    def snap(self, seconds, keyframe=False):
+        """ Time of the frame or keyframe closest to a position. """
+        times = self.keyframes if keyframe else self.times
+        idx = bisect.bisect_left(times, seconds)
+        candidates = times[max(0, idx - 1):idx + 1]
+        return min(candidates, key=lambda t: abs(t - seconds)) if candidates else seconds
+
+    def keyframes_between(self, start, end):
+        return list(self.keyframes[bisect.bisect_right(self.keyframes, start):bisect.bisect_left(self.keyframes, end)])
+
+    def count(self, start, end):
+        """ Frames shown from start until end, which is what an encode of that range outputs. """
+        return bisect.bisect_left(self.times, end - EPSILON) - bisect.bisect_left(self.times, start - EPSILON)
+
+
+def _paths(path):
+    frames = mediacache.cache_path(CACHE_KIND, path, '.frames')
+    return frames, os.path.splitext(frames)[0] + '.keys'
+
+
+def _load(file):
+    values = array('d')
+    with open(file, 'rb') as f:
+        values.frombytes(f.read())
+    return values
+
+
+def cached_index(path):
+    """ Returns the cached index of a source, or None. """
+    try:
+        frames, keys = _paths(path)
+        return FrameIndex(_load(frames), _load(keys))
+    except (OSError, ValueError):
+        return None
+
+
+def build_index(path, offset=None, on_start=None):
+    """
+    Reads the timestamp and flags of every video packet with ffprobe, without decoding anything.
+    The output is read line by line, so only the arrays are kept. Returns None for sources without video.
+    Offset is the start time of the file, which is subtracted from the timestamps, probed if not given.
+    Blocks while ffprobe runs, on_start gets its process. Returns None if it is stopped.
+    """
+    if offset is None:
+        try:
+            offset = start_time(probe(path))
+        except ProbeError as e:
+            log.error(f'Failed to probe start time: {e}')
+            offset = 0.0
+
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+               '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path]
+    times = array('d')
+    keyframes = array('d')
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        if on_start is not None:
+            on_start(process)
+        for line in process.stdout:
+            pts, _, flags = line.decode('utf-8', 'replace').strip().partition(',')
+            try:
+                pts = float(pts) - offset
+            except ValueError:
+                # Packets without a timestamp (N/A) can't be stepped to
+                continue
+            times.append(pts)
+            if 'K' in flags:
+                keyframes.append(pts)
+
+    if process.returncode or not times:
+        return None
+
+    # Packets are in decode order, which isn't the presentation order with B-frames
+    times = array('d', sorted(times))
+    keyframes = array('d', sorted(keyframes))
+    try:
+        frames, keys = _paths(path)
+        # Keyframes first, so a complete frames file means the index is complete
+        for file, values in ((keys, keyframes), (frames, times)):
+            with open(file + '.part', 'wb') as f:
+                values.tofile(f)
+            os.replace(file + '.part', file)
+        mediacache.prune(CACHE_KIND, MAX_ENTRIES)
+    except OSError as e:
+        log.error(f'Could not cache frame index: {e}')
+    log.info(f'Indexed {len(times)} frames and {len(keyframes)} keyframes of {path}')
+    return FrameIndex(times, keyframes)
+
+
+class IndexSignals(QObject):
+    # Source path, FrameIndex
+    finished = pyqtSignal(str, object)
+
+
+class IndexTask(mediacache.CacheTask):
+    """ Builds the frame index of a source in a threadpool. """
+
+    def __init__(self, path):
+        super(IndexTask, self).__init__()
+        self.path = path
+        self.signals = IndexSignals()
+
+    def work(self):
+        try:
+            index = build_index(self.path, on_start=self.watch)
+        except Exception as e:
+            log.error(f'Failed to index {self.path}: {e}')
+        else:
+            if index is not None:
+                self.signals.finished.emit(self.path, index)
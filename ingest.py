@@ -0,0 +1,128 @@
+import os
+
+from PyQt5.QtCore import QObject, QThreadPool, pyqtSignal, Qt
+from PyQt5.QtWidgets import QListWidget, QListWidgetItem, QAbstractItemView
+
+from probe import ProbeTask, duration, resolution
+from utils import get_logger, format_timestamp
+
+log = get_logger('Webber.Ingest')
+
+# Files in dropped folders are only picked up with these extensions, files dropped on their own always are
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.webm', '.mov', '.avi', '.flv', '.ts', '.m4v', '.wmv', '.mpg', '.mpeg')
+# ffprobe is mostly waiting on the disk, a few at a time is enough to hide that without thrashing it
+PROBE_THREADS = 4
+
+
+def expand_paths(paths):
+    """ Returns the files in a drop, with the videos in dropped folders (and their subfolders) in name order. """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.lower().endswith(VIDEO_EXTENSIONS))
+        elif os.path.isfile(path):
+            files.append(path)
+    return [os.path.normpath(file) for file in files]
+
+
+class Ingest(QObject):
+    """ Probes dropped files on a small threadpool of its own, so the player's probing isn't held up. """
+    added = pyqtSignal(str)
+    # Path, probe info
+    probed = pyqtSignal(str, dict)
+    # Path, error message
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, parent=None, threads=PROBE_THREADS):
+        super(Ingest, self).__init__(parent)
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(threads)
+        self._known = set()
+
+    def add(self, paths):
+        """ Starts probing the files in a drop, skipping those already added. Returns how many were added. """
+        count = 0
+        for path in expand_paths(paths):
+            if path in self._known:
+                continue
+            self._known.add(path)
+            self.added.emit(path)
+            task = ProbeTask(path)
+            task.signals.finished.connect(self.probed)
+            task.signals.failed.connect(self.failed)
+            self._pool.start(task)
+            count += 1
+        log.info(f'Probing {count} dropped file(s)')
+        return count
+
+    def forget(self, path):
+        self._known.discard(path)
+
+
+class SourceList(QListWidget):
+    """ Files waiting to be queued, with their length and resolution once probed. """
+    # Path of a double clicked source
+    open_requested = pyqtSignal(str)
+    removed = pyqtSignal(str)
+
+    PATH_ROLE = Qt.UserRole
+
+    def __init__(self, *args):
+        super(SourceList, self).__init__(*args)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setFocusPolicy(Qt.ClickFocus)
+        # Path to probe info, kept here rather than in the items so it isn't converted to Qt types
+        self._info = {}
+        self.itemActivated.connect(lambda item: self.open_requested.emit(item.data(self.PATH_ROLE)))
+
+    def _item(self, path):
+        for row in range(self.count()):
+            if self.item(row).data(self.PATH_ROLE) == path:
+                return self.item(row)
+        return None
+
+    def add_source(self, path):
+        item = QListWidgetItem(f'{os.path.basename(path)}  (reading...)')
+        item.setData(self.PATH_ROLE, path)
+        item.setToolTip(path)
+        self.addItem(item)
+
+    def set_info(self, path, info):
+        item = self._item(path)
+        if item is None:
+            return
+        size = resolution(info)
+        if size is None:
+            self.set_failed(path, 'No video stream')
+            return
+        self._info[path] = info
+        item.setText(f'{os.path.basename(path)}  {format_timestamp((duration(info) or 0) * 1000)}  {size[0]}x{size[1]}')
+
+    def set_failed(self, path, error):
+        item = self._item(path)
+        if item is not None:
+            item.setText(f'{os.path.basename(path)}  (can not be read)')
+            item.setToolTip(f'{path}\n{error}')
+
+    def ready(self, selected_only=False):
+        """ Returns (path, info) for the probed sources, or only the selected ones. """
+        items = self.selectedItems() if selected_only else [self.item(row) for row in range(self.count())]
+        paths = [item.data(self.PATH_ROLE) for item in items]
+        return [(path, self._info[path]) for path in paths if path in self._info]
+
+    def remove_source(self, path):
+        item = self._item(path)
+        if item is not None:
+            self.takeItem(self.row(item))
+            self._info.pop(path, None)
+            self.removed.emit(path)
+
+    def keyPressEvent(self, e) -> None:
+        if e.key() == Qt.Key_Delete:
+            for item in self.selectedItems():
+                self.remove_source(item.data(self.PATH_ROLE))
+        else:
+            super(SourceList, self).keyPressEvent(e)
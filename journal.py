@@ -0,0 +1,69 @@
+import json
+import os
+
+from utils import get_logger
+
+log = get_logger('Webber.Journal')
+
+JOURNAL_FILE = 'webber_queue.jsonl'
+
+
+class JobJournal:
+    """
+    Append-only log of the conversion queue, so queued jobs survive the program closing or crashing.
+    Every queued job is written as an "add" entry with its job record, and every job that ends
+    gets a "done" entry. Jobs without one are unfinished, and are restored on the next start.
+    Entries are flushed to disk before returning, and a half written last line from a crash is ignored.
+    """
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+
+    def _append(self, entry):
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            log.error(f'Failed to write to the queue journal: {e}')
+
+    def add(self, record: dict):
+        self._append({'op': 'add', 'record': record})
+
+    def finish(self, job_id, code):
+        self._append({'op': 'done', 'id': job_id, 'code': code})
+
+    def pending(self) -> list:
+        """ Returns the records of unfinished jobs, in the order they were queued. """
+        records = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        log.warning('Skipping broken line in the queue journal')
+                        continue
+                    if entry.get('op') == 'add':
+                        records[entry['record']['id']] = entry['record']
+                    elif entry.get('op') == 'done':
+                        records.pop(entry.get('id'), None)
+        except OSError:
+            return []
+        return list(records.values())
+
+    def compact(self):
+        """ Rewrites the journal with only the unfinished jobs, so it doesn't grow forever. """
+        pending = self.pending()
+        temp = self.path + '.tmp'
+        try:
+            with open(temp, 'w', encoding='utf-8') as f:
+                for record in pending:
+                    f.write(json.dumps({'op': 'add', 'record': record}, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp, self.path)
+        except OSError as e:
+            log.error(f'Failed to compact the queue journal: {e}')
+        return pending
@@ -0,0 +1,87 @@
+import hashlib
+import os
+
+from PyQt5.QtCore import QRunnable
+
+from utils import get_logger
+
+log = get_logger('Webber.MediaCache')
+
+# Previews made from the sources (thumbnails, waveforms, proxies) are kept here, in a folder per kind
+CACHE_ROOT = 'media_cache'
+
+
+def source_key(path):
+    """ Key of a source file, which changes if the file does. """
+    stat = os.stat(path)
+    payload = f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}'
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def cache_path(kind, path, suffix):
+    """ Returns where the preview of the given kind for a source is kept. Raises OSError if it can't be read. """
+    folder = os.path.join(CACHE_ROOT, kind)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, source_key(path) + suffix)
+
+
+class CacheTask(QRunnable):
+    """
+    Makes a preview in a threadpool, with a blocking ffmpeg or ffprobe run that cancel() stops from another thread.
+    Subclasses do the work in work(), and give watch to the function that starts the process.
+    """
+
+    def __init__(self):
+        super(CacheTask, self).__init__()
+        self.process = None
+        self.cancelled = False
+        self.done = False
+
+    def watch(self, process):
+        self.process = process
+        # Cancelled before the process was known
+        if self.cancelled:
+            process.terminate()
+
+    def cancel(self):
+        self.cancelled = True
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+    def run(self):
+        try:
+            if not self.cancelled:
+                self.work()
+        finally:
+            self.done = True
+
+    def work(self):
+        raise NotImplementedError
+
+
+def prune(kind, max_entries):
+    """ Removes the least recently written previews of a kind, keeping max_entries sources. """
+    folder = os.path.join(CACHE_ROOT, kind)
+    try:
+        files = [os.path.join(folder, i) for i in os.listdir(folder)]
+    except OSError:
+        return
+
+    # A source can have several files (eg. a sheet and its index), they're grouped by key
+    newest = {}
+    for file in files:
+        key = os.path.basename(file).split('.')[0]
+        try:
+            newest[key] = max(newest.get(key, 0), os.path.getmtime(file))
+        except OSError:
+            continue
+
+    for key in sorted(newest, key=newest.get, reverse=True)[max_entries:]:
+        for file in files:
+            if os.path.basename(file).split('.')[0] == key:
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass
+        log.debug(f'Removed cached {kind} {key}')
@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from utils import get_logger
+
+log = get_logger('Webber.Metrics')
+
+HOST = '127.0.0.1'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsState:
+    """
+    The queue as last published by the GUI. The GUI thread replaces the snapshot,
+    and the server threads only read it, so they never touch Qt objects.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = dict(queued=0, active=[])
+        self._counts = dict(completed=0, failed=0, stopped=0)
+        self._started = time.time()
+
+    def publish(self, queued, active):
+        """ Queued is the number of waiting jobs, active a dict per running job. """
+        with self._lock:
+            self._snapshot = dict(queued=queued, active=[dict(i) for i in active])
+
+    def job_done(self, code):
+        key = 'completed' if not code else 'stopped' if code == 123 else 'failed'
+        with self._lock:
+            self._counts[key] += 1
+
+    def status(self):
+        with self._lock:
+            return dict(self._snapshot, **self._counts, uptime=round(time.time() - self._started, 1))
+
+    def prometheus(self):
+        status = self.status()
+        lines = [
+            '# HELP webber_queue_length Jobs waiting to start.',
+            '# TYPE webber_queue_length gauge',
+            f'webber_queue_length {status["queued"]}',
+            '# HELP webber_active_jobs Jobs running.',
+            '# TYPE webber_active_jobs gauge',
+            f'webber_active_jobs {len(status["active"])}',
+            '# HELP webber_jobs_total Finished jobs by result.',
+            '# TYPE webber_jobs_total counter',
+        ]
+        lines += [f'webber_jobs_total{{result="{key}"}} {status[key]}' for key in ('completed', 'failed', 'stopped')]
+
+        for name, key, text in (('pass', 'pass', 'Current pass of the job.'),
+                                ('passes', 'passes', 'Passes of the job.'),
+                                ('percent', 'percent', 'Progress of the current pass.'),
+                                ('fps', 'fps', 'Encoding speed in frames per second.'),
+                                ('speed', 'speed', 'Encoding speed as a multiple of realtime.'),
+                                ('eta_seconds', 'eta', 'Estimated seconds left.')):
+            lines += [f'# HELP webber_job_{name} {text}', f'# TYPE webber_job_{name} gauge']
+            lines += [f'webber_job_{name}{{job="{_escape(job["id"])}",name="{_escape(job["name"])}"}} {job[key]}'
+                      for job in status['active'] if job.get(key) is not None]
+        return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    state = None
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            body, content_type = self.state.prometheus(), 'text/plain; version=0.0.4'
+        elif path in ('/', '/status'):
+            body, content_type = json.dumps(self.state.status()), 'application/json'
+        else:
+            self.send_error(404)
+            return
+
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        log.debug(f'{self.address_string()} {format % args}')
+
+
+class MetricsServer:
+    """ Serves /metrics (Prometheus text) and /status (JSON) on localhost, from daemon threads. """
+
+    def __init__(self, state: MetricsState, port):
+        handler = type('Handler', (_Handler,), dict(state=state))
+        self._server = ThreadingHTTPServer((HOST, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='Webber metrics', daemon=True)
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        log.info(f'Serving metrics on http://{HOST}:{self.port}/metrics')
+
+    def stop(self):
+        # shutdown() waits for the serving loop to notice, which isn't done on the caller's thread
+        threading.Thread(target=self._shutdown, daemon=True).start()
+
+    def _shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        log.info('Stopped serving metrics')
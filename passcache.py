@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import shutil
+
+from utils import get_logger, get_option
+
+log = get_logger('Webber.PassCache')
+
+CACHE_DIR = 'pass_cache'
+MAX_ENTRIES = 20
+
+# Options that don't change the first pass statistics, or only decide where things go.
+IGNORED_OPTIONS = {'-b:v', '-maxrate', '-bufsize', '-passlogfile', '-threads', '-tile-columns', '-tile-rows',
+                   '-tiles', '-progress', '-metadata'}
+IGNORED_FLAGS = {'-y', '-nostdin', '-hide_banner', '-nostats'}
+
+
+class PassCache:
+    """
+    Keeps the logs of finished first passes, so a job with the same source, trim, crop, speed and
+    encoder settings can skip straight to the second pass. Only the newest entries are kept.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_entries=MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def key(self, file_name, command):
+        """ Returns the cache key of a first pass command, or None if the source can't be read. """
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+
+        parts = []
+        idx = 0
+        # Last item is the output, which is just the null device for the first pass
+        while idx < len(command) - 1:
+            item = command[idx]
+            if item in IGNORED_OPTIONS:
+                idx += 2
+                continue
+            if item not in IGNORED_FLAGS:
+                parts.append(item)
+            idx += 1
+
+        payload = json.dumps([os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns, parts])
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.log')
+
+    @staticmethod
+    def _log_file(command):
+        return f'{get_option(command, "-passlogfile", "ffmpeg2pass")}-0.log'
+
+    def has(self, key) -> bool:
+        return os.path.isfile(self._path(key))
+
+    def restore(self, key, command) -> bool:
+        """ Copies a cached first pass log to where the second pass of command will read it. """
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return False
+
+        try:
+            shutil.copyfile(path, self._log_file(command))
+            # Marks the entry as recently used
+            os.utime(path)
+        except OSError as e:
+            log.error(f'Failed to restore first pass {key}: {e}')
+            return False
+        return True
+
+    def store(self, key, command):
+        """ Saves the log written by the first pass command. """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp = self._path(key) + '.tmp'
+            shutil.copyfile(self._log_file(command), temp)
+            os.replace(temp, self._path(key))
+        except OSError as e:
+            log.error(f'Failed to cache first pass {key}: {e}')
+            return
+        self.prune()
+
+    def prune(self):
+        try:
+            entries = [os.path.join(self.cache_dir, i) for i in os.listdir(self.cache_dir) if i.endswith('.log')]
+        except OSError:
+            return
+
+        entries.sort(key=os.path.getmtime, reverse=True)
+        for path in entries[self.max_entries:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import statistics
+import time
+
+from utils import get_logger
+
+log = get_logger('Webber.Planner')
+
+HISTORY_FILE = 'webber_history.jsonl'
+
+# WebM cues, cluster headers and metadata, as a share of the file plus a fixed part
+CONTAINER_OVERHEAD = 0.005
+FIXED_OVERHEAD = 16 * 1024
+# Aim a little below the limit, so a typical miss still fits
+SAFETY_MARGIN = 0.97
+# Finished jobs needed before the history is trusted over the fallback
+MIN_SAMPLES = 3
+# Only the newest jobs are used, so encoder or preset changes take over quickly
+RECENT_SAMPLES = 30
+
+
+def resolution_bucket(resolution):
+    if not resolution:
+        return 'unknown'
+    height = min(int(resolution[0]), int(resolution[1]))
+    for bucket in (480, 720, 1080, 1440):
+        if height <= bucket:
+            return f'{bucket}p'
+    return '2160p'
+
+
+def plan_key(format_name, encoding, resolution):
+    """ Key that groups jobs which should over/undershoot the same way. """
+    preset = hashlib.sha1(json.dumps(encoding.commands).encode('utf-8')).hexdigest()[:8]
+    return f'{format_name}/{preset}/{resolution_bucket(resolution)}'
+
+
+class BitratePlanner:
+    """
+    Picks the video bitrate for a target size, and learns how far off the encoders end up.
+    Every finished job is appended to a local history, and the ratio between the video size that was
+    asked for and what was produced is used to correct the next plan for the same format, preset and resolution.
+    """
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self._history = None
+
+    @property
+    def history(self):
+        if self._history is None:
+            self._history = []
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            self._history.append(json.loads(line))
+                        except ValueError:
+                            continue
+            except OSError:
+                pass
+        return self._history
+
+    def correction(self, key):
+        """ Returns the median produced/planned video size ratio, from the closest matching history. """
+        format_name, preset, _ = key.split('/')
+        matchers = [
+            lambda i: i['key'] == key,
+            lambda i: i['key'].startswith(f'{format_name}/{preset}/'),
+            lambda i: i['key'].startswith(f'{format_name}/'),
+        ]
+        for matcher in matchers:
+            ratios = [i['ratio'] for i in self.history if matcher(i)][-RECENT_SAMPLES:]
+            if len(ratios) >= MIN_SAMPLES:
+                return min(max(statistics.median(ratios), 0.5), 2.0)
+        return 1.0
+
+    @staticmethod
+    def _usable_bytes(target_size):
+        target_bytes = target_size * 1024 ** 2
+        return (target_bytes * SAFETY_MARGIN - FIXED_OVERHEAD) / (1 + CONTAINER_OVERHEAD)
+
+    def plan(self, target_size, duration, audio_bitrate, key):
+        """ Returns the video bitrate in kbps for a target size in MB, or 0 if the audio alone is too large. """
+        audio_bytes = audio_bitrate * 1000 / 8 * duration
+        video_bytes = self._usable_bytes(target_size) - audio_bytes
+        if video_bytes <= 0:
+            return 0
+
+        correction = self.correction(key)
+        bitrate = int(video_bytes * 8 / 1000 / duration / correction)
+        log.debug(f'Planned {bitrate} kbps for {target_size} MB ({key}, correction {correction:.3f})')
+        return bitrate
+
+    def record(self, key, target_size, video_bitrate, duration, audio_bitrate, out_path):
+        """ Adds a finished job to the history. """
+        try:
+            achieved = os.path.getsize(out_path)
+        except OSError as e:
+            log.error(f'Could not read size of {out_path}: {e}')
+            return
+
+        planned_video = video_bitrate * 1000 / 8 * duration
+        audio_bytes = audio_bitrate * 1000 / 8 * duration
+        produced_video = (achieved - FIXED_OVERHEAD) / (1 + CONTAINER_OVERHEAD) - audio_bytes
+        if planned_video <= 0 or produced_video <= 0:
+            return
+
+        entry = dict(time=int(time.time()), key=key, target=int(target_size * 1024 ** 2), achieved=achieved,
+                     video_bitrate=video_bitrate, audio_bitrate=audio_bitrate, duration=round(duration, 3),
+                     ratio=round(produced_video / planned_video, 4))
+        self.history.append(entry)
+        log.info(f'{out_path}: {achieved / 1024 ** 2:.2f} MB of {target_size} MB, '
+                 f'video ratio {entry["ratio"]:.3f}')
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        except OSError as e:
+            log.error(f'Could not save size history: {e}')
@@ -2,14 +2,15 @@ import sys
 import traceback
 import typing
 
-from PyQt5.QtCore import Qt, QSizeF, QPoint
+from PyQt5.QtCore import Qt, QSizeF, QPoint, QUrl, QTimer
 from PyQt5.QtGui import QShowEvent, QPainter
-from PyQt5.QtMultimedia import QMediaPlayer
+from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
 from PyQt5.QtMultimediaWidgets import QGraphicsVideoItem
 from PyQt5.QtWidgets import (QApplication, QHBoxLayout, QLabel,
                              QSizePolicy, QStyle, QVBoxLayout, QGraphicsScene, QProxyStyle, QGraphicsProxyWidget)
 from PyQt5.QtWidgets import QWidget, QPushButton
 
+import waveform
 from relay_widgets import RelayPushButton, RelaySlider
 from video import VideoOverlay, GraphicsView
 
@@ -123,6 +124,13 @@ class VideoWindow(QWidget):
         self.positionSlider.valueChanged.connect(self.setPosition)
         self.positionSlider.sliderPressed.connect(self.slider_pressed)
         self.positionSlider.sliderReleased.connect(self.slider_released)
+        self.positionSlider.hovered.connect(self.show_preview)
+        self.positionSlider.hover_left.connect(self.hide_preview)
+
+        # Thumbnail shown above the slider while hovering it
+        self.filmstrip = None
+        self.preview = QLabel(self, Qt.ToolTip)
+        self.preview.hide()
 
         # self.positionSliderF = QSlider(Qt.Horizontal)
         # self.positionSliderF.setRange(0, 0)
@@ -188,6 +196,9 @@ class VideoWindow(QWidget):
         self.mediaPlayer.error.connect(self.handleError)
 
         self.was_playing = False
+        # Position to return to once a proxy has replaced the source, and set while that happens
+        self._resume_position = 0
+        self.swapping_media = False
 
         # TODO: Arrow keys for fine control!
 
@@ -199,6 +210,41 @@ class VideoWindow(QWidget):
         if self.was_playing:
             self.mediaPlayer.play()
 
+    def play_proxy(self, proxy_path):
+        """
+        Plays a proxy instead of the source, from the same position. The video item keeps the size
+        of the source, so crop selections are still in source pixels, and the timeline is the same.
+        """
+        self._resume_position = self.mediaPlayer.position()
+        self.swapping_media = True
+        self.mediaPlayer.setMedia(QMediaContent(QUrl.fromLocalFile(proxy_path)))
+
+    def set_filmstrip(self, filmstrip):
+        self.filmstrip = filmstrip
+        if filmstrip is None:
+            self.hide_preview()
+
+    def set_waveform(self, overview):
+        if overview is None:
+            self.positionSlider.set_background(None)
+        else:
+            self.positionSlider.set_background(lambda width, height: waveform.render(overview, width, height))
+
+    def show_preview(self, position, global_pos):
+        if self.filmstrip is None:
+            return
+        thumbnail = self.filmstrip.thumbnail(position)
+        if thumbnail.isNull():
+            return
+        self.preview.setPixmap(thumbnail)
+        self.preview.resize(thumbnail.size())
+        top = self.positionSlider.mapToGlobal(QPoint(0, 0)).y()
+        self.preview.move(global_pos.x() - thumbnail.width() // 2, top - thumbnail.height() - 4)
+        self.preview.show()
+
+    def hide_preview(self):
+        self.preview.hide()
+
     def media_status_change(self, status):
         if status == QMediaPlayer.LoadedMedia:
             try:
@@ -211,10 +257,17 @@ class VideoWindow(QWidget):
                 self.mediaPlayer.play()
                 self.mediaPlayer.pause()
                 self.mediaPlayer.setMuted(False)
-                self.mediaPlayer.setPosition(0)
+                self.mediaPlayer.setPosition(self._resume_position)
                 self.mediaPlayer.blockSignals(False)
             except:
                 traceback.print_exc()
+            finally:
+                self._resume_position = 0
+                # Cleared after the other handlers of this status change have run
+                QTimer.singleShot(0, self._swap_done)
+
+    def _swap_done(self):
+        self.swapping_media = False
 
     def skip(self, time_ms):
         if not self.mediaPlayer.media().isNull():
@@ -226,6 +279,12 @@ class VideoWindow(QWidget):
                 self.mediaPlayer.play()
             self.mediaPlayer.blockSignals(False)
 
+    def show_frame(self, time_ms):
+        """ Pauses on a position, for stepping through frames. """
+        if not self.mediaPlayer.media().isNull():
+            self.mediaPlayer.pause()
+            self.mediaPlayer.setPosition(max(0, int(time_ms)))
+
     def resizeEvent(self, event) -> None:
         super(VideoWindow, self).resizeEvent(event)
         try:
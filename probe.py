@@ -0,0 +1,152 @@
+import json
+import os
+import re
+import subprocess
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+from utils import get_logger
+
+log = get_logger('Webber.Probe')
+
+# Probed files kept in memory, oldest are dropped first.
+CACHE_SIZE = 64
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+class ProbeError(Exception):
+    pass
+
+
+def _cache_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def probe(path) -> dict:
+    """
+    Runs ffprobe once on a file, and returns its JSON output with all streams and the format.
+    Results are cached by path, size and modification time, so a changed file is probed again.
+    This blocks while ffprobe runs, so use ProbeTask from the GUI thread.
+    """
+    try:
+        key = _cache_key(path)
+    except OSError as e:
+        raise ProbeError(f'Can not read {path}: {e}')
+
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    command = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_streams', '-show_format', path]
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise ProbeError(f'Could not start ffprobe: {e}')
+
+    if result.returncode:
+        raise ProbeError(result.stderr.decode('utf-8', 'replace').strip())
+
+    info = json.loads(result.stdout.decode('utf-8', 'replace'))
+    log.debug(f'Probed {path}')
+
+    with _lock:
+        _cache[key] = info
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
+
+
+def video_stream(info: dict):
+    for stream in info.get('streams', []):
+        if stream.get('codec_type') == 'video' and not stream.get('disposition', {}).get('attached_pic'):
+            return stream
+    return None
+
+
+def audio_streams(info: dict):
+    return [i for i in info.get('streams', []) if i.get('codec_type') == 'audio']
+
+
+def resolution(info: dict):
+    stream = video_stream(info)
+    if stream is None:
+        return None
+    return stream['width'], stream['height']
+
+
+def framerate(info: dict):
+    stream = video_stream(info)
+    if stream is None:
+        return None
+    for key in ('avg_frame_rate', 'r_frame_rate'):
+        num, _, den = stream.get(key, '0/0').partition('/')
+        try:
+            rate = float(num) / float(den or 1)
+        except (ValueError, ZeroDivisionError):
+            continue
+        if rate:
+            return rate
+    return None
+
+
+def bit_depth(info: dict):
+    """ Bits per color sample of the video, 8 when it can't be told. """
+    stream = video_stream(info)
+    if stream is None:
+        return None
+    try:
+        return int(stream['bits_per_raw_sample'])
+    except (KeyError, ValueError):
+        pass
+    match = re.search(r'p(\d+)(le|be)$', stream.get('pix_fmt', ''))
+    return int(match.group(1)) if match else 8
+
+
+def duration(info: dict):
+    try:
+        return float(info['format']['duration'])
+    except (KeyError, ValueError):
+        stream = video_stream(info) or {}
+        try:
+            return float(stream['duration'])
+        except (KeyError, ValueError):
+            return None
+
+
+def start_time(info: dict):
+    """ Timestamp (in seconds) of the start of the file, which -ss and -to are relative to. """
+    try:
+        return float(info['format']['start_time'])
+    except (KeyError, ValueError):
+        return 0.0
+
+
+class ProbeSignals(QObject):
+    # Path, probe result
+    finished = pyqtSignal(str, dict)
+    # Path, error message
+    failed = pyqtSignal(str, str)
+
+
+class ProbeTask(QRunnable):
+    """ Probes a file in a threadpool, and reports back with signals. """
+
+    def __init__(self, path):
+        super(ProbeTask, self).__init__()
+        self.path = path
+        self.signals = ProbeSignals()
+
+    def run(self):
+        try:
+            info = probe(self.path)
+        except Exception as e:
+            log.error(f'Failed to probe {self.path}: {e}')
+            self.signals.failed.emit(self.path, str(e))
+        else:
+            self.signals.finished.emit(self.path, info)
@@ -0,0 +1,90 @@
+import os
+import subprocess
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import mediacache
+from probe import video_stream
+from utils import get_logger
+
+log = get_logger('Webber.Proxy')
+
+PROXY_HEIGHT = 540
+# Sources above this height, bitrate (bits/s) or with these codecs are slow to scrub
+HEAVY_HEIGHT = 1080
+HEAVY_BITRATE = 40 * 1000 ** 2
+HEAVY_CODECS = ('hevc', 'av1', 'prores')
+# Proxies are large, so only a few are kept
+MAX_ENTRIES = 5
+
+
+def is_heavy(info: dict):
+    stream = video_stream(info)
+    if stream is None:
+        return False
+    try:
+        bitrate = int(stream.get('bit_rate') or info['format'].get('bit_rate') or 0)
+    except (KeyError, ValueError):
+        bitrate = 0
+    return stream.get('height', 0) > HEAVY_HEIGHT or bitrate > HEAVY_BITRATE or stream.get('codec_name') in HEAVY_CODECS
+
+
+def cached_proxy(path):
+    try:
+        proxy = mediacache.cache_path('proxies', path, '.mp4')
+    except OSError:
+        return None
+    return proxy if os.path.isfile(proxy) else None
+
+
+def make_proxy(path, on_start=None):
+    """
+    Makes a small, short GOP copy of a source that plays and seeks quickly. It has the same timeline as the
+    source, so positions in it are positions in the source. Blocks while ffmpeg runs, on_start gets its process.
+    """
+    proxy = mediacache.cache_path('proxies', path, '.mp4')
+    # Written under another name first, so a half made proxy is never used
+    partial = proxy + '.part'
+    command = ['ffmpeg', '-hide_banner', '-nostdin', '-y', '-v', 'error', '-i', path,
+               '-map', '0:v:0', '-map', '0:a:0?', '-sn',
+               '-vf', f'scale=-2:min({PROXY_HEIGHT}\\,ih)', '-c:v', 'libx264', '-preset', 'ultrafast',
+               '-tune', 'fastdecode', '-crf', '28', '-g', '10', '-pix_fmt', 'yuv420p',
+               '-c:a', 'aac', '-b:a', '96k', '-movflags', '+faststart', '-f', 'mp4', partial]
+    with subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as process:
+        if on_start is not None:
+            on_start(process)
+        _, error = process.communicate()
+    if process.returncode:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise RuntimeError(error.decode('utf-8', 'replace').strip())
+
+    os.replace(partial, proxy)
+    mediacache.prune('proxies', MAX_ENTRIES)
+    log.info(f'Made proxy {proxy} for {path}')
+    return proxy
+
+
+class ProxySignals(QObject):
+    # Source path, proxy path
+    finished = pyqtSignal(str, str)
+
+
+class ProxyTask(mediacache.CacheTask):
+    """ Makes the proxy of a source in a threadpool. """
+
+    def __init__(self, path):
+        super(ProxyTask, self).__init__()
+        self.path = path
+        self.signals = ProxySignals()
+
+    def work(self):
+        try:
+            proxy = cached_proxy(self.path) or make_proxy(self.path, self.watch)
+        except Exception as e:
+            if not self.cancelled:
+                log.error(f'Failed to make proxy for {self.path}: {e}')
+        else:
+            self.signals.finished.emit(self.path, proxy)
@@ -0,0 +1,188 @@
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QTableView, QStyledItemDelegate, QStyleOptionProgressBar, QApplication, QStyle, \
+    QHeaderView, QAbstractItemView
+
+from telemetry import format_eta
+
+# Updates are collected and shown at most this often, however fast the jobs report
+REFRESH_MS = 250
+# Finished rows kept below the running and queued ones
+MAX_FINISHED = 20
+
+QUEUED, RUNNING, PAUSED, DONE, FAILED, STOPPED = 'Queued', 'Running', 'Paused', 'Done', 'Failed', 'Stopped'
+
+
+class QueueModel(QAbstractTableModel):
+    """
+    A row per job, with its state and the latest progress.
+    Changes are only stored when they arrive, and the rows that changed are sent to the view on a timer,
+    so the cost of redrawing doesn't depend on how often ffmpeg reports.
+    The ETA of a running job is asked from eta(job_id) when its row is sent, for the same reason.
+    """
+    COLUMNS = ('Name', 'Status', 'Pass', 'Progress', 'Speed', 'Size', 'ETA')
+    PROGRESS_COLUMN = 3
+    # Sent after the view is updated
+    flushed = pyqtSignal()
+
+    def __init__(self, parent=None, eta=None):
+        super(QueueModel, self).__init__(parent)
+        self._eta = eta
+        self._rows = []
+        self._ids = {}
+        self._dirty = set()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(REFRESH_MS)
+        self._timer.timeout.connect(self.flush)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        column = index.column()
+        if role == Qt.ToolTipRole:
+            return row['name']
+        if role == Qt.UserRole and column == self.PROGRESS_COLUMN:
+            return row['percent']
+        if role != Qt.DisplayRole:
+            return None
+
+        if column == 0:
+            return row['name']
+        if column == 1:
+            return row['status']
+        if column == 2:
+            return f'{row["cur_pass"]}/{row["passes"]}' if row['cur_pass'] else ''
+        if column == 3:
+            return f'{row["percent"]}%' if row['percent'] is not None else ''
+        if column == 4:
+            return f'{row["fps"]:.1f} fps, {row["speed"]:.2f}x' if row['fps'] is not None and row['speed'] else ''
+        if column == 5:
+            return f'{row["size"] / 1024 ** 2:.1f} MB' if row['size'] is not None else ''
+        if column == 6:
+            return format_eta(row['eta'])
+        return None
+
+    def add_job(self, job_id, name):
+        self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows))
+        self._rows.append(dict(id=job_id, name=name, status=QUEUED, cur_pass=None, passes=None, percent=None,
+                               fps=None, speed=None, size=None, eta=None))
+        self._ids[job_id] = len(self._rows) - 1
+        self.endInsertRows()
+
+    def _update(self, job_id, **values):
+        idx = self._ids.get(job_id)
+        if idx is None:
+            return
+        self._rows[idx].update(values)
+        self._dirty.add(job_id)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def set_status(self, job_id, status):
+        self._update(job_id, status=status)
+
+    def set_eta(self, job_id, eta):
+        self._update(job_id, eta=eta)
+
+    def set_pass(self, job_id, cur_pass, passes):
+        self._update(job_id, cur_pass=cur_pass, passes=passes, percent=None, fps=None, speed=None, size=None)
+
+    def eta(self, job_id):
+        """ ETA of a job as of the last flush. """
+        idx = self._ids.get(job_id)
+        return self._rows[idx]['eta'] if idx is not None else None
+
+    def update_progress(self, job_id, items):
+        values = dict(percent=items.get('percent'), fps=items.get('fps'), speed=items.get('speed'),
+                      size=items.get('total_size'))
+        # Chunked jobs report the parts done instead of passes
+        if items.get('pass'):
+            values.update(cur_pass=items['pass'], passes=items.get('passes'))
+        self._update(job_id, **values)
+
+    def finish(self, job_id, code):
+        status = DONE if not code else STOPPED if code == 123 else f'{FAILED} ({code})'
+        self._update(job_id, status=status, percent=100 if not code else None, fps=None, speed=None, eta=None)
+        self._prune()
+
+    def flush(self):
+        """ Tells the view about the rows that changed since the last flush. """
+        for job_id in self._dirty:
+            idx = self._ids.get(job_id)
+            if idx is not None:
+                if self._eta is not None and self._rows[idx]['status'] == RUNNING:
+                    self._rows[idx]['eta'] = self._eta(job_id)
+                self.dataChanged.emit(self.index(idx, 0), self.index(idx, len(self.COLUMNS) - 1))
+        self._dirty.clear()
+        self.flushed.emit()
+
+    def active_rows(self):
+        """ Copies of the rows of running and paused jobs. """
+        return [{'id': row['id'], 'name': row['name'], 'status': row['status'], 'pass': row['cur_pass'],
+                 'passes': row['passes'], 'percent': row['percent'], 'fps': row['fps'], 'speed': row['speed'],
+                 'eta': round(row['eta']) if row['eta'] is not None else None}
+                for row in self._rows if row['status'] in (RUNNING, PAUSED)]
+
+    def clear_finished(self):
+        self._remove([row['id'] for row in self._rows if row['status'] not in (QUEUED, RUNNING, PAUSED)])
+
+    def _prune(self):
+        finished = [row['id'] for row in self._rows if row['status'] not in (QUEUED, RUNNING, PAUSED)]
+        self._remove(finished[:-MAX_FINISHED])
+
+    def _remove(self, job_ids):
+        for job_id in job_ids:
+            idx = self._ids.get(job_id)
+            if idx is None:
+                continue
+            self.beginRemoveRows(QModelIndex(), idx, idx)
+            del self._rows[idx]
+            self.endRemoveRows()
+            self._ids = {row['id']: i for i, row in enumerate(self._rows)}
+            self._dirty.discard(job_id)
+
+
+class ProgressDelegate(QStyledItemDelegate):
+    """ Draws the progress column as a progress bar. """
+
+    def paint(self, painter, option, index):
+        percent = index.data(Qt.UserRole)
+        if percent is None:
+            super(ProgressDelegate, self).paint(painter, option, index)
+            return
+        bar = QStyleOptionProgressBar()
+        bar.rect = option.rect.adjusted(1, 2, -1, -2)
+        bar.minimum, bar.maximum, bar.progress = 0, 100, percent
+        bar.text = f'{percent}%'
+        bar.textVisible = True
+        QApplication.style().drawControl(QStyle.CE_ProgressBar, bar, painter)
+
+
+class QueueView(QTableView):
+    def __init__(self, model, *args):
+        super(QueueView, self).__init__(*args)
+        self.setModel(model)
+        self.setItemDelegateForColumn(QueueModel.PROGRESS_COLUMN, ProgressDelegate(self))
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setFocusPolicy(Qt.NoFocus)
+        self.verticalHeader().hide()
+        self.setShowGrid(False)
+        # Fixed widths, sizing to the contents would go through every row on each update
+        header = self.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.Interactive)
+        header.setSectionResizeMode(0, QHeaderView.Stretch)
+        for column, width in enumerate((0, 70, 40, 110, 120, 70, 60)):
+            if width:
+                self.setColumnWidth(column, width)
@@ -1,5 +1,6 @@
-from PyQt5.QtCore import Qt
-from PyQt5.QtWidgets import QPushButton, QSlider
+from PyQt5.QtCore import Qt, QPoint, pyqtSignal
+from PyQt5.QtGui import QPainter
+from PyQt5.QtWidgets import QPushButton, QSlider, QStyle
 
 
 class RelayPushButton(QPushButton):
@@ -11,7 +12,41 @@ class RelayPushButton(QPushButton):
 
 
 class RelaySlider(QSlider):
+    # Value under the mouse, global position of the mouse
+    hovered = pyqtSignal(int, QPoint)
+    hover_left = pyqtSignal()
+
+    def __init__(self, *args):
+        super(RelaySlider, self).__init__(*args)
+        self.setMouseTracking(True)
+        # Function that draws the background for a size, eg. a waveform
+        self._background = None
+        self._background_cache = None
+
+    def set_background(self, render):
+        """ Sets a function returning a QPixmap for a width and height, drawn behind the slider. """
+        self._background = render
+        self._background_cache = None
+        self.update()
+
+    def paintEvent(self, ev) -> None:
+        if self._background is not None:
+            if self._background_cache is None or self._background_cache.size() != self.size():
+                self._background_cache = self._background(self.width(), self.height())
+            painter = QPainter(self)
+            painter.drawPixmap(0, 0, self._background_cache)
+            painter.end()
+        super(RelaySlider, self).paintEvent(ev)
+
     def keyPressEvent(self, a0) -> None:
         self.parent().keyPressEvent(a0)
 
+    def mouseMoveEvent(self, ev) -> None:
+        super(RelaySlider, self).mouseMoveEvent(ev)
+        if self.maximum() > self.minimum():
+            value = QStyle.sliderValueFromPosition(self.minimum(), self.maximum(), ev.pos().x(), self.width())
+            self.hovered.emit(value, ev.globalPos())
 
+    def leaveEvent(self, a0) -> None:
+        super(RelaySlider, self).leaveEvent(a0)
+        self.hover_left.emit()
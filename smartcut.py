@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+from collections import deque
+
+from chunking import find_keyframes, write_concat_list
+from probe import probe, video_stream, framerate, start_time, ProbeError
+from utils import get_option, parse_timestamp
+from worker import Conversion
+
+# Encoder, bitstream filter and output tag for the codecs that can be cut without re-encoding all of it.
+# Parts are written as MPEG-TS, where the parameter sets are repeated in the stream, so the re-encoded
+# and copied parts can be joined even if the encoder picked different settings than the source.
+# The joined file is tagged avc3/hev1, which tells players to use those in-band parameter sets,
+# instead of only the ones from the first part.
+SMART_CODECS = {
+    'h264': (['-c:v', 'libx264', '-preset', 'fast', '-crf', '18'], 'h264_mp4toannexb', 'avc3'),
+    'hevc': (['-c:v', 'libx265', '-preset', 'fast', '-crf', '18', '-x265-params', 'log-level=error'],
+             'hevc_mp4toannexb', 'hev1'),
+}
+
+
+def plan_parts(start, end, keyframes, tolerance):
+    """
+    Splits start-end into the parts to re-encode and to copy. Returns (start, end, copy) tuples.
+    The partial GOP before the first keyframe and after the last one are re-encoded,
+    everything between the two keyframes is copied.
+    """
+    inside = [k for k in keyframes if start - tolerance <= k <= end + tolerance]
+    if not inside:
+        return [(start, end, False)]
+
+    first, last = inside[0], inside[-1]
+    parts = []
+    if first - start > tolerance:
+        parts.append((start, first, False))
+    else:
+        first = start
+    if last - first > tolerance:
+        parts.append((first, last, True))
+    if end - last > tolerance:
+        parts.append((last, end, False))
+    return parts
+
+
+class SmartCut(Conversion):
+    """
+    Frame accurate cut at close to remux speed.
+    Only the partial GOPs at the start and end are re-encoded, the rest is copied, and the parts joined.
+    Takes the regular cut command, which is used as is for crops and codecs that can't be cut this way.
+    """
+
+    def __init__(self, commands: list, target_name, file_name, duration):
+        super(SmartCut, self).__init__(commands, target_name, file_name, duration)
+        self.work_dir = None
+
+    def _plan(self, command):
+        """ Returns the stages that replace the cut command, or None to run it as is. """
+        try:
+            info = probe(self.file_name)
+        except ProbeError as e:
+            self._log.error(f'Can not smart cut, probing failed: {e}')
+            return None
+
+        stream = video_stream(info)
+        if stream is None or stream.get('codec_name') not in SMART_CODECS:
+            self._log.info(f'No smart cut for {stream.get("codec_name") if stream else "no video"}, copying instead')
+            return None
+        encoder, bsf, tag = SMART_CODECS[stream['codec_name']]
+
+        start = parse_timestamp(get_option(command, '-ss', 0))
+        end = parse_timestamp(get_option(command, '-to', self.dur + start))
+        # Half a frame, anything closer is on the keyframe
+        tolerance = 0.5 / (framerate(info) or 30)
+        keyframes = find_keyframes(self.file_name, start - tolerance, end + tolerance, start_time(info))
+        parts = plan_parts(start, end, keyframes, tolerance)
+        self._log.info('Smart cut parts: ' + ', '.join(f'{s:.3f}-{e:.3f} {"copy" if c else "encode"}'
+                                                     for s, e, c in parts))
+
+        self.work_dir = tempfile.mkdtemp(prefix='webber_cut_')
+        files = []
+        group = []
+        for idx, (part_start, part_end, copy) in enumerate(parts):
+            path = os.path.join(self.work_dir, f'part_{idx}.ts')
+            video = ['-c:v', 'copy'] if copy else encoder + ['-pix_fmt', stream.get('pix_fmt', 'yuv420p')]
+            group.append(['-hide_banner', '-nostdin', '-y', '-ss', f'{part_start:.6f}', '-i', self.file_name,
+                          '-t', f'{part_end - part_start:.6f}', '-map', '0:v:0', '-an', '-sn', *video,
+                          '-bsf:v', bsf, '-f', 'mpegts', path])
+            files.append(path)
+
+        sound = '-an' not in command
+        audio = os.path.join(self.work_dir, 'audio.mka')
+        if sound:
+            group.append(['-hide_banner', '-nostdin', '-y', '-ss', f'{start:.6f}', '-i', self.file_name,
+                          '-t', f'{end - start:.6f}', '-map', '0:a?', '-vn', '-sn', '-c:a', 'copy', audio])
+
+        list_file = os.path.join(self.work_dir, 'parts.txt')
+        write_concat_list(list_file, files)
+
+        join = ['-hide_banner', '-nostdin', '-y', '-f', 'concat', '-safe', '0', '-i', list_file]
+        if sound:
+            join.extend(['-i', audio, '-map', '0:v', '-map', '1:a?'])
+        join.extend(['-c', 'copy', '-tag:v', tag, '-avoid_negative_ts', 'make_zero', '-movflags', '+faststart', command[-1]])
+
+        longest = max(part_end - part_start for part_start, part_end, _ in parts)
+        return [group, join], [longest, end - start]
+
+    def run(self):
+        command = self.queue[0]
+        try:
+            plan = None if '-filter:v' in command else self._plan(command)
+        except OSError as e:
+            self._log.error(f'Can not smart cut: {e}')
+            plan = None
+
+        if plan is not None:
+            stages, self.durations = plan
+            self.queue = deque(stages)
+            self.passes = len(stages)
+        try:
+            super(SmartCut, self).run()
+        finally:
+            if self.work_dir is not None:
+                shutil.rmtree(self.work_dir, ignore_errors=True)
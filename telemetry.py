@@ -0,0 +1,181 @@
+import json
+import statistics
+import time
+
+from planner import resolution_bucket
+from utils import get_logger
+
+log = get_logger('Webber.Telemetry')
+
+TELEMETRY_FILE = 'webber_telemetry.jsonl'
+# Shortest time between two samples of a pass, doubled whenever a pass has MAX_SAMPLES of them
+SAMPLE_INTERVAL = 1.0
+MAX_SAMPLES = 300
+# Passes with less progress than this are estimated from the history instead of their own speed
+MIN_PERCENT = 2
+RECENT_JOBS = 30
+# Realtime speed used for passes without any history
+FALLBACK_SPEED = 1.0
+
+
+def telemetry_key(record):
+    return f'{record.get("preset") or record["kind"]}/{resolution_bucket(record.get("resolution"))}'
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return ''
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    return f'{hours}:{rest // 60:02d}:{rest % 60:02d}' if hours else f'{rest // 60}:{rest % 60:02d}'
+
+
+class SpeedHistory:
+    """
+    The timelines of finished jobs. Every job is a line with the samples of each pass,
+    and the realtime speed of each pass is used to estimate jobs with the same preset and resolution.
+    """
+
+    def __init__(self, path=TELEMETRY_FILE):
+        self.path = path
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = []
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue
+                        # Only the speeds are kept in memory
+                        if not entry.get('code'):
+                            self._entries.append(self._summary(entry))
+            except OSError:
+                pass
+        return self._entries
+
+    @staticmethod
+    def _summary(entry):
+        # Passes can be missing, eg. a first pass restored from the pass cache
+        return dict(key=entry['key'], total_passes=entry['total_passes'],
+                    speeds={i['number']: i['speed'] for i in entry['passes']})
+
+    def speed(self, key, cur_pass, passes):
+        """ Median realtime speed of a pass of jobs with the same key and number of passes, or None. """
+        speeds = [i['speeds'][cur_pass] for i in self.entries
+                  if i['key'] == key and i['total_passes'] == passes and i['speeds'].get(cur_pass)][-RECENT_JOBS:]
+        return statistics.median(speeds) if speeds else None
+
+    def add(self, entry):
+        if not entry.get('code'):
+            self.entries.append(self._summary(entry))
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        except OSError as e:
+            log.error(f'Could not save telemetry: {e}')
+
+
+HISTORY = SpeedHistory()
+
+
+class JobTelemetry:
+    """
+    Samples the progress of a job, for its ETA, and adds its timeline to the history when it ends.
+    A sample is [seconds into the pass, output time, fps, speed, bitrate in kbps, size in bytes].
+    """
+
+    def __init__(self, record, history=HISTORY):
+        self.record = record
+        self.history = history
+        self.key = telemetry_key(record)
+        durations = record['duration']
+        self.durations = list(durations) if isinstance(durations, (list, tuple)) else [durations]
+        self.started = None
+        self.passes = []
+        self.total_passes = len(record['commands'])
+        self._interval = SAMPLE_INTERVAL
+        self._last_sample = 0
+        self._percent = None
+
+    def _duration(self, cur_pass):
+        if not self.durations:
+            return 0
+        return self.durations[min(cur_pass, len(self.durations)) - 1] or 0
+
+    def _close_pass(self, now):
+        current = self.passes[-1]
+        current['wall'] = round(now - current['start'], 2)
+        # What was encoded, which is the pass length unless it was stopped early
+        media = current['last_out_time'] or self._duration(current['number'])
+        current['speed'] = round(media / current['wall'], 4) if current['wall'] > 0 and media else None
+
+    def sample(self, items):
+        if items.get('sampling'):
+            # Quality mode's CRF samples aren't passes, and would mix up the pass speeds
+            return
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        cur_pass = items.get('pass') or 1
+        self.total_passes = items.get('passes') or self.total_passes
+        if not self.passes or self.passes[-1]['number'] != cur_pass:
+            if self.passes:
+                self._close_pass(now)
+            self.passes.append(dict(number=cur_pass, start=now, samples=[], last_out_time=None))
+            self._interval = SAMPLE_INTERVAL
+            self._last_sample = 0
+
+        current = self.passes[-1]
+        self._percent = items.get('percent')
+        if items.get('out_time') is not None:
+            current['last_out_time'] = items['out_time']
+        if now - self._last_sample < self._interval:
+            return
+        self._last_sample = now
+        current['samples'].append([round(now - current['start'], 2), items.get('out_time'), items.get('fps'),
+                                   items.get('speed'), items.get('bitrate'), items.get('total_size')])
+        if len(current['samples']) >= MAX_SAMPLES:
+            current['samples'] = current['samples'][::2]
+            self._interval *= 2
+
+    def _pass_time(self, cur_pass, observed=None):
+        speed = self.history.speed(self.key, cur_pass, self.total_passes) or observed or FALLBACK_SPEED
+        return self._duration(cur_pass) / speed
+
+    def estimate(self):
+        """ Seconds the whole job should take, from the history. """
+        return sum(self._pass_time(i) for i in range(1, self.total_passes + 1))
+
+    def eta(self):
+        """ Seconds left of a running job, or the estimate if it hasn't reported yet. """
+        if not self.passes:
+            return self.estimate()
+
+        now = time.monotonic()
+        current = self.passes[-1]
+        elapsed = now - current['start']
+        observed = current['last_out_time'] / elapsed if current['last_out_time'] and elapsed > 0 else None
+        if self._percent is not None and self._percent >= MIN_PERCENT:
+            left = elapsed * (100 - self._percent) / self._percent
+        else:
+            left = max(0.0, self._pass_time(current['number'], observed) - elapsed)
+        return left + sum(self._pass_time(i, observed) for i in range(current['number'] + 1, self.total_passes + 1))
+
+    def finish(self, code):
+        if self.started is None:
+            return
+        now = time.monotonic()
+        self._close_pass(now)
+        entry = dict(time=int(time.time()), id=self.record.get('id'), key=self.key, kind=self.record['kind'],
+                     preset=self.record.get('preset'), resolution=self.record.get('resolution'), code=code,
+                     wall=round(now - self.started, 2), total_passes=self.total_passes,
+                     passes=[dict(number=i['number'], wall=i['wall'], speed=i['speed'], samples=i['samples'])
+                             for i in self.passes])
+        log.info(f'{self.record["target_name"]} took {entry["wall"]:.1f}s, pass speeds '
+                 + ', '.join(f'{i["speed"]:.2f}x' if i['speed'] else '-' for i in entry['passes']))
+        self.history.add(entry)
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, and some import Qt widgets
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+@pytest.fixture
+def source(tmp_path):
+    """ A small file standing in for a video, for the code that only stats or hashes the source. """
+    path = tmp_path / 'source.mp4'
+    path.write_bytes(b'video')
+    return str(path)
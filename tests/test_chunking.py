@@ -0,0 +1,62 @@
+import os
+
+import worker
+from chunking import plan_chunks, write_concat_list
+from worker import ChunkedConversion
+
+TEMPLATE = [['-hide_banner', '-ss', '0', '-to', '60', '-i', 'source.mp4', '-c:v', 'libvpx-vp9', '-b:v', '800k',
+             '-pass', '1', '-an', '-f', 'webm', os.devnull],
+            ['-hide_banner', '-ss', '0', '-to', '60', '-i', 'source.mp4', '-c:v', 'libvpx-vp9', '-b:v', '800k',
+             '-pass', '2', '-an', '-f', 'webm', 'out.webm']]
+
+
+def conversion():
+    return ChunkedConversion(TEMPLATE, 'out.webm', 'source.mp4', 60, audio=['-c:a', 'libopus'], workers=2,
+                             resume_dir=None)
+
+
+def test_short_range_is_one_chunk():
+    assert plan_chunks(0, 15, [5, 10], 4) == [(0, 15)]
+
+
+def test_range_is_split_evenly_without_keyframes():
+    assert plan_chunks(0, 40, [], 4) == [(0, 10), (10, 20), (20, 30), (30, 40)]
+
+
+def test_boundaries_snap_to_nearest_keyframe():
+    assert plan_chunks(0, 40, [9.5, 21, 31.2], 4) == [(0, 9.5), (9.5, 21), (21, 31.2), (31.2, 40)]
+
+
+def test_boundaries_making_tiny_chunks_are_skipped():
+    # Every boundary snaps to the keyframe near the start, only the first one is far enough from it
+    assert plan_chunks(0, 40, [6], 4) == [(0, 6), (6, 40)]
+
+
+def test_chunks_cover_the_range():
+    chunks = plan_chunks(12.5, 200, [30, 61.2, 95, 130.4, 170], 6)
+    assert chunks[0][0] == 12.5 and chunks[-1][1] == 200
+    assert all(a[1] == b[0] for a, b in zip(chunks, chunks[1:]))
+
+
+def test_source_without_audio_has_no_audio_task(monkeypatch):
+    monkeypatch.setattr(worker, 'probe', lambda path: {'streams': [{'codec_type': 'video'}]})
+    assert not conversion()._has_audio()
+    monkeypatch.setattr(worker, 'probe', lambda path: {'streams': [{'codec_type': 'audio'}]})
+    assert conversion()._has_audio()
+
+
+def test_join_without_sound_maps_no_audio(tmp_path):
+    command = conversion()._concat_command(str(tmp_path), ['a.webm', 'b.webm'], sound=False)
+    assert '1:a' not in command and command.count('-i') == 1
+    command = conversion()._concat_command(str(tmp_path), ['a.webm', 'b.webm'], sound=True)
+    assert command[command.index('-map', command.index('-map') + 1) + 1] == '1:a'
+
+
+def test_get_pids_without_running_chunks():
+    assert conversion().get_pids() == []
+
+
+def test_concat_list_escapes_quotes(tmp_path):
+    list_file = tmp_path / 'chunks.txt'
+    write_concat_list(str(list_file), ["/tmp/it's/chunk_0000.webm", '/tmp/plain.webm'])
+    assert list_file.read_text(encoding='utf-8') == "file '/tmp/it'\\''s/chunk_0000.webm'\nfile '/tmp/plain.webm'\n"
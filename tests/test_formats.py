@@ -0,0 +1,25 @@
+from formats import apply_thread_budget
+from utils import get_option
+
+
+def test_vp9_threads_and_tiles_follow_the_budget():
+    command = apply_thread_budget(['-c:v', 'libvpx-vp9', '-threads', '16', '-tile-columns', '3', 'out.webm'], 4)
+    assert get_option(command, '-threads') == '4'
+    assert get_option(command, '-tile-columns') == '1'
+
+
+def test_budget_never_raises_the_options():
+    command = apply_thread_budget(['-c:v', 'libvpx-vp9', '-threads', '2', '-tile-columns', '0', 'out.webm'], 32)
+    assert get_option(command, '-threads') == '2'
+    assert get_option(command, '-tile-columns') == '0'
+
+
+def test_aom_tiles_keep_their_rows():
+    command = apply_thread_budget(['-c:v', 'libaom-av1', '-threads', '16', '-tiles', '8x2', 'out.webm'], 8)
+    assert get_option(command, '-threads') == '8'
+    assert get_option(command, '-tiles') == '4x2'
+
+
+def test_commands_without_video_encoding_are_left_alone():
+    command = ['-i', 'in.mp4', '-vn', '-c:a', 'libopus', '-threads', '16', 'audio.webm']
+    assert apply_thread_budget(list(command), 2) == command
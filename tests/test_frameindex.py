@@ -0,0 +1,73 @@
+from array import array
+
+import pytest
+
+import frameindex
+import mediacache
+from frameindex import FrameIndex, build_index, cached_index
+
+# 10 fps, keyframe every second
+INDEX = FrameIndex(array('d', [i / 10 for i in range(50)]), array('d', [0.0, 1.0, 2.0, 3.0, 4.0]))
+
+
+def test_snap_to_closest_frame():
+    assert INDEX.snap(1.23) == pytest.approx(1.2)
+    assert INDEX.snap(1.27) == pytest.approx(1.3)
+    assert INDEX.snap(-1) == 0.0
+    assert INDEX.snap(60) == pytest.approx(4.9)
+
+
+def test_snap_to_closest_keyframe():
+    assert INDEX.snap(1.4, keyframe=True) == 1.0
+    assert INDEX.snap(1.6, keyframe=True) == 2.0
+
+
+def test_step_from_the_shown_frame():
+    assert INDEX.step(1.25, 1) == pytest.approx(1.3)
+    assert INDEX.step(1.25, -1) == pytest.approx(1.1)
+    # A position a rounding error before a frame is on it
+    assert INDEX.step(1.2999, 1) == pytest.approx(1.4)
+
+
+def test_step_stops_at_the_ends():
+    assert INDEX.step(0.05, -3) == 0.0
+    assert INDEX.step(4.85, 5) == pytest.approx(4.9)
+
+
+def test_count_frames_in_a_range():
+    assert INDEX.count(1.0, 2.0) == 10
+    assert INDEX.count(0, 10) == 50
+    assert INDEX.count(1.05, 1.3) == 2
+
+
+def test_keyframes_between_excludes_the_bounds():
+    assert INDEX.keyframes_between(1.0, 3.0) == [2.0]
+
+
+class FakeProbe:
+    """ Stands in for the ffprobe process, with packets in decode order. """
+    returncode = 0
+
+    def __init__(self, command, **kwargs):
+        self.stdout = [b'1.400000,K__\n', b'1.500000,___\n', b'1.450000,___\n', b'N/A,___\n', b'2.400000,K__\n']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def test_build_index_is_relative_to_start_time(monkeypatch, tmp_path):
+    monkeypatch.setattr(mediacache, 'CACHE_ROOT', str(tmp_path / 'cache'))
+    monkeypatch.setattr(frameindex.subprocess, 'Popen', FakeProbe)
+    source = tmp_path / 'source.ts'
+    source.write_bytes(b'video')
+
+    index = build_index(str(source), offset=1.4)
+    assert list(index.times) == pytest.approx([0.0, 0.05, 0.1, 1.0])
+    assert list(index.keyframes) == pytest.approx([0.0, 1.0])
+
+    cached = cached_index(str(source))
+    assert list(cached.times) == list(index.times)
+    assert list(cached.keyframes) == list(index.keyframes)
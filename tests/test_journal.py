@@ -0,0 +1,40 @@
+from journal import JobJournal
+
+
+def record(job_id):
+    return dict(id=job_id, kind='conversion', commands=[['-i', 'in.mp4', 'out.webm']])
+
+
+def test_pending_lists_unfinished_jobs_in_order(tmp_path):
+    journal = JobJournal(str(tmp_path / 'queue.jsonl'))
+    for job_id in ('a', 'b', 'c'):
+        journal.add(record(job_id))
+    journal.finish('b', 0)
+    assert [i['id'] for i in journal.pending()] == ['a', 'c']
+
+
+def test_missing_journal_has_no_jobs(tmp_path):
+    assert JobJournal(str(tmp_path / 'queue.jsonl')).pending() == []
+
+
+def test_half_written_line_is_ignored(tmp_path):
+    path = tmp_path / 'queue.jsonl'
+    journal = JobJournal(str(path))
+    journal.add(record('a'))
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"op":"add","record":{"id":"b"')
+    assert [i['id'] for i in journal.pending()] == ['a']
+
+
+def test_compact_keeps_only_unfinished_jobs(tmp_path):
+    path = tmp_path / 'queue.jsonl'
+    journal = JobJournal(str(path))
+    for job_id in ('a', 'b', 'c'):
+        journal.add(record(job_id))
+    journal.finish('a', 0)
+    journal.finish('c', 1)
+
+    assert [i['id'] for i in journal.compact()] == ['b']
+    assert len(path.read_text(encoding='utf-8').splitlines()) == 1
+    assert journal.pending() == [record('b')]
+    assert not (tmp_path / 'queue.jsonl.tmp').exists()
@@ -0,0 +1,40 @@
+from passcache import PassCache
+
+COMMAND = ['-hide_banner', '-nostdin', '-y', '-ss', '10.000', '-to', '20.000', '-i', 'source.mp4',
+           '-c:v', 'libvpx-vp9', '-b:v', '800k', '-maxrate', '800k', '-bufsize', '3200k', '-threads', '8',
+           '-pass', '1', '-passlogfile', 'webber_a', '-f', 'webm', '/dev/null']
+
+
+def with_option(command, option, value):
+    command = list(command)
+    command[command.index(option) + 1] = value
+    return command
+
+
+def test_key_ignores_rates_threads_and_pass_logs(tmp_path, source):
+    cache = PassCache(str(tmp_path / 'cache'))
+    key = cache.key(source, COMMAND)
+    assert key is not None
+    for option, value in (('-b:v', '600k'), ('-maxrate', '600k'), ('-bufsize', '2400k'), ('-threads', '2'),
+                          ('-passlogfile', 'webber_b')):
+        assert cache.key(source, with_option(COMMAND, option, value)) == key
+    assert cache.key(source, [i for i in COMMAND if i not in ('-y', '-nostdin')]) == key
+
+
+def test_key_changes_with_trim_and_encoder(tmp_path, source):
+    cache = PassCache(str(tmp_path / 'cache'))
+    key = cache.key(source, COMMAND)
+    assert cache.key(source, with_option(COMMAND, '-ss', '11.000')) != key
+    assert cache.key(source, with_option(COMMAND, '-c:v', 'libaom-av1')) != key
+
+
+def test_key_changes_with_the_source(tmp_path, source):
+    cache = PassCache(str(tmp_path / 'cache'))
+    key = cache.key(source, COMMAND)
+    with open(source, 'ab') as f:
+        f.write(b'more')
+    assert cache.key(source, COMMAND) != key
+
+
+def test_missing_source_has_no_key(tmp_path):
+    assert PassCache(str(tmp_path / 'cache')).key(str(tmp_path / 'missing.mp4'), COMMAND) is None
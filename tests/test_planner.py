@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+from planner import BitratePlanner, resolution_bucket, CONTAINER_OVERHEAD, FIXED_OVERHEAD, SAFETY_MARGIN
+
+KEY = 'VP9/abcd1234/1080p'
+
+
+def write_history(path, entries):
+    path.write_text(''.join(json.dumps(entry) + '\n' for entry in entries), encoding='utf-8')
+
+
+def test_no_history_has_no_correction(tmp_path):
+    assert BitratePlanner(str(tmp_path / 'history.jsonl')).correction(KEY) == 1.0
+
+
+def test_plan_fills_the_target_after_audio(tmp_path):
+    planner = BitratePlanner(str(tmp_path / 'history.jsonl'))
+    usable = (8 * 1024 ** 2 * SAFETY_MARGIN - FIXED_OVERHEAD) / (1 + CONTAINER_OVERHEAD)
+    video = usable - 96 * 1000 / 8 * 60
+    assert planner.plan(8, 60, 96, KEY) == int(video * 8 / 1000 / 60)
+
+
+def test_plan_is_zero_when_audio_does_not_fit(tmp_path):
+    assert BitratePlanner(str(tmp_path / 'history.jsonl')).plan(1, 600, 320, KEY) == 0
+
+
+def test_correction_is_the_median_of_the_matching_history(tmp_path):
+    path = tmp_path / 'history.jsonl'
+    write_history(path, [dict(key=KEY, ratio=r) for r in (1.1, 1.2, 1.3)] + [dict(key='VP8/x/720p', ratio=0.6)] * 3)
+    planner = BitratePlanner(str(path))
+    assert planner.correction(KEY) == pytest.approx(1.2)
+    assert planner.plan(8, 60, 96, KEY) < BitratePlanner(str(tmp_path / 'empty.jsonl')).plan(8, 60, 96, KEY)
+
+
+def test_correction_falls_back_to_the_same_format(tmp_path):
+    path = tmp_path / 'history.jsonl'
+    write_history(path, [dict(key='VP9/abcd1234/720p', ratio=0.9)] * 2 + [dict(key='VP9/other/480p', ratio=0.9)])
+    assert BitratePlanner(str(path)).correction(KEY) == pytest.approx(0.9)
+
+
+def test_correction_is_clamped_and_skips_broken_lines(tmp_path):
+    path = tmp_path / 'history.jsonl'
+    write_history(path, [dict(key=KEY, ratio=5.0)] * 3)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"key": "VP9/abc')
+    assert BitratePlanner(str(path)).correction(KEY) == 2.0
+
+
+def test_resolution_bucket_uses_the_short_side():
+    assert resolution_bucket((1920, 1080)) == '1080p'
+    assert resolution_bucket((1080, 1920)) == '1080p'
+    assert resolution_bucket((3840, 2160)) == '2160p'
+    assert resolution_bucket(None) == 'unknown'
@@ -0,0 +1,56 @@
+from worker import ProgressParser, ChunkedConversion
+
+BLOCK = (b'frame=120\nfps=59.9\nbitrate= 812.4kbits/s\ntotal_size=204800\nout_time_us=2000000\n'
+         b'speed=1.5x\nprogress=continue\n')
+
+
+def test_feed_parses_a_block():
+    blocks = ProgressParser().feed(BLOCK)
+    assert blocks == [dict(frame=120, fps=59.9, bitrate=812.4, total_size=204800, out_time=2.0, speed=1.5,
+                           finished=False)]
+
+
+def test_feed_joins_lines_split_between_reads():
+    parser = ProgressParser()
+    assert parser.feed(BLOCK[:30]) == []
+    blocks = parser.feed(BLOCK[30:])
+    assert len(blocks) == 1
+    assert blocks[0]['frame'] == 120 and blocks[0]['speed'] == 1.5
+
+
+def test_feed_returns_every_completed_block():
+    blocks = ProgressParser().feed(BLOCK + BLOCK.replace(b'continue', b'end'))
+    assert [i['finished'] for i in blocks] == [False, True]
+
+
+def test_feed_handles_missing_values():
+    blocks = ProgressParser().feed(b'frame=10\nfps=N/A\nout_time_us=N/A\nspeed=N/A\nprogress=continue\n')
+    assert blocks[0]['frame'] == 10
+    assert blocks[0]['fps'] is None and blocks[0]['out_time'] is None and blocks[0]['speed'] is None
+    assert blocks[0]['bitrate'] is None and blocks[0]['total_size'] is None
+
+
+def test_feed_drops_overlong_partial_line():
+    parser = ProgressParser()
+    parser.feed(b'x' * (ProgressParser.MAX_LINE + 1))
+    blocks = parser.feed(b'\nframe=5\nprogress=continue\n')
+    assert blocks[0]['frame'] == 5
+
+
+def test_chunked_status_adds_up_the_chunks():
+    process = ChunkedConversion([['-c:v', 'libvpx-vp9', '-b:v', '800k', 'out.webm']], 'out.webm', 'source.mp4', 60,
+                                workers=2, resume_dir=None)
+    process._done_size = 1000
+    process._progress = {
+        'first pass': [None, dict(fps=30.0, speed=1.0, total_size=50), False],
+        'second pass': [None, dict(fps=20.0, speed=0.5, total_size=400), True],
+        'starting': [None, None, True],
+    }
+    emitted = []
+    process.progress.connect(emitted.append)
+    process._emit_status(3, 12)
+
+    assert emitted[0]['fps'] == 50.0 and emitted[0]['speed'] == 1.5
+    # The first pass writes no output, only the finished tasks and the second pass count
+    assert emitted[0]['total_size'] == 1400
+    assert emitted[0]['percent'] == 25
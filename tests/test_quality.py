@@ -0,0 +1,27 @@
+import pytest
+
+from worker import QualityConversion, interpolate_crf, SAMPLE_COUNT, SAMPLE_LENGTH
+
+
+def test_interpolate_crf_on_log_size():
+    # Halfway in log(size) between the two probes
+    assert interpolate_crf([(24, 8_000_000), (40, 2_000_000)], 4_000_000) == pytest.approx(32)
+    # Past the probes the line is extended
+    assert interpolate_crf([(24, 8_000_000), (40, 2_000_000)], 16_000_000) == pytest.approx(16)
+
+
+def test_interpolate_crf_without_a_line():
+    assert interpolate_crf([(24, 1000), (24, 2000)], 1500) is None
+    assert interpolate_crf([(24, 1000), (40, 1000)], 1500) is None
+    assert interpolate_crf([(24, 0), (40, 1000)], 1500) is None
+
+
+def test_short_clips_are_encoded_whole():
+    assert QualityConversion._samples(10, 10 + SAMPLE_COUNT * SAMPLE_LENGTH * 2) is None
+
+
+def test_samples_are_spread_over_the_clip():
+    samples = QualityConversion._samples(0, 90)
+    assert len(samples) == SAMPLE_COUNT
+    assert [start + SAMPLE_LENGTH / 2 for start, _ in samples] == pytest.approx([15, 45, 75])
+    assert all(end - start == pytest.approx(SAMPLE_LENGTH) for start, end in samples)
@@ -0,0 +1,25 @@
+from chunking import work_key, load_manifest, save_manifest
+
+
+def test_work_key_ignores_rates_and_pass_logs(source):
+    first = ['-i', source, '-b:v', '800k', '-maxrate', '800k', '-bufsize', '3200k', '-passlogfile', 'a', 'out.webm']
+    second = ['-i', source, '-b:v', '760k', '-maxrate', '760k', '-bufsize', '3040k', '-passlogfile', 'b', 'out.webm']
+    assert work_key(source, [first]) == work_key(source, [second])
+
+
+def test_work_key_changes_with_the_job(source):
+    command = ['-i', source, '-b:v', '800k', 'out.webm']
+    key = work_key(source, [command])
+    assert key != work_key(source, [command[:-1] + ['-crf', '30', 'out.webm']])
+    assert key != work_key(source, [command], audio=['-c:a', 'libopus'])
+    with open(source, 'ab') as f:
+        f.write(b'more')
+    assert key != work_key(source, [command])
+
+
+def test_manifest_is_only_read_back_for_its_key(tmp_path):
+    manifest = dict(key='abc', start=0, end=60, chunks=[[0, 30], [30, 60]], done=[0], rates={'-b:v': '800k'})
+    save_manifest(str(tmp_path), manifest)
+    assert load_manifest(str(tmp_path), 'abc') == manifest
+    assert load_manifest(str(tmp_path), 'other') is None
+    assert not (tmp_path / 'manifest.json.tmp').exists()
@@ -0,0 +1,46 @@
+import subprocess
+
+import pytest
+
+import chunking
+from smartcut import plan_parts
+
+TOLERANCE = 0.02
+
+
+def test_no_keyframes_encodes_everything():
+    assert plan_parts(1, 9, [], TOLERANCE) == [(1, 9, False)]
+
+
+def test_partial_gops_are_encoded_and_the_rest_copied():
+    assert plan_parts(1, 9, [0, 2, 4, 6, 8, 10], TOLERANCE) == [(1, 2, False), (2, 8, True), (8, 9, False)]
+
+
+def test_start_on_a_keyframe_is_copied_from_the_start():
+    assert plan_parts(2.01, 9, [2, 4, 8], TOLERANCE) == [(2.01, 8, True), (8, 9, False)]
+
+
+def test_end_on_a_keyframe_has_no_encoded_tail():
+    assert plan_parts(1, 8, [2, 4, 8], TOLERANCE) == [(1, 2, False), (2, 8, True)]
+
+
+def test_single_keyframe_inside():
+    assert plan_parts(1, 9, [5], TOLERANCE) == [(1, 5, False), (5, 9, False)]
+
+
+def test_find_keyframes_is_relative_to_start_time(monkeypatch, source):
+    calls = []
+
+    def run(command, **kwargs):
+        calls.append(command)
+        out = b'1.400000,K__\n1.433000,___\n3.400000,K__\n5.400000,K__\n'
+        return subprocess.CompletedProcess(command, 0, stdout=out)
+
+    monkeypatch.setattr(chunking, 'cached_index', lambda path: None)
+    monkeypatch.setattr(chunking.subprocess, 'run', run)
+    # Like an MPEG-TS recording, where the first packet is at 1.4s
+    keyframes = chunking.find_keyframes(source, 0.5, 5, offset=1.4)
+
+    interval = calls[0][calls[0].index('-read_intervals') + 1]
+    assert interval == f'{0.5 + 1.4}%{5 + 1.4}'
+    assert keyframes == pytest.approx([2.0, 4.0])
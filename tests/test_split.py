@@ -0,0 +1,30 @@
+from commands import JobBuilder
+from utils import get_option
+
+
+def split(start, end, crop=None):
+    state = dict(filename='source.mp4', ts_start=start, ts_end=end, crop_area=crop, sound=True, destination='out',
+                 source_duration=120)
+    builder = JobBuilder(None, lambda *args: True, lambda *args: None, {})
+    commands, _, total = builder.split_commands(state)
+    assert total == 120
+    return commands[0]
+
+
+def test_split_is_one_read_at_both_marks():
+    command = split('00:10.500', '01:00.000')
+    assert get_option(command, '-segment_times') == '10.500,60.000'
+    assert get_option(command, '-segment_start_number') == '0'
+    assert command[-1].endswith('trim_%d.mp4')
+
+
+def test_split_from_the_start_keeps_the_middle_as_trim_1():
+    command = split('00:00.00', '01:00.000')
+    assert get_option(command, '-segment_times') == '60.000'
+    assert get_option(command, '-segment_start_number') == '1'
+
+
+def test_cropped_split_forces_keyframes_on_the_marks():
+    command = split('00:10.500', '01:00.000', crop=(10, 20, 640, 360))
+    assert get_option(command, '-filter:v') == 'crop=640:360:10:20'
+    assert get_option(command, '-force_key_frames') == '10.500,60.000'
@@ -0,0 +1,19 @@
+from formats import apply_thread_budget, merge_svt_params, svt_params
+from tuning import tuned_options
+from utils import get_option
+
+
+def test_svt_params_merge_keeps_the_order():
+    assert merge_svt_params('tune=0:lp=12', {'lp': 4, 'tile-rows': 1}) == 'tune=0:lp=4:tile-rows=1'
+    assert svt_params(None) == {}
+
+
+def test_svt_budget_goes_in_its_params():
+    command = ['-c:v', 'libsvtav1', '-svtav1-params', 'tune=0:tile-columns=0:lp=12', 'out.webm']
+    params = svt_params(get_option(apply_thread_budget(command, 4), '-svtav1-params'))
+    assert params == {'tune': '0', 'tile-columns': '0', 'lp': '4'}
+
+
+def test_svt_tuning_gives_params_to_merge():
+    options = tuned_options('libsvtav1', (1920, 1080), 8, 6)
+    assert options['-svtav1-params'] == {'tile-columns': 2, 'tile-rows': 0, 'lp': 6}
@@ -0,0 +1,25 @@
+from tuning import tuned_options
+
+
+def test_1080p_vp9():
+    options = tuned_options('libvpx-vp9', (1920, 1080), 8, 32)
+    assert options == {'-threads': '16', '-row-mt': '1', '-pix_fmt': 'yuv420p',
+                       '-tile-columns': '2', '-tile-rows': '0'}
+
+
+def test_4k_uses_more_tiles_but_not_more_threads_than_cores():
+    options = tuned_options('libvpx-vp9', (3840, 2160), 8, 12)
+    assert options['-tile-columns'] == '3' and options['-tile-rows'] == '1'
+    assert options['-threads'] == '12'
+
+
+def test_high_bit_depth_keeps_10_bit():
+    assert tuned_options('libvpx-vp9', (1280, 720), 10, 8)['-pix_fmt'] == 'yuv420p10le'
+
+
+def test_aom_tiles():
+    assert tuned_options('libaom-av1', (2560, 1440), 8, 64)['-tiles'] == '8x2'
+
+
+def test_unknown_resolution_is_treated_as_1080p():
+    assert tuned_options('libvpx-vp9', None, None, 32) == tuned_options('libvpx-vp9', (1920, 1080), 8, 32)
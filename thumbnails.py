@@ -0,0 +1,125 @@
+import bisect
+import json
+import math
+import os
+import re
+import subprocess
+
+from PyQt5.QtCore import QObject, pyqtSignal, QRect
+from PyQt5.QtGui import QPixmap
+
+import mediacache
+from utils import get_logger
+
+log = get_logger('Webber.Thumbnails')
+
+THUMB_WIDTH = 160
+MAX_THUMBS = 240
+# Shortest time between thumbnails, in seconds
+MIN_INTERVAL = 1.0
+COLUMNS = 16
+# Sources with cached sheets
+MAX_ENTRIES = 50
+
+
+def _paths(path):
+    sheet = mediacache.cache_path('thumbnails', path, '.jpg')
+    return sheet, os.path.splitext(sheet)[0] + '.json'
+
+
+def cached_sheet(path):
+    """ Returns the sheet and its index for a source if they're cached, otherwise None. """
+    try:
+        sheet, index = _paths(path)
+        with open(index, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.isfile(sheet):
+        return None
+    return sheet, meta
+
+
+def make_sheet(path, duration, resolution, on_start=None):
+    """
+    Extracts thumbnails at regular intervals into a single sprite sheet, and saves it with an index of
+    the time of every thumbnail. Only keyframes are decoded, so this is close to reading the file.
+    Blocks while ffmpeg runs, on_start gets its process.
+    """
+    sheet, index = _paths(path)
+    interval = max(MIN_INTERVAL, duration / MAX_THUMBS)
+    count = max(1, math.ceil(duration / interval))
+    width, height = resolution
+    thumb_height = max(2, round(THUMB_WIDTH * int(height) / int(width) / 2) * 2)
+    columns = min(COLUMNS, count)
+    rows = math.ceil(count / columns)
+
+    video_filter = (f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{interval:.3f})',"
+                    f"showinfo,scale={THUMB_WIDTH}:{thumb_height},tile={columns}x{rows}")
+    command = ['ffmpeg', '-hide_banner', '-nostdin', '-y', '-skip_frame', 'nokey', '-i', path,
+               '-map', '0:v:0', '-an', '-sn', '-vf', video_filter, '-vsync', 'vfr', '-frames:v', '1',
+               '-update', '1', '-q:v', '5', sheet]
+    with subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as process:
+        if on_start is not None:
+            on_start(process)
+        _, error = process.communicate()
+    error = error.decode('utf-8', 'replace')
+    if process.returncode:
+        # A stopped run can leave part of a sheet, which has no index so it isn't used, but takes space
+        try:
+            os.remove(sheet)
+        except OSError:
+            pass
+        raise RuntimeError(error.strip().splitlines()[-1:])
+
+    # showinfo logs every selected frame, in order
+    times = [float(i) for i in re.findall(r'pts_time:\s*([\d.]+)', error)]
+    meta = dict(width=THUMB_WIDTH, height=thumb_height, columns=columns, times=times[:columns * rows])
+    with open(index, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    mediacache.prune('thumbnails', MAX_ENTRIES)
+    log.info(f'Made {len(meta["times"])} thumbnails for {path}')
+    return sheet, meta
+
+
+class Filmstrip:
+    """ A loaded sprite sheet, which gives the thumbnail closest before a position. """
+
+    def __init__(self, sheet, meta):
+        self.sheet = QPixmap(sheet)
+        self.meta = meta
+
+    def thumbnail(self, position_ms) -> QPixmap:
+        times = self.meta['times']
+        if not times or self.sheet.isNull():
+            return QPixmap()
+        idx = max(0, bisect.bisect_right(times, position_ms / 1000) - 1)
+        width, height, columns = self.meta['width'], self.meta['height'], self.meta['columns']
+        return self.sheet.copy(QRect((idx % columns) * width, (idx // columns) * height, width, height))
+
+
+class ThumbnailSignals(QObject):
+    # Source path, sheet path, index
+    finished = pyqtSignal(str, str, dict)
+
+
+class ThumbnailTask(mediacache.CacheTask):
+    """ Makes the sprite sheet of a source in a threadpool, unless it's already cached. """
+
+    def __init__(self, path, duration, resolution):
+        super(ThumbnailTask, self).__init__()
+        self.path = path
+        self.duration = duration
+        self.resolution = resolution
+        self.signals = ThumbnailSignals()
+
+    def work(self):
+        try:
+            cached = cached_sheet(self.path)
+            sheet, meta = cached if cached is not None else \
+                make_sheet(self.path, self.duration, self.resolution, self.watch)
+        except Exception as e:
+            if not self.cancelled:
+                log.error(f'Failed to make thumbnails for {self.path}: {e}')
+        else:
+            self.signals.finished.emit(self.path, sheet, meta)
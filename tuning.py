@@ -0,0 +1,68 @@
+import os
+
+from formats import default_spec, encoding, passes, merge_svt_params
+from utils import get_logger
+
+log = get_logger('Webber.Tuning')
+
+# Narrowest tile the encoders allow, in pixels
+MIN_TILE_WIDTH = 256
+# Threads per tile that row based multithreading can keep busy
+THREADS_PER_TILE = 4
+
+
+def _pairs(options: list) -> dict:
+    return dict(zip(options[::2], options[1::2]))
+
+
+def tuned_options(codec, resolution, depth, cores):
+    """ Picks the threading, tiling and pixel format options for a source. """
+    if resolution:
+        width, height = int(resolution[0]), int(resolution[1])
+    else:
+        width, height = 1920, 1080
+
+    # log2 of the tile columns and rows, tiles that are too narrow are not allowed or hurt quality
+    columns = max(0, min(4, (width // MIN_TILE_WIDTH).bit_length() - 1))
+    rows = 1 if height >= 1440 else 0
+    threads = max(1, min(cores, (2 ** (columns + rows)) * THREADS_PER_TILE))
+    pix_fmt = 'yuv420p10le' if depth and depth > 8 else 'yuv420p'
+
+    options = {'-threads': str(threads), '-row-mt': '1', '-pix_fmt': pix_fmt}
+    if codec == 'libvpx-vp9':
+        options.update({'-tile-columns': str(columns), '-tile-rows': str(rows)})
+    elif codec == 'libaom-av1':
+        options['-tiles'] = f'{2 ** columns}x{2 ** rows}'
+    elif codec == 'libsvtav1':
+        # Merged into the preset's -svtav1-params by tune_encoding
+        options['-svtav1-params'] = {'tile-columns': columns, 'tile-rows': rows, 'lp': threads}
+    return options
+
+
+def tune_encoding(name, enc: encoding, resolution=None, depth=None, cores=None) -> encoding:
+    """
+    Returns a copy of a preset with the threads, tiles, row-mt and pixel format picked for the source,
+    its resolution (after cropping) and bit depth, and the cores of this machine.
+    Options that were changed or removed with the Tweaker are left as they are.
+    """
+    default = default_spec.get(name)
+    if default is None:
+        return enc
+
+    current = _pairs(enc.commands.all)
+    original = _pairs(default.commands.all)
+    tuned = tuned_options(current.get('-c:v'), resolution, depth, cores or os.cpu_count() or 1)
+
+    changed = []
+    for key, value in tuned.items():
+        if key == '-svtav1-params':
+            value = merge_svt_params(current.get(key), value)
+        if key in current and current[key] == original.get(key) and current[key] != value:
+            current[key] = value
+            changed.append(f'{key} {value}')
+    if changed:
+        log.debug(f'Tuned {name} for {resolution} at {depth} bit: {", ".join(changed)}')
+
+    options = [item for pair in current.items() for item in pair]
+    return encoding(enc.ext, enc.f, passes(options, list(enc.commands.first), list(enc.commands.second)),
+                    enc.two_pass)
@@ -131,6 +131,67 @@ def color_text(text: str, color: str = 'darkorange', weight: str = 'bold', secti
     return string
 
 
+def format_timestamp(time_ms) -> str:
+    """ Formats milliseconds as mm:ss.ms, the format used in the timestamp fields. """
+    time_ms = int(time_ms)
+    time_s = time_ms // 1000
+    return f'{time_s // 60:02d}:{time_s % 60:02d}.{time_ms % 1000:03d}'
+
+
+def get_millisecond_time(string_time) -> float:
+    """ Converts a mm:ss.ms timestamp from the timestamp fields to milliseconds. """
+    m, sms = string_time.split(':')
+    s, ms = sms.split('.')
+
+    t1 = float(m) * 1000 * 60
+    t2 = float(s) * 1000
+
+    return t1 + t2 + int(ms)
+
+
+def parse_timestamp(string_time) -> float:
+    """ Converts a ffmpeg style timestamp ([hh:]mm:ss.ms or plain seconds) to seconds. """
+    seconds = 0.0
+    for part in str(string_time).split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def get_option(command: list, key: str, default=None):
+    """ Returns the value of the last occurrence of an option in a ffmpeg command list. """
+    for idx in range(len(command) - 2, -1, -1):
+        if command[idx] == key:
+            return command[idx + 1]
+    return default
+
+
+def set_option(command: list, key: str, value: str) -> list:
+    """
+    Sets the value of every occurrence of an option in a ffmpeg command list.
+    If the option is missing, it's added as an output option, right before the output path.
+    """
+    found = False
+    for idx in range(len(command) - 1):
+        if command[idx] == key:
+            command[idx + 1] = value
+            found = True
+
+    if not found:
+        command[-1:-1] = [key, value]
+    return command
+
+
+def remove_option(command: list, key: str, has_value=True) -> list:
+    """ Removes every occurrence of an option (and its value) from a ffmpeg command list. """
+    idx = 0
+    while idx < len(command):
+        if command[idx] == key:
+            del command[idx:idx + 1 + has_value]
+        else:
+            idx += 1
+    return command
+
+
 class FileHandler:
     """
     A class to handle finding/loading/saving to files. So, IO operations.
@@ -175,6 +236,9 @@ class FileHandler:
         else:
             settings = get_file(self.settings_path)
             if settings:
+                # Settings added in newer versions get their default value
+                for key, value in get_base_settings().items():
+                    settings.setdefault(key, value)
                 return settings
             else:
                 return self.load_settings(reset=True)
@@ -185,7 +249,26 @@ class FileHandler:
 
 
 base_settings = {
-    'destination': None
+    'destination': None,
+    # Jobs running at the same time, 0 picks it based on the amount of cores.
+    'max_jobs': 0,
+    # Lets the next job start its first pass while the others are in their last pass.
+    'overlap_passes': True,
+    # How far over the target size an encode may be projected to end, before it's restarted with a lower bitrate.
+    'size_margin': 0.1,
+    # Cuts re-encode only the partial GOPs at the ends, so they land on the exact frame.
+    'smart_cut': False,
+    # Two-pass encodes decode and filter the source once, into a lossless file both passes read.
+    'intermediate': False,
+    # Where that file goes, a tmpfs is fastest. None uses the system temp folder.
+    'intermediate_dir': None,
+    # Heavy sources (4K, high bitrate, HEVC) are played from a small proxy made in the background.
+    'proxy': False,
+    # Start and end are moved to the closest 'frame' or 'keyframe' when they're set, None keeps the exact position.
+    'snap': 'frame',
+    # Serves the queue state on http://127.0.0.1:<metrics_port>/metrics and /status.
+    'metrics': False,
+    'metrics_port': 9187
 }
 
 
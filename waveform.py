@@ -0,0 +1,144 @@
+import subprocess
+
+from PyQt5.QtCore import QObject, pyqtSignal, Qt, QPointF
+from PyQt5.QtGui import QPixmap, QPainter, QColor, QPolygonF
+
+import mediacache
+from utils import get_logger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = get_logger('Webber.Waveform')
+
+# Buckets in the overview, it's scaled down to the width of the slider when drawn
+BUCKETS = 2048
+SAMPLE_RATE = 8000
+# Bytes read from ffmpeg at a time, which is all the PCM kept in memory
+READ_SIZE = 1 << 20
+MAX_ENTRIES = 50
+
+
+def available():
+    return np is not None
+
+
+def cached_waveform(path):
+    """ Returns the cached overview of a source, or None. """
+    if np is None:
+        return None
+    try:
+        return np.load(mediacache.cache_path('waveforms', path, '.npy'))
+    except (OSError, ValueError):
+        return None
+
+
+def build_waveform(path, duration, on_start=None):
+    """
+    Streams mono PCM of the first audio track from ffmpeg, and reduces it to BUCKETS rows of min, max and RMS.
+    Only one read and the unfinished bucket are kept, so memory use doesn't depend on the length.
+    Returns None for sources without sound, or if ffmpeg is stopped. Blocks while ffmpeg runs,
+    on_start gets its process.
+    """
+    per_bucket = max(1, int(duration * SAMPLE_RATE / BUCKETS) + 1)
+    command = ['ffmpeg', '-hide_banner', '-nostdin', '-v', 'error', '-i', path, '-map', '0:a:0', '-vn', '-sn',
+               '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-acodec', 'pcm_s16le', '-']
+
+    rows = []
+    leftover = np.empty(0, dtype=np.float32)
+    partial = b''
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as process:
+        if on_start is not None:
+            on_start(process)
+        while True:
+            data = process.stdout.read(READ_SIZE)
+            if not data:
+                break
+            # An odd byte count splits a sample, the half is kept for the next read
+            data = partial + data
+            usable = len(data) - len(data) % 2
+            partial = data[usable:]
+            samples = np.frombuffer(data[:usable], dtype='<i2').astype(np.float32) / 32768
+            samples = np.concatenate((leftover, samples))
+
+            full = len(samples) - len(samples) % per_bucket
+            if full:
+                rows.append(_reduce(samples[:full].reshape(-1, per_bucket)))
+            leftover = samples[full:]
+
+    if len(leftover):
+        rows.append(_reduce(leftover.reshape(1, -1)))
+    if process.returncode or not rows:
+        return None
+
+    overview = np.concatenate(rows)
+    try:
+        np.save(mediacache.cache_path('waveforms', path, '.npy'), overview)
+        mediacache.prune('waveforms', MAX_ENTRIES)
+    except OSError as e:
+        log.error(f'Could not cache waveform: {e}')
+    return overview
+
+
+def _reduce(buckets):
+    return np.stack((buckets.min(axis=1), buckets.max(axis=1), np.sqrt(np.mean(buckets ** 2, axis=1))), axis=1)
+
+
+def render(overview, width, height, color=QColor(255, 140, 0, 70), rms_color=QColor(255, 140, 0, 140)) -> QPixmap:
+    """ Draws an overview as a transparent image, with the peaks around the RMS. """
+    pixmap = QPixmap(max(1, width), max(1, height))
+    pixmap.fill(Qt.transparent)
+    if overview is None or not len(overview) or width < 2:
+        return pixmap
+
+    # Every pixel column gets the extremes of the buckets it covers
+    columns = min(width, len(overview))
+    starts = np.linspace(0, len(overview), columns, endpoint=False).astype(int)
+    lows = np.minimum.reduceat(overview[:, 0], starts)
+    highs = np.maximum.reduceat(overview[:, 1], starts)
+    rms = np.maximum.reduceat(overview[:, 2], starts)
+    # Quiet recordings would be a flat line otherwise
+    scale = 1 / max(float(np.abs(overview[:, :2]).max()), 1e-3)
+
+    middle = height / 2
+    xs = np.arange(columns) * (width / columns)
+
+    def band(top, bottom):
+        points = [QPointF(x, middle - y * middle) for x, y in zip(xs, top * scale)]
+        points += [QPointF(x, middle - y * middle) for x, y in zip(xs[::-1], (bottom * scale)[::-1])]
+        return QPolygonF(points)
+
+    painter = QPainter(pixmap)
+    painter.setPen(Qt.NoPen)
+    painter.setBrush(color)
+    painter.drawPolygon(band(highs, lows))
+    painter.setBrush(rms_color)
+    painter.drawPolygon(band(rms, -rms))
+    painter.end()
+    return pixmap
+
+
+class WaveformSignals(QObject):
+    # Source path, overview array
+    finished = pyqtSignal(str, object)
+
+
+class WaveformTask(mediacache.CacheTask):
+    """ Builds the overview of a source in a threadpool. """
+
+    def __init__(self, path, duration):
+        super(WaveformTask, self).__init__()
+        self.path = path
+        self.duration = duration
+        self.signals = WaveformSignals()
+
+    def work(self):
+        try:
+            overview = build_waveform(self.path, self.duration, self.watch)
+        except Exception as e:
+            log.error(f'Failed to make waveform for {self.path}: {e}')
+        else:
+            if overview is not None:
+                self.signals.finished.emit(self.path, overview)
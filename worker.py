@@ -1,148 +1,989 @@
-import re
+import math
+import os
+import shutil
+import tempfile
 import time
 import traceback
 from collections import deque
 
-import math
 from PyQt5.QtCore import *
 
-from utils import get_logger, color_text
+from chunking import find_keyframes, plan_chunks, work_key, load_manifest, save_manifest, sync_file, \
+    prune_work_dirs, write_concat_list, RESUME_CHUNK_LENGTH, RATE_OPTIONS
+from formats import apply_thread_budget
+from passcache import PassCache
+from planner import SAFETY_MARGIN
+from probe import probe, resolution, framerate, bit_depth, audio_streams, ProbeError
+from utils import get_logger, color_text, get_option, set_option, remove_option, parse_timestamp
+
+# Makes ffmpeg write machine readable progress to stdout, leaving stderr for the log.
+PROGRESS_ARGS = ['-progress', 'pipe:1', '-nostats']
+
+# Output size projections are too noisy before this share of the encode is done
+MIN_PROJECTION_PROGRESS = 0.1
+# Times an overshooting encode is restarted with a lower bitrate
+MAX_SIZE_RETRIES = 2
+# Expected size of the FFV1 intermediate compared to raw video, and how much more free space is wanted
+INTERMEDIATE_RATIO = 0.6
+INTERMEDIATE_HEADROOM = 1.5
+
+# Samples encoded for each CRF tried in quality mode, and their length in seconds
+SAMPLE_COUNT = 3
+SAMPLE_LENGTH = 2.0
+# CRF values allowed in quality mode, lower is better quality
+CRF_RANGE = (15, 50)
+# The first two CRF values tried in quality mode, a third is interpolated from their sizes
+CRF_PROBES = (24, 40)
+# Share of the video budget the samples should fit in, as they don't predict the size exactly
+SAMPLE_FIT = 0.9
+# Work folders of chunked jobs, kept until the job finishes so it can continue after a cancel or crash
+RESUME_DIR = 'resume'
+
+
+class ProgressParser:
+    """
+    Incremental parser for the key=value blocks ffmpeg writes with -progress.
+    Only the unfinished line is kept between reads, and it's dropped if it grows past MAX_LINE,
+    so the memory use doesn't depend on how much ffmpeg writes.
+    """
+    MAX_LINE = 1024
+
+    def __init__(self):
+        self._partial = b''
+        self._block = {}
+
+    def feed(self, data: bytes) -> list:
+        """ Returns a progress dict for every block completed by the given data. """
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        if len(self._partial) > self.MAX_LINE:
+            self._partial = b''
+
+        blocks = []
+        for line in lines:
+            key, sep, value = line.decode('utf-8', 'replace').strip().partition('=')
+            if not sep:
+                continue
+            self._block[key] = value
+            if key == 'progress':
+                blocks.append(self._parse(self._block))
+                self._block = {}
+        return blocks
+
+    @staticmethod
+    def _parse(block: dict) -> dict:
+        def number(key, cast=float, strip=''):
+            try:
+                return cast(block[key].strip().rstrip(strip))
+            except (KeyError, ValueError):
+                return None
 
-progress_pattern = re.compile(
-    r'(frame|fps|size|time|bitrate|speed)\s*\=\s*(\S+)'
-)
+        out_time = number('out_time_us', int)
+        return dict(
+            frame=number('frame', int),
+            fps=number('fps'),
+            bitrate=number('bitrate', strip='kbits/s'),
+            total_size=number('total_size', int),
+            out_time=out_time / 1_000_000 if out_time is not None else None,
+            speed=number('speed', strip='x'),
+            finished=block.get('progress') == 'end'
+        )
 
 
 class Conversion(QThread):
     process_output = pyqtSignal(str)
+    # Structured progress, see ProgressParser, with pass and percent added
+    progress = pyqtSignal(dict)
     done = pyqtSignal(int)
+    # Current pass, total passes
+    pass_changed = pyqtSignal(int, int)
 
-    def __init__(self, commands: list, target_name, file_name, duration):
+    def __init__(self, commands: list, target_name, file_name, duration, targets: dict = None, margin=0.1,
+                 intermediate_dir=None, frames=None):
+        """
+        Duration is either the length of the output, or a list with the length of every command's output.
+        Targets maps output paths to their size limit in bytes. Encodes projected to exceed it by more than
+        the margin are stopped early, and restarted with a lower bitrate.
+        With an intermediate_dir, two-pass encodes decode and filter the source once into a lossless file
+        there, which both passes read, if it fits.
+        Frames is the number of frames in the output, if it's known, which gives a more accurate progress.
+        """
         super(Conversion, self).__init__()
 
         self.name = target_name
         self.file_name = file_name
-        self.dur = duration
+        if isinstance(duration, (list, tuple)):
+            self.durations = list(duration)
+        else:
+            self.durations = [duration] * len(commands)
+        self.dur = self.durations[0] if self.durations else 0
+        self.frames = frames
         self._log = get_logger('Webber.Convert')
         self._log.info(f'Instanciated with target file {self.name}')
+        # Every item is a command, or a list of commands that run side by side
         self.queue = deque(commands)
-        try:
-            idx = self.queue[0].index('-b:v') + 1
-        except Exception:
-            idx = 0
-
-        self.bitrate = self.queue[0][idx] if idx else None
-        self.active_prog = None
+        last = self._group(self.queue[-1]) if self.queue else []
+        bitrates = [get_option(command, '-b:v') for command in last]
+        self.bitrate = ', '.join(i for i in bitrates if i) or None
+        self.passes = len(self.queue)
+        self.cur_pass = 0
+        self.active_progs = []
+        self.pass_cache = PassCache()
+        self.targets = targets or {}
+        self.margin = margin
+        self.intermediate_dir = intermediate_dir
+        self.intermediate = None
+        # First pass as it was before reading from the intermediate, which is what the pass cache knows
+        self.cache_command = None
+        # Output path to the video bitrate (kbps) it was restarted with
+        self.bitrate_overrides = {}
         self.abort = False
         self.current = None
+        # Last lines ffmpeg logged, shown when something fails
+        self.log_tail = deque(maxlen=30)
+
+    @staticmethod
+    def _group(stage):
+        return stage if stage and isinstance(stage[0], list) else [stage]
+
+    def set_thread_budget(self, threads):
+        """ Limits the encoder to the given amount of threads. Needs to be set before the conversion starts. """
+        for stage in self.queue:
+            group = self._group(stage)
+            for command in group:
+                apply_thread_budget(command, max(1, threads // len(group)))
+
+    def in_last_pass(self):
+        return self.cur_pass == self.passes
+
+    def _use_intermediate(self):
+        """ Rewrites the passes to read from a lossless intermediate, if one fits on disk. """
+        first = self.queue[0] if self.queue else None
+        if not first or isinstance(first[0], list) or get_option(first, '-pass') != '1' or len(self.queue) < 2:
+            return
+        key = self.pass_cache.key(self.file_name, first)
+        if key is not None and self.pass_cache.has(key):
+            # Only the second pass decodes the source anyway
+            return
+
+        try:
+            info = probe(self.file_name)
+            width, height = resolution(info)
+            start = parse_timestamp(get_option(first, '-ss', 0))
+            end = parse_timestamp(get_option(first, '-to', start + self.dur))
+            os.makedirs(self.intermediate_dir, exist_ok=True)
+            free = shutil.disk_usage(self.intermediate_dir).free
+        except (ProbeError, TypeError, ValueError, OSError) as e:
+            self._log.info(f'No intermediate: {e}')
+            return
+
+        raw = width * height * 1.5 * (2 if (bit_depth(info) or 8) > 8 else 1) * (framerate(info) or 60) * (end - start)
+        estimate = raw * INTERMEDIATE_RATIO
+        if estimate * INTERMEDIATE_HEADROOM > free:
+            self._log.info(f'No intermediate, needs about {estimate / 1024 ** 3:.1f} GB, '
+                           f'{free / 1024 ** 3:.1f} GB free in {self.intermediate_dir}')
+            return
+
+        fd, self.intermediate = tempfile.mkstemp(prefix='webber_', suffix='.mkv', dir=self.intermediate_dir)
+        os.close(fd)
+        self.cache_command = list(first)
+        self.queue = deque(self._from_intermediate(stage) for stage in self.queue)
+        self.queue.appendleft(self._intermediate_command(first))
+        self.durations.insert(0, self.durations[0])
+        self.passes += 1
+        self._log.info(f'Decoding once to {self.intermediate}, about {estimate / 1024 ** 3:.1f} GB')
+
+    def _intermediate_command(self, command):
+        idx = command.index('-i')
+        inputs = command[:idx + 2]
+        video_filter = get_option(command, '-filter:v')
+        command = [*inputs, '-map', '0:v:0', '-an', '-sn']
+        if video_filter:
+            command.extend(['-filter:v', video_filter])
+        return command + ['-c:v', 'ffv1', '-level', '3', '-slices', '16', '-g', '1', '-f', 'matroska',
+                          self.intermediate]
+
+    def _from_intermediate(self, stage):
+        """
+        Makes a command read the video from the intermediate, and everything else from the source,
+        which becomes the second input. The trim and filters are already done in the intermediate.
+        """
+        if isinstance(stage[0], list):
+            return [self._from_intermediate(command) for command in stage]
+
+        idx = stage.index('-i')
+        command = []
+        seek = []
+        n = 0
+        while n < idx:
+            if stage[n] in ('-ss', '-to'):
+                seek.extend(stage[n:n + 2])
+                n += 2
+            else:
+                command.append(stage[n])
+                n += 1
+        command.extend(['-i', self.intermediate, *seek, '-i', stage[idx + 1]])
+
+        rest = remove_option(stage[idx + 2:], '-filter:v')
+        for n, item in enumerate(rest):
+            if n > 0 and rest[n - 1] == '-map' and item.startswith('0:') and not item.startswith('0:v'):
+                rest[n] = '1:' + item[2:]
+            elif n > 0 and rest[n - 1] == '-filter_complex':
+                rest[n] = item.replace('[0:a', '[1:a')
+        return command + rest
 
     def run(self):
+        start = time.time()
+        if self.intermediate_dir is not None:
+            self._use_intermediate()
         try:
-            start = time.time()
-            self._log.info('Fetching process framerate..')
-            p = QProcess()
-            p.start(
-                f'ffprobe "{self.file_name}" -v 0 -of csv=p=0 -select_streams v:0 -show_entries stream=r_frame_rate')
-            p.waitForStarted()
-            p.waitForFinished()
-
-            info = p.readAll().data().decode('utf-8', 'replace').strip()
-            self._log.debug(f'Given framerate info: {info}')
+            self._run_passes(start)
+        finally:
+            self._drop_intermediate()
+
+    def _drop_intermediate(self):
+        if self.intermediate is not None:
             try:
-                x, y = info.split('/')
-                framerate = int(x) / int(y)
-            except Exception:
-                framerate = float(info)
-            self._log.info(f'Found framerate: {framerate:.4f}')
-        except Exception:
-            self._log.error('Failed to get info!')
-            framerate = None
+                os.remove(self.intermediate)
+            except OSError:
+                pass
+            self.intermediate = None
 
+    def _run_passes(self, start):
         cur_pass = 1
-        workers = []
+        code = 0
         while self.queue:
-            self.current = commands = self.queue.popleft()
-
-            worker = QProcess()
-            workers.append(worker)
-            worker.setWorkingDirectory('.')
-            worker.setProcessChannelMode(QProcess.MergedChannels)
-            worker.readyReadStandardOutput.connect(lambda *_: self.out_stream(worker, cur_pass, framerate))
-            worker.start('ffmpeg', commands)
-            self._log.info(f'Starting process, pass {cur_pass}')
-            worker.waitForStarted()
-            self.active_prog = worker
-            while not worker.waitForFinished(500):
-                if self.abort:
-                    self.queue.clear()
-                    worker.kill()
-                    self.active_prog = None
-                    self._log.info(f'Process terminated by user... '
-                                   f'Process was active for {time.time() - start} seconds.')
-                    self.done.emit(123)
-                    return
+            group = self._group(self.queue.popleft())
+            self.current = group
+            self.dur = self.durations[cur_pass - 1]
+
+            first_pass = len(group) == 1 and get_option(group[0], '-pass') == '1'
+            cache_key = self.pass_cache.key(self.file_name, self.cache_command or group[0]) if first_pass else None
+            if cache_key is not None and self.pass_cache.restore(cache_key, group[0]):
+                self._log.info(f'Reusing cached first pass {cache_key}, skipping pass {cur_pass}')
+                cur_pass += 1
+                continue
+
+            code = self._run_stage(group, cur_pass)
+            if code == 123:
+                self.queue.clear()
+                self._log.info(f'Process terminated by user... '
+                               f'Process was active for {time.time() - start} seconds.')
+                self.done.emit(123)
+                return
 
             cur_pass += 1
-            if worker.exitCode():
-                self._log.error(f'Process closed with error code {worker.exitCode()}. '
-                                f'Process was active for {time.time() - start} seconds.')
+            if code:
+                self._log.error(f'Process closed with error code {code}. '
+                                f'Process was active for {time.time() - start} seconds.\n'
+                                + '\n'.join(self.log_tail))
+                if self.intermediate is not None and group[0][-1] == self.intermediate:
+                    # Every pass after it reads the intermediate, they can only fail too
+                    self._drop_intermediate()
+                    self.queue.clear()
+                    self.process_output.emit(color_text(f'\nDecoding {self.name} failed with code {code}\n'))
+                    self.current = None
+                    self.done.emit(code)
+                    return
                 continue
 
-        self.done.emit(worker.exitCode())
-        self.active_prog = None
+            if cache_key is not None:
+                self.pass_cache.store(cache_key, group[0])
+
+        self.done.emit(code)
         self._log.info(f'Finished all passes! Process was active for {time.time() - start} seconds.')
         self.current = None
 
+    def _run_stage(self, group, cur_pass):
+        """ Runs the commands of a pass side by side, and returns the first error code or 123 if aborted. """
+        workers = [self._start_process(commands) for commands in group]
+        self._log.info(f'Starting {len(workers)} process(es), pass {cur_pass}')
+
+        self.active_progs = [worker for worker, _ in workers]
+        self.cur_pass = cur_pass
+        self.pass_changed.emit(cur_pass, self.passes)
+        latest = {}
+        retries = {}
+        try:
+            while any(worker.state() != QProcess.NotRunning for worker, _ in workers):
+                for worker, _ in workers:
+                    if worker.state() != QProcess.NotRunning:
+                        worker.waitForFinished(500 // len(workers))
+                self.out_stream(workers, latest, cur_pass)
+
+                for idx, commands in enumerate(group):
+                    worker = workers[idx][0]
+                    if worker not in latest or retries.get(idx, 0) >= MAX_SIZE_RETRIES:
+                        continue
+                    corrected = self._check_size(commands, latest[worker])
+                    if corrected is None:
+                        continue
+
+                    worker.kill()
+                    worker.waitForFinished(1000)
+                    del latest[worker]
+                    retries[idx] = retries.get(idx, 0) + 1
+                    group[idx] = commands = corrected
+                    workers[idx] = self._start_process(commands)
+                    self.active_progs = [worker for worker, _ in workers]
+
+                if self.abort:
+                    for worker, _ in workers:
+                        worker.kill()
+                        worker.waitForFinished(1000)
+                    return 123
+            self.out_stream(workers, latest, cur_pass)
+        finally:
+            self.active_progs = []
+
+        for worker, _ in workers:
+            if worker.exitStatus() != QProcess.NormalExit:
+                return 1
+            if worker.exitCode():
+                return worker.exitCode()
+        return 0
+
+    @staticmethod
+    def _start_process(commands):
+        worker = QProcess()
+        worker.setWorkingDirectory('.')
+        worker.start('ffmpeg', PROGRESS_ARGS + commands)
+        worker.waitForStarted()
+        return worker, ProgressParser()
+
+    def _check_size(self, commands, items):
+        """
+        Projects the final size of an encode from how large it is at the current position.
+        Returns the command with a corrected bitrate if it will overshoot, otherwise None.
+        """
+        out_path = commands[-1]
+        target = self.targets.get(out_path)
+        bitrate = get_option(commands, '-b:v')
+        if not target or not bitrate or not self.dur or not items['total_size'] or not items['out_time']:
+            return None
+
+        done = items['out_time'] / self.dur
+        if done < MIN_PROJECTION_PROGRESS:
+            return None
+
+        projected = items['total_size'] / done
+        if projected <= target * (1 + self.margin):
+            return None
+
+        old = float(bitrate.rstrip('k'))
+        new = old * target * SAFETY_MARGIN / projected
+        self._log.warning(f'{out_path} projected to {projected / 1024 ** 2:.2f} MB at {done:.0%}, '
+                          f'limit is {target / 1024 ** 2:.2f} MB. Restarting with {new:.0f}k instead of {old:.0f}k')
+        self.process_output.emit(color_text(f'\nOvershooting size, restarting {os.path.basename(out_path)} '
+                                            f'with {new:.0f}k bitrate\n'))
+
+        commands = list(commands)
+        set_option(commands, '-b:v', f'{new:.2f}k')
+        # Single pass encodes run without a max rate
+        if get_option(commands, '-maxrate') is not None:
+            set_option(commands, '-maxrate', f'{new:.2f}k')
+            set_option(commands, '-bufsize', f'{new * 4:.2f}k')
+        self.bitrate_overrides[out_path] = int(new)
+        return commands
+
+    def get_pids(self):
+        return [worker.processId() for worker in self.active_progs if worker.processId()]
+
     def get_pid(self):
-        if self.active_prog is not None:
-            return self.active_prog.processId()
+        pids = self.get_pids()
+        return pids[0] if pids else None
+
+    def _read_progress(self, workers, latest):
+        """
+        Reads what side by side encodes wrote since the last read. Returns their progress,
+        as the one furthest behind with the sizes added up, or None if none of them reported.
+        """
+        updated = False
+        for worker, parser in workers:
+            for line in worker.readAllStandardError().data().decode('utf-8', 'replace').splitlines():
+                if line.strip():
+                    self.log_tail.append(line)
+
+            blocks = parser.feed(worker.readAllStandardOutput().data())
+            if blocks:
+                # Only the newest state is of interest when several blocks arrived at once
+                latest[worker] = blocks[-1]
+                updated = True
+
+        if not updated:
+            return None
+
+        items = dict(min(latest.values(), key=lambda i: i['out_time'] or 0))
+        sizes = [i['total_size'] for i in latest.values() if i['total_size'] is not None]
+        items['total_size'] = sum(sizes) if sizes else None
+        return items
+
+    def out_stream(self, workers, latest, cur_pass):
+        items = self._read_progress(workers, latest)
+        if items is None:
+            return
+
+        items['pass'] = cur_pass
+        items['passes'] = self.passes
+        if self.frames and items['frame'] is not None:
+            items['percent'] = max(0, min(100, int(items['frame'] / self.frames * 100)))
+        elif self.dur and items['out_time'] is not None:
+            items['percent'] = max(0, min(100, int(items['out_time'] / self.dur * 100)))
+        else:
+            items['percent'] = None
+        self.progress.emit(items)
+
+        try:
+            output = color_text(f'\nWorking...\n', 'white')
+            output += f'Target name: {self.name}\n' \
+                f'Target bitrate: {self.bitrate + "b" if self.bitrate is not None else "Nan"}\n' \
+                f'Pass: {cur_pass} of {self.passes}\n'
+
+            if items['percent'] is not None:
+                output += f'Progress: {items["percent"]}% \n'
+            if items['out_time'] is not None:
+                output += f'Time: {items["out_time"]:.1f}s' + (f' of {self.dur:.1f}s' if self.dur else '') + '\n'
+            if items['frame'] is not None and self.frames:
+                output += f'Frame: {items["frame"]} of {self.frames}\n'
+            if items['fps'] is not None and items['speed'] is not None:
+                output += f'Speed: {items["fps"]:.1f} fps ({items["speed"]:.2f}x)\n'
+            if items['total_size'] is not None:
+                output += f'Size: {items["total_size"] / 1024 ** 2:.2f} MB\n'
+
+        except Exception as e:
+            self._log.error(f'Failed formatting with error: {e}')
+            traceback.print_exc()
+
+        else:
+            self.process_output.emit(output.replace('\n', '<br>'))
+
+
+def interpolate_crf(points, budget):
+    """
+    Returns the CRF where the size reaches the budget, on the line through two (crf, size) points.
+    Sizes shrink about exponentially as the CRF goes up, so the line is drawn through the log of the sizes.
+    Returns None if the points don't make a line.
+    """
+    (crf_1, size_1), (crf_2, size_2) = points
+    if crf_1 == crf_2 or min(size_1, size_2, budget) <= 0 or size_1 == size_2:
         return None
+    slope = (math.log(size_2) - math.log(size_1)) / (crf_2 - crf_1)
+    return crf_1 + (math.log(budget) - math.log(size_1)) / slope
+
+
+class QualityConversion(Conversion):
+    """
+    Size capped quality mode. Encodes a few short samples of the clip side by side at two CRF values,
+    and a third interpolated from their sizes, then runs a single CRF pass with the planned bitrate as the cap,
+    using the best quality predicted to fit the size. Short clips are encoded whole instead,
+    and the best of those encodes that fits is kept as the output.
+    Clips that don't fit at any tried CRF get the regular two-pass encode.
+    Takes the regular two-pass commands, which are also the fallback.
+    """
 
-    def out_stream(self, prog, cur_pass, framerate):
-        data = prog.readAllStandardOutput().data()
-        data: bytes
-        text = data.decode('utf-8', 'replace').strip()
-        print(text)
-        text_list = text.split('\n')
-
-        for i in reversed(text_list):
-            items = {
-                key: value for key, value in progress_pattern.findall(i)
-            }
-            if items:
-                break
+    def __init__(self, commands: list, target_name, file_name, duration, targets: dict = None, margin=0.1):
+        super(QualityConversion, self).__init__(commands, target_name, file_name, duration, targets, margin)
+        self._log = get_logger('Webber.Quality')
+        self.crf = None
+        # Output of a short clip encoded whole while searching, which needs no further encode
+        self.kept = None
+
+    def in_last_pass(self):
+        # The samples are encoded before the passes are known
+        return self.crf is not None and super(QualityConversion, self).in_last_pass()
+
+    def _crf_command(self, crf):
+        command = remove_option(list(self.queue[-1]), '-pass')
+        remove_option(command, '-passlogfile')
+        set_option(command, '-crf', str(crf))
+        return command
+
+    @staticmethod
+    def _sample_command(command, start, end, out_path):
+        """ Cuts a sample out of the final command, without sound so only the video is measured. """
+        sample = []
+        idx = 0
+        while idx < len(command) - 1:
+            item = command[idx]
+            if item in ('-c:a', '-b:a', '-ac', '-filter_complex') or \
+                    (item == '-map' and command[idx + 1].startswith(('0:a', '[a]'))):
+                idx += 2
+                continue
+            sample.append(item)
+            idx += 1
+        set_option(sample, '-ss', f'{start:.3f}')
+        set_option(sample, '-to', f'{end:.3f}')
+        remove_option(sample, '-an', has_value=False)
+        return sample + ['-an', out_path]
+
+    @staticmethod
+    def _samples(start, end):
+        """ Evenly spread sample ranges, or None when the clip is short enough to encode whole. """
+        length = end - start
+        if length <= SAMPLE_COUNT * SAMPLE_LENGTH * 2:
+            return None
+        step = length / SAMPLE_COUNT
+        return [(start + step * (i + 0.5) - SAMPLE_LENGTH / 2, start + step * (i + 0.5) + SAMPLE_LENGTH / 2)
+                for i in range(SAMPLE_COUNT)]
+
+    def _encode(self, commands, length, crf):
+        """
+        Runs encodes of the given length side by side, and reports their progress.
+        Returns False if any failed or the job was aborted.
+        """
+        workers = []
+        latest = {}
+        try:
+            for command in commands:
+                workers.append(self._start_process(command))
+                # Listed like the passes, so pausing the job pauses the samples too
+                self.active_progs = [worker for worker, _ in workers]
+
+            for worker, _ in workers:
+                while worker.state() != QProcess.NotRunning and not worker.waitForFinished(200):
+                    self._sample_status(workers, latest, length, crf)
+                    if self.abort:
+                        for other, _ in workers:
+                            other.kill()
+                            other.waitForFinished(1000)
+                        return False
+            self._sample_status(workers, latest, length, crf)
+        finally:
+            self.active_progs = []
+
+        for worker, _ in workers:
+            if worker.exitStatus() != QProcess.NormalExit or worker.exitCode():
+                self._log.error('Sample encode failed:\n' + '\n'.join(self.log_tail))
+                return False
+        return True
+
+    def _sample_status(self, workers, latest, length, crf):
+        items = self._read_progress(workers, latest)
+        if items is None:
+            return
+        # Not a pass of the job, so it's left out of the pass column and the telemetry
+        items['sampling'] = True
+        items['percent'] = max(0, min(100, int(items['out_time'] / length * 100))) \
+            if items['out_time'] is not None and length else None
+        self.progress.emit(items)
+
+        output = color_text('\nSampling...\n', 'white')
+        output += f'Target name: {self.name}\nCRF: {crf}\n'
+        if items['percent'] is not None:
+            output += f'Progress: {items["percent"]}%\n'
+        if items['fps'] is not None and items['speed'] is not None:
+            output += f'Speed: {items["fps"]:.1f} fps ({items["speed"]:.2f}x)\n'
+        if items['total_size'] is not None:
+            output += f'Size: {items["total_size"] / 1024 ** 2:.2f} MB\n'
+        self.process_output.emit(output.replace('\n', '<br>'))
+
+    def _predict(self, crf, samples, work_dir, length):
+        """
+        Returns the predicted size in bytes at a CRF and the encoded files, or None if aborted or failed.
+        Without samples the whole clip is encoded with the final command, so the size is the real one.
+        """
+        ext = get_option(self.queue[-1], '-f', 'webm')
+        if samples is None:
+            commands = [self._crf_command(crf)[:-1] + [os.path.join(work_dir, f'crf_{crf}.{ext}')]]
+            encode_length = length
         else:
+            encode_length = SAMPLE_LENGTH
+            commands = [self._sample_command(self._crf_command(crf), start, end,
+                                             os.path.join(work_dir, f'crf_{crf}_{idx}.{ext}'))
+                        for idx, (start, end) in enumerate(samples)]
+        if not self._encode(commands, encode_length, crf):
+            return None
+
+        files = [command[-1] for command in commands]
+        size = sum(os.path.getsize(file) for file in files)
+        predicted = size if samples is None else size / sum(end - start for start, end in samples) * length
+        self._log.info(f'CRF {crf}: predicted {predicted / 1024 ** 2:.2f} MB')
+        self.process_output.emit(f'<br>Sampling: CRF {crf} predicted to {predicted / 1024 ** 2:.2f} MB')
+        return predicted, files
+
+    def _search(self):
+        """
+        Returns the lowest CRF predicted to fit, or None to use the two-pass encode.
+        Tries at most three CRF values. A short clip's encode at that CRF is moved to the output.
+        """
+        command = self.queue[-1]
+        out_path = command[-1]
+        bitrate = get_option(command, '-b:v')
+        start = parse_timestamp(get_option(command, '-ss', 0))
+        end = get_option(command, '-to')
+        end = parse_timestamp(end) if end is not None else start + self.dur
+        if not bitrate or end <= start:
+            return None
+
+        samples = self._samples(start, end)
+        if samples is None and self.targets.get(out_path):
+            # Whole clip encodes include the sound and are exact, so they're held to the size limit itself
+            budget = self.targets[out_path]
+        else:
+            budget = float(bitrate.rstrip('k')) * 1000 / 8 * self.dur * SAMPLE_FIT
+
+        work_dir = tempfile.mkdtemp(prefix='webber_samples_')
+        try:
+            results = {}
+            for crf in CRF_PROBES:
+                result = self._predict(crf, samples, work_dir, end - start)
+                if result is None:
+                    return None
+                results[crf] = result
+
+            crf = interpolate_crf([(crf, results[crf][0]) for crf in CRF_PROBES], budget)
+            if crf is not None:
+                # Rounded up, as a higher CRF is the side that fits
+                crf = min(max(math.ceil(crf), CRF_RANGE[0]), CRF_RANGE[1])
+                if crf not in results:
+                    result = self._predict(crf, samples, work_dir, end - start)
+                    if result is None:
+                        return None
+                    results[crf] = result
+
+            fitting = [crf for crf, (predicted, _) in results.items() if predicted <= budget]
+            if not fitting:
+                return None
+            best = min(fitting)
+            if samples is None:
+                if os.path.exists(out_path):
+                    os.remove(out_path)
+                shutil.move(results[best][1][0], out_path)
+                self.kept = out_path
+            return best
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def run(self):
+        self.process_output.emit(color_text(f'\nSampling {self.name} to pick the quality...\n', 'white')
+                                 .replace('\n', '<br>'))
+        try:
+            self.crf = self._search()
+        except Exception:
+            traceback.print_exc()
+            self.crf = None
+
+        if self.abort:
+            self._log.info('Process terminated by user while sampling...')
+            self.done.emit(123)
             return
 
-            # frame=int(items['frame']),
-            # fps=float(items['fps']),
-            # size=int(items['size'].replace('kB', '')) // 1024,
-            # time=items['time'],
-            # bitrate=float(items['bitrate'].replace('kbits/s', '')),
-            # speed=float(items['speed'].replace('x', '')),
+        if self.kept is not None:
+            self._log.info(f'Kept the CRF {self.crf} encode of the whole clip')
+            self.process_output.emit(color_text(f'\nFinished {self.name} at CRF {self.crf}\n', 'white')
+                                     .replace('\n', '<br>'))
+            self.done.emit(0)
+            return
+
+        if self.crf is None:
+            self._log.info('No CRF is predicted to fit, using the two-pass encode')
+        else:
+            self._log.info(f'Encoding with CRF {self.crf}, capped at {self.bitrate}b')
+            self.queue = deque([self._crf_command(self.crf)])
+            self.durations = self.durations[-1:]
+            self.passes = 1
+        super(QualityConversion, self).run()
+
+
+class ChunkedConversion(QThread):
+    """
+    Encodes the trimmed range as several chunks in parallel, then joins them without re-encoding.
+    Takes the regular two-pass commands as a template, and rewrites the range,
+    pass log and output of them for every chunk.
+
+    With a resume_dir, the chunks are kept in a folder named after the job along with a manifest
+    of the finished ones. Running the same job again, after it was cancelled or interrupted,
+    only encodes the missing chunks before joining them.
+    """
+    process_output = pyqtSignal(str)
+    progress = pyqtSignal(dict)
+    done = pyqtSignal(int)
+    pass_changed = pyqtSignal(int, int)
+
+    def __init__(self, commands: list, target_name, file_name, duration, audio: list = None, workers=None,
+                 resume_dir=RESUME_DIR):
+        super(ChunkedConversion, self).__init__()
+
+        self.name = target_name
+        self.file_name = file_name
+        self.dur = duration
+        self.template = commands
+        self.audio = audio
+        self._log = get_logger('Webber.Chunked')
+        self._log.info(f'Instanciated with target file {self.name}')
+
+        self._fixed_workers = workers
+        self.set_thread_budget(os.cpu_count() or 1)
+
+        self.bitrate = get_option(commands[-1], '-b:v')
+        self.out_path = commands[-1][-1]
+        self.running = {}
+        # Worker to its progress parser, latest progress and whether it writes the task output
+        self._progress = {}
+        # Bytes of the finished task outputs
+        self._done_size = 0
+        self.abort = False
+        self.current = None
+        self.resume_dir = resume_dir
+
+    def set_thread_budget(self, threads):
+        """ Splits the given amount of threads between the chunk encoders. """
+        self.workers = self._fixed_workers if self._fixed_workers else max(1, threads // 4)
+        self.threads = max(1, threads // self.workers)
+
+    def in_last_pass(self):
+        # All chunks run both passes, there's no point where a single pass is left.
+        return False
+
+    def _chunk_commands(self, work_dir, idx, start, end):
+        commands = []
+        for command in self.template:
+            command = set_option(list(command), '-ss', f'{start:.3f}')
+            set_option(command, '-to', f'{end:.3f}')
+            apply_thread_budget(command, self.threads)
+            set_option(command, '-passlogfile', os.path.join(work_dir, f'pass_{idx}'))
+            commands.append(command)
+        commands[-1][-1] = self._task_output(work_dir, idx)
+        return commands
+
+    def _audio_command(self, work_dir, start, end):
+        return ['-hide_banner', '-nostdin', '-y',
+                '-ss', f'{start:.3f}', '-to', f'{end:.3f}', '-i', self.file_name,
+                *self.audio, '-vn', '-f', 'webm', self._task_output(work_dir, 'audio')]
+
+    def _has_audio(self):
+        """ Whether the source has sound to encode. If it can't be probed, the audio encode will tell. """
         try:
-            if framerate is not None and self.dur:
-                percent = int(int(items['frame']) / (framerate * self.dur) * 100)
-                percent = 100 if percent > 100 else percent
+            return bool(audio_streams(probe(self.file_name)))
+        except ProbeError as e:
+            self._log.error(f'Could not probe for audio: {e}')
+            return True
 
-                output = color_text(f'\nWorking...\n', 'white')
-                output += f'Target name: {self.name}\n' \
-                    f'Target bitrate: {self.bitrate + "b" if self.bitrate is not None else "Nan"}\n' \
-                    f'Pass: {cur_pass}\n' \
-                    f'Progress: {percent}% \n'
+    def _concat_command(self, work_dir, chunk_files, sound):
+        list_file = os.path.join(work_dir, 'chunks.txt')
+        write_concat_list(list_file, chunk_files)
 
-                output += f'Frame {items["frame"]} of {math.ceil(framerate * self.dur)}' + '\n' + f'Time: {items["time"]}'
+        command = ['-hide_banner', '-nostdin', '-y', '-f', 'concat', '-safe', '0', '-i', list_file]
+        if sound:
+            command.extend(['-i', self._task_output(work_dir, 'audio'), '-map', '0:v', '-map', '1:a'])
+        command.extend(['-c', 'copy', '-metadata', f'title={os.path.splitext(self.name)[0]}', self.out_path])
+        return command
 
-            else:
-                output = color_text(f'\nWorking...\n', 'white')
+    def _start(self, work_dir, idx, command, last):
+        """ Starts a command of a task, last is whether it writes the output of the task. """
+        worker = QProcess()
+        worker.setWorkingDirectory('.')
+        worker.setStandardErrorFile(os.path.join(work_dir, f'chunk_{idx}.log'), QIODevice.Append)
+        worker.start('ffmpeg', PROGRESS_ARGS + command)
+        worker.waitForStarted()
+        self._progress[worker] = [ProgressParser(), None, last]
+        return worker
 
-                output += f'Target name: {self.name}\n' \
-                    f'Target bitrate: {self.bitrate + "b" if self.bitrate is not None else "Nan"}\n' \
-                    f'Pass: {cur_pass}\n'
+    def _kill_all(self):
+        for worker in list(self.running):
+            worker.kill()
+            worker.waitForFinished(1000)
+        self.running.clear()
+        self._progress.clear()
 
-        except Exception as e:
-            self._log.error(f'Failed formatting with error: {e.with_traceback()}')
+    def _read_progress(self):
+        """ Reads the progress of the running commands. Returns whether any of them reported. """
+        updated = False
+        for worker, entry in list(self._progress.items()):
+            blocks = entry[0].feed(worker.readAllStandardOutput().data())
+            if blocks:
+                entry[1] = blocks[-1]
+                updated = True
+        return updated
+
+    def _emit_status(self, finished, total):
+        # The chunks run side by side, so their speeds add up, and the size is what's written so far
+        reports = [(latest, last) for _, latest, last in self._progress.values() if latest is not None]
+        fps = [i['fps'] for i, _ in reports if i['fps'] is not None]
+        speeds = [i['speed'] for i, _ in reports if i['speed'] is not None]
+        size = self._done_size + sum(i['total_size'] or 0 for i, last in reports if last)
+        items = dict(frame=None, fps=sum(fps) if fps else None, bitrate=None, total_size=size or None,
+                     out_time=None, speed=sum(speeds) if speeds else None, finished=finished == total,
+                     percent=int(finished / total * 100), **{'pass': 1, 'passes': 1})
+        self.progress.emit(items)
+
+        output = color_text(f'\nWorking...\n', 'white')
+        output += f'Target name: {self.name}\n' \
+            f'Target bitrate: {self.bitrate + "b" if self.bitrate is not None else "Nan"}\n' \
+            f'Chunks: {len(self.running)} running on {self.threads} threads each\n' \
+            f'Progress: {items["percent"]}% ({finished} of {total} tasks)\n'
+        if items['fps'] is not None and items['speed'] is not None:
+            output += f'Speed: {items["fps"]:.1f} fps ({items["speed"]:.2f}x)\n'
+        if items['total_size'] is not None:
+            output += f'Size: {items["total_size"] / 1024 ** 2:.2f} MB\n'
+        self.process_output.emit(output.replace('\n', '<br>'))
+
+    def _work_dir(self):
+        if self.resume_dir is None:
+            return tempfile.mkdtemp(prefix='webber_chunks_'), None
+
+        key = work_key(self.file_name, self.template, self.audio)
+        prune_work_dirs(self.resume_dir, keep=key)
+        work_dir = os.path.abspath(os.path.join(self.resume_dir, key))
+        os.makedirs(work_dir, exist_ok=True)
+        return work_dir, key
+
+    def run(self):
+        start_time = time.time()
+        work_dir, key = None, None
+        code = 1
+        try:
+            work_dir, key = self._work_dir()
+            code = self._run(work_dir, key)
+        except Exception:
             traceback.print_exc()
+            self._kill_all()
+        finally:
+            if work_dir is None:
+                pass
+            elif key is None or code == 0:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            else:
+                self._log.info(f'Keeping finished chunks in {work_dir}, to resume the job later.')
 
-        else:
-            self.process_output.emit(output.replace('\n', '<br>'))
+        self._log.info(f'Chunked conversion ended with code {code}. '
+                       f'Process was active for {time.time() - start_time} seconds.')
+        self.current = None
+        self.done.emit(code)
+
+    def _plan(self, work_dir, key):
+        """ Returns the manifest of the job, reusing the one in work_dir so the chunks stay the same. """
+        manifest = load_manifest(work_dir, key) if key is not None else None
+        if manifest is not None:
+            # Chunks listed as done, but lost since, are encoded again
+            manifest['done'] = [idx for idx in manifest['done']
+                                if os.path.isfile(self._task_output(work_dir, idx))]
+            self._log.info(f'Resuming, {len(manifest["done"])} finished tasks found in {work_dir}')
+            # The rest of the chunks are encoded at the rate of the finished ones
+            self.template = [list(command) for command in self.template]
+            for command in self.template:
+                for option, value in manifest.get('rates', {}).items():
+                    if get_option(command, option) is not None:
+                        set_option(command, option, value)
+            self.bitrate = get_option(self.template[-1], '-b:v')
+            return manifest
+
+        first = self.template[0]
+        start = parse_timestamp(get_option(first, '-ss', 0))
+        end = get_option(first, '-to')
+        end = parse_timestamp(end) if end is not None else start + self.dur
+
+        count = self.workers * 2
+        if key is not None:
+            # Short chunks limit how much work is lost on an interruption
+            count = max(count, int((end - start) // RESUME_CHUNK_LENGTH) + 1)
+        keyframes = find_keyframes(self.file_name, start, end)
+        rates = {option: get_option(self.template[-1], option) for option in RATE_OPTIONS
+                 if get_option(self.template[-1], option) is not None}
+        manifest = dict(key=key, start=start, end=end, chunks=plan_chunks(start, end, keyframes, count), done=[],
+                        rates=rates)
+        if key is not None:
+            save_manifest(work_dir, manifest)
+        return manifest
+
+    def _output_size(self, work_dir, idx):
+        try:
+            return os.path.getsize(self._task_output(work_dir, idx))
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _task_output(work_dir, idx):
+        if idx == 'audio':
+            return os.path.join(work_dir, 'audio.webm')
+        return os.path.join(work_dir, f'chunk_{idx:04d}.webm')
+
+    def _run(self, work_dir, key):
+        manifest = self._plan(work_dir, key)
+        start, end, chunks = manifest['start'], manifest['end'], manifest['chunks']
+        self._log.info(f'Split {start:.3f}-{end:.3f} into {len(chunks)} chunks, '
+                       f'running {self.workers} at a time.')
+
+        # Sources without sound get no audio task, its encode would fail on the missing stream
+        sound = bool(self.audio) and self._has_audio()
+        if self.audio and not sound:
+            self._log.info('No audio stream in the source, joining the chunks without sound')
+
+        # Every task is a chain of commands that has to run in order
+        tasks = []
+        if sound:
+            tasks.append(('audio', deque([self._audio_command(work_dir, start, end)])))
+        for idx, (chunk_start, chunk_end) in enumerate(chunks):
+            tasks.append((idx, deque(self._chunk_commands(work_dir, idx, chunk_start, chunk_end))))
+
+        pending = deque(task for task in tasks if task[0] not in manifest['done'])
+        self._done_size = sum(self._output_size(work_dir, idx) for idx, _ in tasks if idx in manifest['done'])
+        total = sum(len(chain) for _, chain in tasks)
+        finished = total - sum(len(chain) for _, chain in pending)
+        self._emit_status(finished, total)
+
+        while pending or self.running:
+            while pending and len(self.running) < self.workers:
+                idx, chain = pending.popleft()
+                command = chain.popleft()
+                self.running[self._start(work_dir, idx, command, not chain)] = (idx, chain)
+
+            for worker in list(self.running):
+                if self.abort:
+                    self._kill_all()
+                    self._log.info('Process terminated by user...')
+                    return 123
+
+                if worker.state() != QProcess.NotRunning and not worker.waitForFinished(100):
+                    continue
+
+                self._read_progress()
+                self._progress.pop(worker, None)
+                idx, chain = self.running.pop(worker)
+                if worker.exitStatus() != QProcess.NormalExit or worker.exitCode():
+                    self._log.error(f'Chunk {idx} failed with code {worker.exitCode()}, '
+                                    f'see {os.path.join(work_dir, f"chunk_{idx}.log")}')
+                    self._kill_all()
+                    return worker.exitCode() or 1
+
+                finished += 1
+                if chain:
+                    command = chain.popleft()
+                    self.running[self._start(work_dir, idx, command, not chain)] = (idx, chain)
+                else:
+                    self._done_size += self._output_size(work_dir, idx)
+                    if key is not None:
+                        sync_file(self._task_output(work_dir, idx))
+                        manifest['done'].append(idx)
+                        save_manifest(work_dir, manifest)
+                self._emit_status(finished, total)
+
+            if self._read_progress():
+                self._emit_status(finished, total)
+
+        chunk_files = [self._task_output(work_dir, idx) for idx in range(len(chunks))]
+        self.current = concat = self._concat_command(work_dir, chunk_files, sound)
+        worker = QProcess()
+        worker.setProcessChannelMode(QProcess.MergedChannels)
+        worker.start('ffmpeg', concat)
+        worker.waitForStarted()
+        self.running[worker] = ('join', deque())
+        while worker.state() != QProcess.NotRunning and not worker.waitForFinished(100):
+            if self.abort:
+                self._kill_all()
+                self._log.info('Process terminated by user while joining...')
+                return 123
+        self.running.pop(worker, None)
+        if worker.exitStatus() != QProcess.NormalExit:
+            return 1
+        if worker.exitCode():
+            self._log.error(worker.readAll().data().decode('utf-8', 'replace'))
+        return worker.exitCode()
+
+    def get_pids(self):
+        # Called from the GUI thread while the workers change, so a copy is iterated
+        return [worker.processId() for worker in list(self.running) if worker.processId()]
+
+    def get_pid(self):
+        pids = self.get_pids()
+        return pids[0] if pids else None